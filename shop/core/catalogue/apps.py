@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class CatalogueConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core.catalogue"
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        from core.catalogue import attribute_schema, category_tree  # noqa: F401
+        from core.catalogue.documents import connect_receivers, documents_enabled
+        from core.catalogue.search import get_search_backend
+
+        # Backends keeping state connect their signal receivers on creation,
+        # every process must track writes
+        get_search_backend()
+
+        if documents_enabled():
+            connect_receivers()
@@ -0,0 +1,185 @@
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Iterable, Optional
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.utils.translation import gettext_lazy as _
+
+# The model module rather than the package, which imports the models that
+# use the schemas
+from core.catalogue.models.product_attribute import ProductAttribute
+from core.catalogue.signals import bulk_changed
+from core.catalogue.versions import get_version, is_stale, next_version
+
+__all__ = [
+    "AttributeField",
+    "AttributeSchema",
+    "get_attribute_schema",
+    "get_attribute_schemas",
+    "invalidate_attribute_schemas",
+]
+
+VERSION_KEY = "catalogue:attribute_schema:version"
+
+
+class AttributeField:
+    """
+    An attribute with its validator and coercer looked up once.
+    """
+
+    __slots__ = ("attribute", "code", "type", "required", "validator", "coercer")
+
+    def __init__(self, attribute: ProductAttribute):
+        self.attribute = attribute
+        self.code = attribute.code
+        self.type = attribute.type
+        self.required = attribute.required
+        self.validator: Callable = getattr(attribute, f"_validate_{attribute.type}")
+        self.coercer: Optional[Callable] = getattr(
+            attribute, f"_coerce_{attribute.type}", None
+        )
+
+    def clean(self, value, coerce=False):
+        """
+        Returns the value, coerced from text first if asked to, or raises
+        ValidationError.
+        """
+        if coerce and self.coercer is not None and isinstance(value, str):
+            try:
+                value = self.coercer(value)
+            except ValueError as ex:
+                raise ValidationError(
+                    _("Invalid %(type)s value"), params={"type": self.type}
+                ) from ex
+        self.validator(value)
+        return value
+
+
+class AttributeSchema:
+    """
+    The attributes of a product type by code, including the attributes bound
+    to no type unless the type has one with the same code. Shared between
+    threads, the attributes must not be modified.
+    """
+
+    def __init__(self, product_type_id, attributes: Iterable[ProductAttribute]):
+        self.product_type_id = product_type_id
+        self.fields: dict[str, AttributeField] = {}
+        # Typeless attributes first, so typed ones with the same code win
+        for attribute in sorted(
+            attributes, key=lambda attribute: attribute.product_type_id is not None
+        ):
+            self.fields[attribute.code] = AttributeField(attribute)
+        self.required = tuple(
+            code for code, field in self.fields.items() if field.required
+        )
+        self.has_own_attributes = any(
+            field.attribute.product_type_id is not None
+            for field in self.fields.values()
+        )
+
+    def __contains__(self, code):
+        return code in self.fields
+
+    def __len__(self):
+        return len(self.fields)
+
+    def get(self, code) -> Optional[AttributeField]:
+        return self.fields.get(code)
+
+    def clean(self, values: dict, partial=False, coerce=False) -> list:
+        """
+        Validates attribute values given by code in one pass and returns them
+        as (attribute, value) pairs, ready for ProductAttributeValue.save_values.
+        A None or empty value stands for removing the value.
+
+        Required attributes must not be removed, and must all be given unless
+        `partial`. With `coerce`, values written as text are converted to the
+        attribute's type first. Raises ValidationError keyed by code.
+        """
+        cleaned, errors = [], {}
+        for code, value in values.items():
+            field = self.fields.get(code)
+            if field is None:
+                errors[code] = [_("Unknown attribute")]
+            elif value is None or value == "":
+                if field.required:
+                    errors[code] = [_("This attribute is required")]
+                else:
+                    cleaned.append((field.attribute, value))
+            else:
+                try:
+                    cleaned.append((field.attribute, field.clean(value, coerce)))
+                except ValidationError as ex:
+                    errors[code] = ex.messages
+        if not partial:
+            for code in self.required:
+                if code not in values:
+                    errors[code] = [_("This attribute is required")]
+        if errors:
+            raise ValidationError(errors)
+        return cleaned
+
+
+# The schemas of this process, dropped together when stale
+_current = SimpleNamespace(schemas={}, version=None, built_at=0.0)
+_lock = threading.Lock()
+
+
+def get_attribute_schemas(product_type_ids: Iterable) -> dict:
+    """
+    Returns the {product type id: AttributeSchema} of the given types. Schemas
+    are kept in process memory until an attribute changes in any process, or
+    for CATALOGUE_LOCAL_CACHE_TIMEOUT seconds, missing ones are built with
+    one query for all types.
+    """
+    product_type_ids = set(product_type_ids)
+    version = get_version(VERSION_KEY)
+    with _lock:
+        if is_stale(_current.version, _current.built_at, version):
+            _current.schemas, _current.version = {}, version
+            _current.built_at = time.monotonic()
+        schemas = _current.schemas
+        missing = product_type_ids.difference(schemas)
+        if missing:
+            attributes = list(
+                ProductAttribute.objects.filter(
+                    Q(product_type__in=missing) | Q(product_type__isnull=True)
+                )
+            )
+            for type_id in missing:
+                schemas[type_id] = AttributeSchema(
+                    type_id,
+                    (
+                        attribute
+                        for attribute in attributes
+                        if attribute.product_type_id in (None, type_id)
+                    ),
+                )
+        return {type_id: schemas[type_id] for type_id in product_type_ids}
+
+
+def get_attribute_schema(product_type_id) -> AttributeSchema:
+    return get_attribute_schemas([product_type_id])[product_type_id]
+
+
+def invalidate_attribute_schemas():
+    """
+    Makes every process rebuild its attribute schemas on next use.
+    """
+    next_version(VERSION_KEY)
+
+
+def invalidate_on_commit(**_kwargs):
+    # A schema rebuilt before the commit would hold the old attributes
+    transaction.on_commit(invalidate_attribute_schemas)
+
+
+post_save.connect(invalidate_on_commit, sender=ProductAttribute)
+post_delete.connect(invalidate_on_commit, sender=ProductAttribute)
+bulk_changed.connect(invalidate_on_commit, sender=ProductAttribute)
+post_delete.connect(invalidate_on_commit, sender="catalogue.ProductType")
@@ -0,0 +1,153 @@
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from core.catalogue.models import Category
+from core.catalogue.signals import bulk_changed
+from core.catalogue.versions import get_version, is_stale, next_version
+
+__all__ = ["CategoryTree", "get_category_tree", "invalidate_category_tree"]
+
+VERSION_KEY = "catalogue:category_tree:version"
+
+
+# One attribute per lookup table of the snapshot
+class CategoryTree:  # pylint: disable=too-many-instance-attributes
+    """
+    A read-only snapshot of every category, built from one scan ordered by
+    path. Categories are kept in that order, so the descendants of the
+    category at index i are exactly the ones at i + 1 ... ends[i] - 1, and
+    parents, children, ancestors and descendants are looked up without
+    queries. The Category instances are shared between threads and must not
+    be modified.
+    """
+
+    def __init__(self, categories, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.categories = list(categories)
+        self.index = {category.pk: i for i, category in enumerate(self.categories)}
+        self.by_full_slug = {
+            category.full_slug: category for category in self.categories
+        }
+        self.parents: list[Optional[int]] = [None] * len(self.categories)
+        self.children: list[list[int]] = [[] for _ in self.categories]
+        self.ends = [len(self.categories)] * len(self.categories)
+        self.roots = []
+
+        # Ancestors of the current category, closed when a path leaves them
+        open_indexes = []
+        for i, category in enumerate(self.categories):
+            while open_indexes and not category.path.startswith(
+                self.categories[open_indexes[-1]].path
+            ):
+                self.ends[open_indexes.pop()] = i
+            if open_indexes:
+                parent = open_indexes[-1]
+                self.parents[i] = parent
+                self.children[parent].append(i)
+                # Spares treebeard's get_parent a query
+                category._cached_parent_obj = self.categories[parent]
+            else:
+                self.roots.append(i)
+            open_indexes.append(i)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def get(self, category_id) -> Optional[Category]:
+        i = self.index.get(category_id)
+        return None if i is None else self.categories[i]
+
+    def get_by_full_slug(self, full_slug: str) -> Optional[Category]:
+        return self.by_full_slug.get(full_slug)
+
+    def get_roots(self) -> list[Category]:
+        return [self.categories[i] for i in self.roots]
+
+    def get_parent(self, category_id) -> Optional[Category]:
+        parent = self.parents[self.index[category_id]]
+        return None if parent is None else self.categories[parent]
+
+    def get_children(self, category_id) -> list[Category]:
+        return [self.categories[i] for i in self.children[self.index[category_id]]]
+
+    def has_children(self, category_id) -> bool:
+        return bool(self.children[self.index[category_id]])
+
+    def get_num_children(self, category_id) -> int:
+        return len(self.children[self.index[category_id]])
+
+    def get_ancestors(self, category_id, include_self=False) -> list[Category]:
+        """
+        Returns the ancestors of a category, the root first.
+        """
+        i = self.index[category_id]
+        ancestors = [self.categories[i]] if include_self else []
+        parent = self.parents[i]
+        while parent is not None:
+            ancestors.append(self.categories[parent])
+            parent = self.parents[parent]
+        ancestors.reverse()
+        return ancestors
+
+    def get_descendants(self, category_id, include_self=False) -> list[Category]:
+        """
+        Returns the descendants of a category in path order.
+        """
+        i = self.index[category_id]
+        return self.categories[i if include_self else i + 1 : self.ends[i]]
+
+    def get_descendant_ids(self, category_id, include_self=False) -> list:
+        return [
+            category.pk for category in self.get_descendants(category_id, include_self)
+        ]
+
+
+# The tree of this process, replaced whole under the lock
+_current = SimpleNamespace(tree=None)
+_lock = threading.Lock()
+
+
+def _is_current(tree: Optional[CategoryTree], version) -> bool:
+    return tree is not None and not is_stale(tree.version, tree.built_at, version)
+
+
+def get_category_tree() -> CategoryTree:
+    """
+    Returns the process-local category tree, rebuilt when the version shared
+    through the default cache changed, i.e. a category changed in a process
+    sharing the cache, and at least every CATALOGUE_LOCAL_CACHE_TIMEOUT
+    seconds. Costs one cache lookup and no queries while the tree is current.
+    """
+    version = get_version(VERSION_KEY)
+    tree = _current.tree
+    if not _is_current(tree, version):
+        with _lock:
+            tree = _current.tree
+            if not _is_current(tree, version):
+                tree = CategoryTree(Category.objects.order_by("path"), version)
+                _current.tree = tree
+    return tree
+
+
+def invalidate_category_tree():
+    """
+    Makes every process sharing the cache rebuild its category tree on next
+    use.
+    """
+    next_version(VERSION_KEY)
+
+
+def invalidate_on_commit(**_kwargs):
+    # A tree rebuilt before the commit would hold the old categories
+    transaction.on_commit(invalidate_category_tree)
+
+
+post_save.connect(invalidate_on_commit, sender=Category)
+post_delete.connect(invalidate_on_commit, sender=Category)
+bulk_changed.connect(invalidate_on_commit, sender=Category)
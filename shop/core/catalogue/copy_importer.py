@@ -0,0 +1,279 @@
+import io
+from uuid import uuid4
+
+from django.db import NotSupportedError, connection, transaction
+
+from core.catalogue.importer import CatalogueImporter, RowError
+from core.catalogue.models import (
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+)
+from core.catalogue.signals import bulk_changed
+
+__all__ = ["CopyCatalogueImporter"]
+
+VALUE_COLUMNS = [f"value_{type_}" for type_, _ in ProductAttribute.TYPE_CHOICES]
+
+
+def to_copy_text(value):
+    """
+    Encodes a value as a field of COPY's text format.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyCatalogueImporter(CatalogueImporter):
+    """
+    PostgreSQL fast path of CatalogueImporter for initial loads and full
+    refreshes.
+
+    Chunks are streamed with COPY FROM STDIN into unlogged staging tables and
+    merged into the catalogue tables once all input is read, with a handful
+    of set based statements (INSERT ... ON CONFLICT) in one transaction.
+    Every product column comes from the feed, new and existing products alike.
+    """
+
+    def __init__(self, chunk_size=10000):
+        if connection.vendor != "postgresql":
+            raise NotSupportedError("COPY import requires PostgreSQL")
+        super().__init__(chunk_size=chunk_size)
+        suffix = uuid4().hex[:12]
+        self.staged_products = f"catalogue_import_product_{suffix}"
+        self.staged_values = f"catalogue_import_value_{suffix}"
+        self.staged_categories = f"catalogue_import_category_{suffix}"
+
+    def run(self, records, on_chunk=None):
+        self.create_staging_tables()
+        try:
+            super().run(records, on_chunk)
+        finally:
+            self.drop_staging_tables()
+
+    def create_staging_tables(self):
+        value_columns = ", ".join(
+            f"{column} "
+            f"{ProductAttributeValue._meta.get_field(column).db_type(connection)}"
+            for column in VALUE_COLUMNS
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE UNLOGGED TABLE {self.staged_products} ("
+                "line integer, upc text, name text, description text, "
+                "product_type_id bigint, contains_hazmat boolean, "
+                "is_discountable boolean, parent_upc text, set_categories boolean)"
+            )
+            cursor.execute(
+                f"CREATE UNLOGGED TABLE {self.staged_values} ("
+                "line integer, upc text, attribute_id bigint, is_delete boolean, "
+                f"{value_columns})"
+            )
+            cursor.execute(
+                f"CREATE UNLOGGED TABLE {self.staged_categories} ("
+                "line integer, upc text, category_id bigint)"
+            )
+
+    def drop_staging_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DROP TABLE IF EXISTS {self.staged_products}, "
+                f"{self.staged_values}, {self.staged_categories}"
+            )
+
+    @staticmethod
+    def copy(cursor, table, columns, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(map(to_copy_text, row)))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+    def prepare(self, line, record):
+        row = super().prepare(line, record)
+        if not row.fields.get("name"):
+            raise RowError(line, "name is required")
+        return row
+
+    def import_chunk(self, rows):
+        defaults = {
+            column: Product._meta.get_field(column).default
+            for column in ("contains_hazmat", "is_discountable")
+        }
+        with connection.cursor() as cursor:
+            self.copy(
+                cursor,
+                self.staged_products,
+                (
+                    "line",
+                    "upc",
+                    "name",
+                    "description",
+                    "product_type_id",
+                    "contains_hazmat",
+                    "is_discountable",
+                    "parent_upc",
+                    "set_categories",
+                ),
+                (
+                    (
+                        row.line,
+                        row.upc,
+                        row.fields["name"],
+                        row.fields.get("description"),
+                        row.fields["product_type_id"],
+                        row.fields.get("contains_hazmat", defaults["contains_hazmat"]),
+                        row.fields.get("is_discountable", defaults["is_discountable"]),
+                        row.parent_upc,
+                        row.category_ids is not None,
+                    )
+                    for row in rows.values()
+                ),
+            )
+            self.copy(
+                cursor,
+                self.staged_values,
+                ("line", "upc", "attribute_id", "is_delete", *VALUE_COLUMNS),
+                (
+                    (
+                        row.line,
+                        row.upc,
+                        attribute.pk,
+                        value is None or value == "",
+                        *(
+                            value if column == f"value_{attribute.type}" else None
+                            for column in VALUE_COLUMNS
+                        ),
+                    )
+                    for row in rows.values()
+                    for attribute, value in row.values
+                ),
+            )
+            self.copy(
+                cursor,
+                self.staged_categories,
+                ("line", "upc", "category_id"),
+                (
+                    (row.line, row.upc, category_id)
+                    for row in rows.values()
+                    for category_id in row.category_ids or ()
+                ),
+            )
+
+    def drop_superseded(self, cursor):
+        # A later record for the same upc wins, as in CatalogueImporter
+        staged_products = self.staged_products
+        cursor.execute(f"CREATE INDEX ON {staged_products} (upc, line)")
+        cursor.execute(f"ANALYZE {staged_products}")
+        cursor.execute(
+            f"DELETE FROM {staged_products} a USING {staged_products} b "
+            "WHERE a.upc = b.upc AND a.line < b.line"
+        )
+        for staged in (self.staged_values, self.staged_categories):
+            cursor.execute(
+                f"DELETE FROM {staged} s WHERE NOT EXISTS ("
+                f"SELECT 1 FROM {staged_products} p "
+                "WHERE p.upc = s.upc AND p.line = s.line)"
+            )
+
+    def skip_unknown_parents(self, cursor):
+        cursor.execute(
+            f"SELECT line, parent_upc FROM {self.staged_products} s "
+            "WHERE parent_upc <> '' AND NOT EXISTS ("
+            f"SELECT 1 FROM {Product._meta.db_table} p "
+            "WHERE p.upc = s.parent_upc) "
+            "ORDER BY line"
+        )
+        for line, parent_upc in cursor.fetchall():
+            self.skip(RowError(line, f"unknown parent {parent_upc}"))
+
+    def finish(self):
+        products = Product._meta.db_table
+        values = ProductAttributeValue._meta.db_table
+        categories = ProductCategory._meta.db_table
+        staged_products = self.staged_products
+        staged_values = self.staged_values
+        staged_categories = self.staged_categories
+        value_updates = ", ".join(
+            f"{column} = EXCLUDED.{column}" for column in VALUE_COLUMNS
+        )
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.drop_superseded(cursor)
+
+            cursor.execute(
+                f"SELECT count(*), count(p.id) FROM {staged_products} s "
+                f"LEFT JOIN {products} p ON p.upc = s.upc"
+            )
+            total, existing = cursor.fetchone()
+            self.created += total - existing
+            self.updated += existing
+
+            cursor.execute(
+                f"INSERT INTO {products} (upc, name, description, product_type_id, "
+                "contains_hazmat, is_discountable) "
+                "SELECT upc, name, description, product_type_id, contains_hazmat, "
+                f"is_discountable FROM {staged_products} "
+                "ON CONFLICT (upc) DO UPDATE SET name = EXCLUDED.name, "
+                "description = EXCLUDED.description, "
+                "product_type_id = EXCLUDED.product_type_id, "
+                "contains_hazmat = EXCLUDED.contains_hazmat, "
+                "is_discountable = EXCLUDED.is_discountable "
+                "RETURNING id"
+            )
+            product_ids = [product_id for (product_id,) in cursor.fetchall()]
+
+            self.skip_unknown_parents(cursor)
+            cursor.execute(
+                f"UPDATE {products} p SET parent_id = parent.id "
+                f"FROM {staged_products} s "
+                f"LEFT JOIN {products} parent ON parent.upc = s.parent_upc "
+                "WHERE p.upc = s.upc AND s.parent_upc IS NOT NULL "
+                "AND (s.parent_upc = '' OR parent.id IS NOT NULL) "
+                "AND p.parent_id IS DISTINCT FROM parent.id"
+            )
+
+            cursor.execute(
+                f"DELETE FROM {values} v USING {staged_values} s, {products} p "
+                "WHERE s.is_delete AND p.upc = s.upc "
+                "AND v.product_id = p.id AND v.attribute_id = s.attribute_id"
+            )
+            cursor.execute(
+                f"INSERT INTO {values} (product_id, attribute_id, "
+                f"{', '.join(VALUE_COLUMNS)}) "
+                f"SELECT p.id, s.attribute_id, {', '.join(VALUE_COLUMNS)} "
+                f"FROM {staged_values} s JOIN {products} p ON p.upc = s.upc "
+                "WHERE NOT s.is_delete "
+                f"ON CONFLICT (attribute_id, product_id) DO UPDATE SET {value_updates}"
+            )
+
+            cursor.execute(
+                f"DELETE FROM {categories} pc USING {staged_products} s, {products} p "
+                "WHERE s.set_categories AND p.upc = s.upc AND pc.product_id = p.id "
+                f"AND NOT EXISTS (SELECT 1 FROM {staged_categories} c "
+                "WHERE c.upc = s.upc AND c.category_id = pc.category_id)"
+            )
+            cursor.execute(
+                f"INSERT INTO {categories} (product_id, category_id) "
+                f"SELECT DISTINCT p.id, c.category_id FROM {staged_categories} c "
+                f"JOIN {products} p ON p.upc = c.upc "
+                "ON CONFLICT (product_id, category_id) DO NOTHING"
+            )
+
+            for model in (Product, ProductAttributeValue, ProductCategory):
+                transaction.on_commit(
+                    lambda model=model: bulk_changed.send(
+                        sender=model, product_ids=product_ids
+                    )
+                )
@@ -0,0 +1,231 @@
+import threading
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.db.models.signals import post_delete, post_save
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.catalogue.category_tree import get_category_tree
+from core.catalogue.models import (
+    Category,
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductDocument,
+    ProductType,
+)
+from core.catalogue.signals import bulk_changed
+
+__all__ = [
+    "documents_enabled",
+    "build_document",
+    "product_from_document",
+    "refresh_documents",
+]
+
+
+def documents_enabled() -> bool:
+    return getattr(settings, "CATALOGUE_PRODUCT_DOCUMENTS", False)
+
+
+def build_document(product: Product, tree=None) -> dict:
+    """
+    Returns the document of a product fetched with its product type,
+    attribute values with their attributes and category links.
+    """
+    tree = tree or get_category_tree()
+    product_type = product.product_type
+    categories = (
+        tree.get(link.category_id) for link in product.productcategory_set.all()
+    )
+    return {
+        "id": product.pk,
+        "upc": product.upc,
+        "name": product.name,
+        "description": product.description,
+        "image": product.image.name or None,
+        "contains_hazmat": product.contains_hazmat,
+        "is_discountable": product.is_discountable,
+        "rating": product.rating,
+        "parent_id": product.parent_id,
+        "product_type": {
+            "id": product_type.pk,
+            "name": product_type.name,
+            "slug": product_type.slug,
+            "requires_shipping": product_type.requires_shipping,
+            "track_stock": product_type.track_stock,
+        },
+        "attributes": {
+            value.attribute.code: {
+                "id": value.attribute_id,
+                "name": value.attribute.name,
+                "type": value.attribute.type,
+                "value": value.value,
+            }
+            for value in product.attribute_values.all()
+        },
+        "categories": [
+            {"id": category.pk, "full_slug": category.full_slug}
+            for category in categories
+            if category is not None
+        ],
+    }
+
+
+def _set_prefetched(instance, accessor, objects):
+    queryset = getattr(instance, accessor).all()
+    # Filled in as prefetch_related_objects does
+    # pylint: disable=protected-access
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache[accessor] = queryset
+
+
+# Dates went through JSON as text, written by DjangoJSONEncoder
+DOCUMENT_VALUE_PARSERS = {
+    ProductAttribute.DATE: parse_date,
+    ProductAttribute.DATETIME: parse_datetime,
+}
+
+
+def product_from_document(data: dict) -> Product:
+    """
+    Builds a product from its document, with the product type, attribute
+    values and category links already fetched, as select_related and
+    prefetch_related would, so reading them costs no queries.
+    """
+    product_type = ProductType(**data["product_type"])
+    product = Product(
+        id=data["id"],
+        upc=data["upc"],
+        name=data["name"],
+        description=data["description"],
+        image=data["image"],
+        contains_hazmat=data["contains_hazmat"],
+        is_discountable=data["is_discountable"],
+        rating=data["rating"],
+        parent_id=data["parent_id"],
+        product_type=product_type,
+    )
+    product._state.adding = False  # pylint: disable=protected-access
+    product._prefetched_objects_cache = {}  # pylint: disable=protected-access
+
+    values = []
+    for code, item in data["attributes"].items():
+        attribute = ProductAttribute(
+            id=item["id"], code=code, name=item["name"], type=item["type"]
+        )
+        value = ProductAttributeValue(product=product, attribute=attribute)
+        parser = DOCUMENT_VALUE_PARSERS.get(attribute.type)
+        value.value = (
+            parser(item["value"])
+            if parser is not None and isinstance(item["value"], str)
+            else item["value"]
+        )
+        values.append(value)
+    _set_prefetched(product, "attribute_values", values)
+    _set_prefetched(
+        product,
+        "productcategory_set",
+        [
+            ProductCategory(product=product, category_id=category["id"])
+            for category in data["categories"]
+        ],
+    )
+    return product
+
+
+def refresh_documents(products=None, chunk_size=1000) -> int:
+    """
+    Rewrites the documents of a product queryset, all products by default.
+    Products are read `chunk_size` at a time and each chunk costs a fixed
+    number of queries. Returns the number of documents written.
+    """
+    if products is None:
+        products = Product.objects.all()
+    tree = get_category_tree()
+    rows = products.select_related("product_type").order_by("pk").iterator(chunk_size)
+    count = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        prefetch_related_objects(
+            chunk, "attribute_values__attribute", "productcategory_set"
+        )
+        with transaction.atomic():
+            ProductDocument.objects.filter(product__in=chunk).delete()
+            ProductDocument.objects.bulk_create(
+                ProductDocument(product=product, data=build_document(product, tree))
+                for product in chunk
+            )
+        count += len(chunk)
+    return count
+
+
+# Ids of the products written by the current transaction of each thread
+_pending = threading.local()
+
+
+def refresh_pending():
+    product_ids = getattr(_pending, "product_ids", set())
+    _pending.product_ids = set()
+    if product_ids:
+        refresh_documents(Product.objects.filter(pk__in=product_ids))
+
+
+def refresh_product_on_commit(sender, instance, **_kwargs):
+    product_id = instance.pk if sender is Product else instance.product_id
+    if not hasattr(_pending, "product_ids"):
+        _pending.product_ids = set()
+    _pending.product_ids.add(product_id)
+    # A document built before the commit would hold the old rows. The first
+    # callback refreshes every product of the transaction, the others find
+    # nothing left, so a product and its values are refreshed once.
+    transaction.on_commit(refresh_pending)
+
+
+def refresh_bulk_changed(product_ids=None, **_kwargs):
+    # Sent on commit already
+    if product_ids is None:
+        refresh_documents()
+    else:
+        refresh_documents(Product.objects.filter(pk__in=product_ids))
+
+
+def refresh_category_on_commit(instance, **_kwargs):
+    # Full slugs of the whole subtree may have changed
+    transaction.on_commit(
+        lambda: refresh_documents(Product.objects.in_category_tree(instance))
+    )
+
+
+def refresh_categories_bulk_changed(**_kwargs):
+    refresh_documents(
+        Product.objects.filter(pk__in=ProductCategory.objects.values("product_id"))
+    )
+
+
+def refresh_product_type_on_commit(instance, **_kwargs):
+    transaction.on_commit(
+        lambda: refresh_documents(Product.objects.filter(product_type=instance.pk))
+    )
+
+
+def refresh_attribute_on_commit(instance, **_kwargs):
+    products = Product.objects.filter(attribute_values__attribute=instance.pk)
+    transaction.on_commit(lambda: refresh_documents(products.distinct()))
+
+
+def connect_receivers():
+    for model in (Product, ProductAttributeValue, ProductCategory):
+        post_save.connect(refresh_product_on_commit, sender=model)
+        post_delete.connect(refresh_product_on_commit, sender=model)
+        bulk_changed.connect(refresh_bulk_changed, sender=model)
+    post_save.connect(refresh_category_on_commit, sender=Category)
+    bulk_changed.connect(refresh_categories_bulk_changed, sender=Category)
+    post_save.connect(refresh_product_type_on_commit, sender=ProductType)
+    post_save.connect(refresh_attribute_on_commit, sender=ProductAttribute)
@@ -0,0 +1,113 @@
+import csv
+import json
+from itertools import islice
+
+from django.db.models import prefetch_related_objects
+
+from core.catalogue.importer import PRODUCT_COLUMNS
+from core.catalogue.models import Category, Product, ProductAttribute
+
+__all__ = ["CatalogueExporter", "to_jsonl", "to_csv"]
+
+
+class CatalogueExporter:
+    """
+    Yields every product as a record in the format read by CatalogueImporter.
+
+    Products are read through a server-side cursor, `chunk_size` rows at a
+    time, and attribute values and categories are prefetched per chunk, so
+    memory use does not depend on the catalogue size. Products without a
+    parent come first, so an export can be imported again as is.
+    """
+
+    def __init__(self, chunk_size=2000):
+        self.chunk_size = chunk_size
+        self.category_slugs = dict(Category.objects.values_list("pk", "full_slug"))
+
+    @staticmethod
+    def get_attribute_codes():
+        return sorted(set(ProductAttribute.objects.values_list("code", flat=True)))
+
+    def get_queryset(self):
+        return (
+            Product.objects.select_related("product_type", "parent")
+            .only(
+                "upc",
+                "name",
+                "description",
+                "contains_hazmat",
+                "is_discountable",
+                "product_type__slug",
+                "parent__upc",
+            )
+            .order_by("pk")
+        )
+
+    def records(self):
+        queryset = self.get_queryset()
+        for products in (
+            queryset.filter(parent__isnull=True),
+            queryset.filter(parent__isnull=False),
+        ):
+            rows = products.iterator(chunk_size=self.chunk_size)
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                prefetch_related_objects(
+                    chunk, "attribute_values__attribute", "productcategory_set"
+                )
+                for product in chunk:
+                    yield self.to_record(product)
+
+    def to_record(self, product):
+        return {
+            "upc": product.upc,
+            "name": product.name,
+            "description": product.description,
+            "product_type": product.product_type.slug,
+            "parent": product.parent.upc if product.parent_id else "",
+            "contains_hazmat": product.contains_hazmat,
+            "is_discountable": product.is_discountable,
+            "categories": [
+                self.category_slugs[link.category_id]
+                for link in product.productcategory_set.all()
+            ],
+            "attributes": {
+                value.attribute.code: value.value
+                for value in product.attribute_values.all()
+            },
+        }
+
+
+def to_jsonl(records):
+    for record in records:
+        yield json.dumps(record, default=str) + "\n"
+
+
+class _Echo:
+    @staticmethod
+    def write(value):
+        return value
+
+
+def to_csv(records, attribute_codes):
+    """
+    Yields CSV lines with one column per attribute code, categories are full
+    slugs separated by "|".
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow([*PRODUCT_COLUMNS, *attribute_codes])
+    for record in records:
+        attributes = record["attributes"]
+        yield writer.writerow(
+            [
+                *(
+                    "|".join(record[column])
+                    if column == "categories"
+                    else record[column]
+                    for column in PRODUCT_COLUMNS
+                ),
+                *(attributes.get(code) for code in attribute_codes),
+            ]
+        )
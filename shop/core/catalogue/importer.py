@@ -0,0 +1,331 @@
+import csv
+import json
+from itertools import islice
+from typing import NamedTuple, Optional
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from core.catalogue.attribute_schema import get_attribute_schemas
+from core.catalogue.models import (
+    Category,
+    Product,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductType,
+)
+from core.catalogue.signals import bulk_changed
+from core.common.utils import to_bool
+
+__all__ = ["RowError", "ProductRow", "read_csv", "read_jsonl", "CatalogueImporter"]
+
+# Columns mapping onto Product, any other CSV column is an attribute code
+PRODUCT_COLUMNS = (
+    "upc",
+    "name",
+    "description",
+    "product_type",
+    "parent",
+    "contains_hazmat",
+    "is_discountable",
+    "categories",
+)
+BOOLEAN_COLUMNS = ("contains_hazmat", "is_discountable")
+
+
+class RowError(Exception):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+class ProductRow(NamedTuple):
+    line: int
+    upc: str
+    fields: dict
+    # None leaves the parent as is, "" detaches the product from it
+    parent_upc: Optional[str]
+    values: list
+    # None leaves the categories as is
+    category_ids: Optional[set]
+
+
+def read_csv(stream):
+    """
+    Yields (line number, record) pairs from a CSV file with a header row.
+    Columns which are not product columns hold attribute values, categories
+    are full slugs separated by "|".
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        record = {key: value for key, value in row.items() if key in PRODUCT_COLUMNS}
+        if "categories" in record:
+            record["categories"] = [
+                slug for slug in record["categories"].split("|") if slug
+            ]
+        record["attributes"] = {
+            key: value for key, value in row.items() if key not in PRODUCT_COLUMNS
+        }
+        yield reader.line_num, record
+
+
+def read_jsonl(stream):
+    """
+    Yields (line number, record) pairs from a JSON lines file, one product per
+    line with the attribute values under "attributes" and a list of category
+    full slugs under "categories".
+    """
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as ex:
+            raise RowError(line, f"invalid JSON: {ex}") from ex
+        if not isinstance(record, dict):
+            raise RowError(line, "expected a JSON object")
+        yield line, record
+
+
+# The lookup maps and the counters of one run
+class CatalogueImporter:  # pylint: disable=too-many-instance-attributes
+    """
+    Upserts products by upc together with their attribute values.
+
+    Records are consumed in chunks of `chunk_size`, so memory use does not
+    depend on the input size. Product types (by slug), attributes (by code)
+    and categories (by full slug) are resolved from maps built once, and every
+    chunk costs a fixed number of queries inside its own transaction. Parents
+    which are not found, e.g. because they come in a later chunk, are linked
+    once all chunks are written. Invalid records are skipped, the first
+    `max_errors` of them collected in `errors`.
+    """
+
+    max_errors = 100
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.product_types = dict(ProductType.objects.values_list("slug", "pk"))
+        self.schemas = get_attribute_schemas(self.product_types.values())
+        self.categories = dict(Category.objects.values_list("full_slug", "pk"))
+        self.rows = self.created = self.updated = self.skipped = 0
+        self.errors = []
+        # product id -> (line, parent upc) of the parents not found yet
+        self.pending_parents = {}
+
+    def run(self, records, on_chunk=None):
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            rows = {}
+            for line, record in chunk:
+                self.rows += 1
+                try:
+                    row = self.prepare(line, record)
+                except RowError as ex:
+                    self.skip(ex)
+                    continue
+                # A later record for the same upc wins
+                rows[row.upc] = row
+            self.import_chunk(rows)
+            if on_chunk is not None:
+                on_chunk(self)
+        self.finish()
+
+    def prepare(self, line, record):
+        upc = str(record.get("upc") or "").strip()
+        if not upc:
+            raise RowError(line, "upc is required")
+        type_id = self.product_types.get(record.get("product_type"))
+        if type_id is None:
+            raise RowError(line, f"unknown product type {record.get('product_type')}")
+
+        fields = {"product_type_id": type_id}
+        for column in ("name", "description", *BOOLEAN_COLUMNS):
+            if column not in record:
+                continue
+            value = record[column]
+            if column in BOOLEAN_COLUMNS:
+                try:
+                    value = to_bool(value)
+                except ValueError as ex:
+                    raise RowError(line, f"{column}: {ex}") from ex
+            fields[column] = value
+        if not fields.get("name") and "name" in fields:
+            raise RowError(line, "name must not be empty")
+
+        schema = self.schemas[type_id]
+        try:
+            values = schema.clean(
+                {
+                    code: value
+                    for code, value in (record.get("attributes") or {}).items()
+                    # Skips CSV columns of attributes of other product types
+                    if code in schema or (value is not None and value != "")
+                },
+                partial=True,
+                coerce=True,
+            )
+        except ValidationError as ex:
+            raise RowError(
+                line,
+                "; ".join(
+                    f"{code}: {' '.join(messages)}"
+                    for code, messages in ex.message_dict.items()
+                ),
+            ) from ex
+        category_ids = None
+        if "categories" in record:
+            category_ids = set()
+            for full_slug in record["categories"] or []:
+                if full_slug not in self.categories:
+                    raise RowError(line, f"unknown category {full_slug}")
+                category_ids.add(self.categories[full_slug])
+
+        return ProductRow(
+            line=line,
+            upc=upc,
+            fields=fields,
+            parent_upc=(record["parent"] or "") if "parent" in record else None,
+            values=values,
+            category_ids=category_ids,
+        )
+
+    def import_chunk(self, rows):
+        with transaction.atomic():
+            products = self.write_products(rows)
+            self.link_parents(rows, products)
+            ProductAttributeValue.save_values(
+                (products[upc], attribute, value)
+                for upc, row in rows.items()
+                for attribute, value in row.values
+            )
+            self.link_categories(rows, products)
+            product_ids = [product.pk for product in products.values()]
+            transaction.on_commit(
+                lambda: bulk_changed.send(sender=Product, product_ids=product_ids)
+            )
+
+    def finish(self):
+        """
+        Called once all records went through import_chunk, links the products
+        to the parents which were not found in their chunk.
+        """
+        if not self.pending_parents:
+            return
+        parents = Product.objects.in_bulk(
+            list({parent_upc for _, parent_upc in self.pending_parents.values()}),
+            field_name="upc",
+        )
+        to_update = []
+        for product_id, (line, parent_upc) in self.pending_parents.items():
+            if parent_upc not in parents:
+                self.skip(RowError(line, f"unknown parent {parent_upc}"))
+                continue
+            to_update.append(Product(pk=product_id, parent_id=parents[parent_upc].pk))
+        self.pending_parents = {}
+        if not to_update:
+            return
+        with transaction.atomic():
+            Product.objects.bulk_update(to_update, ["parent"], self.chunk_size)
+            product_ids = [product.pk for product in to_update]
+            transaction.on_commit(
+                lambda: bulk_changed.send(sender=Product, product_ids=product_ids)
+            )
+
+    def write_products(self, rows):
+        products = Product.objects.in_bulk(list(rows), field_name="upc")
+        to_create, to_update, update_fields = [], [], set()
+        for upc, row in list(rows.items()):
+            product = products.get(upc)
+            if product is None:
+                if not row.fields.get("name"):
+                    self.skip(RowError(row.line, "name is required for new products"))
+                    del rows[upc]
+                    continue
+                to_create.append(Product(upc=upc, **row.fields))
+            else:
+                for name, value in row.fields.items():
+                    setattr(product, name, value)
+                update_fields.update(row.fields)
+                to_update.append(product)
+
+        if to_create:
+            Product.objects.bulk_create(to_create)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                to_create = Product.objects.filter(
+                    upc__in=[product.upc for product in to_create]
+                )
+            products.update((product.upc, product) for product in to_create)
+        if to_update:
+            Product.objects.bulk_update(to_update, sorted(update_fields))
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        return products
+
+    def link_parents(self, rows, products):
+        parent_upcs = {row.parent_upc for row in rows.values() if row.parent_upc}
+        parents = {upc: products[upc] for upc in parent_upcs if upc in products}
+        missing = parent_upcs.difference(parents)
+        if missing:
+            parents.update(Product.objects.in_bulk(list(missing), field_name="upc"))
+
+        to_update = []
+        for upc, row in rows.items():
+            if row.parent_upc is None:
+                continue
+            product = products[upc]
+            # A later record for the same upc wins
+            self.pending_parents.pop(product.pk, None)
+            parent_id = None
+            if row.parent_upc:
+                if row.parent_upc not in parents:
+                    self.pending_parents[product.pk] = (row.line, row.parent_upc)
+                    continue
+                parent_id = parents[row.parent_upc].pk
+            if product.parent_id != parent_id:
+                product.parent_id = parent_id
+                to_update.append(product)
+        if to_update:
+            Product.objects.bulk_update(to_update, ["parent"])
+
+    @staticmethod
+    def link_categories(rows, products):
+        wanted = {
+            (products[upc].pk, category_id)
+            for upc, row in rows.items()
+            if row.category_ids is not None
+            for category_id in row.category_ids
+        }
+        product_ids = [
+            products[upc].pk
+            for upc, row in rows.items()
+            if row.category_ids is not None
+        ]
+        if not product_ids:
+            return
+        existing = {
+            (product_id, category_id): pk
+            for pk, product_id, category_id in ProductCategory.objects.filter(
+                product__in=product_ids
+            ).values_list("pk", "product_id", "category_id")
+        }
+        stale = [pk for pair, pk in existing.items() if pair not in wanted]
+        if stale:
+            ProductCategory.objects.filter(pk__in=stale).delete()
+        ProductCategory.objects.bulk_create(
+            [
+                ProductCategory(product_id=product_id, category_id=category_id)
+                for product_id, category_id in wanted.difference(existing)
+            ]
+        )
+        transaction.on_commit(
+            lambda: bulk_changed.send(sender=ProductCategory, product_ids=product_ids)
+        )
+
+    def skip(self, error):
+        self.skipped += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from core.catalogue.exporter import CatalogueExporter, to_csv, to_jsonl
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports all products with their type, categories and attribute values "
+        "as CSV or JSON lines, in the format read by import_catalogue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default="-", help='Output file, "-" for standard output'
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Output format, guessed from the file extension by default",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of products fetched and prefetched at once",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        output_format = options["format"]
+        if output_format is None:
+            output_format = "csv" if path.endswith(".csv") else "jsonl"
+
+        exporter = CatalogueExporter(chunk_size=options["chunk_size"])
+        if output_format == "csv":
+            lines = to_csv(exporter.records(), exporter.get_attribute_codes())
+        else:
+            lines = to_jsonl(exporter.records())
+
+        if path == "-":
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        with open(path, "w", encoding="utf-8", newline="") as stream:
+            stream.writelines(lines)
@@ -0,0 +1,83 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from core.catalogue.copy_importer import CopyCatalogueImporter
+from core.catalogue.importer import CatalogueImporter, RowError, read_csv, read_jsonl
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports products with their attribute values from a CSV or JSON lines "
+        "file. Products are matched by upc, product types by slug and attributes "
+        "by code."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help='Input file, "-" reads standard input')
+        parser.add_argument(
+            "--format",
+            choices=sorted(READERS),
+            help="Input format, guessed from the file extension by default",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of records written per transaction",
+        )
+        parser.add_argument(
+            "--copy",
+            action="store_true",
+            help=(
+                "Stage records with PostgreSQL COPY and merge them with set based "
+                "statements at the end, for initial loads and full refreshes"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        input_format = options["format"]
+        if input_format is None:
+            input_format = "csv" if path.endswith(".csv") else "jsonl"
+
+        started = time.monotonic()
+
+        def report(importer):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{importer.rows} rows, {importer.rows / elapsed:.0f} rows/s"
+            )
+
+        importer_class = CopyCatalogueImporter if options["copy"] else CatalogueImporter
+        try:
+            importer = importer_class(chunk_size=options["chunk_size"])
+        except NotSupportedError as ex:
+            raise CommandError(str(ex)) from ex
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+        try:
+            importer.run(
+                READERS[input_format](stream),
+                on_chunk=report if options["verbosity"] > 1 else None,
+            )
+        except RowError as ex:
+            raise CommandError(str(ex)) from ex
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in importer.errors:
+            self.stderr.write(str(error))
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {importer.rows} rows in {elapsed:.1f}s "
+                f"({importer.rows / max(elapsed, 1e-9):.0f} rows/s): "
+                f"{importer.created} created, {importer.updated} updated, "
+                f"{importer.skipped} skipped"
+            )
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.catalogue.models import Category
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the stored full name and full slug of every category, "
+        "e.g. after changing the tree with raw SQL."
+    )
+
+    def handle(self, *args, **options):
+        updated = Category.rebuild_full_values()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} categories"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.catalogue.documents import refresh_documents
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites the denormalized document of every product, e.g. after "
+        "enabling CATALOGUE_PRODUCT_DOCUMENTS or changing data with raw SQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of products fetched and written at once",
+        )
+
+    def handle(self, *args, **options):
+        count = refresh_documents(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} product documents"))
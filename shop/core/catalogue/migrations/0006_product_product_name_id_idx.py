@@ -0,0 +1,17 @@
+# Generated by Django 4.0.5 on 2026-10-17 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalogue", "0005_alter_product_image_alter_product_parent"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["name", "id"], name="product_name_id_idx"),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.0.5 on 2026-10-17 09:12
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_full_values(apps, schema_editor):
+    """
+    Fills full_name and full_slug from the ancestors of each category.
+
+    Full slugs must be unique, so sibling slugs are deduplicated first: in
+    path order, the first sibling keeps its slug and each later one with
+    the same slug gets the lowest free suffix, e.g. "fiction_2", as
+    Category.save() would pick. Every rename is reported.
+    """
+    Category = apps.get_model("catalogue", "Category")
+    categories = list(Category.objects.order_by("path"))
+    slugs_by_parent = defaultdict(set)
+    for category in categories:
+        slugs_by_parent[category.path[:-4]].add(category.slug)
+
+    full_values, seen, renamed = {}, defaultdict(set), []
+    for category in categories:
+        parent_path = category.path[:-4]
+        slug = category.slug
+        if slug in seen[parent_path]:
+            next_num = 2
+            while f"{category.slug}_{next_num}" in slugs_by_parent[parent_path]:
+                next_num += 1
+            slug = f"{category.slug}_{next_num}"
+            slugs_by_parent[parent_path].add(slug)
+            renamed.append(f"{category.pk}: {category.slug!r} -> {slug!r}")
+        seen[parent_path].add(slug)
+
+        category.slug, category.full_name, category.full_slug = (
+            slug,
+            category.name,
+            slug,
+        )
+        if parent_path in full_values:
+            parent_name, parent_slug = full_values[parent_path]
+            category.full_name = f"{parent_name} > {category.name}"
+            category.full_slug = f"{parent_slug}/{slug}"
+        full_values[category.path] = category.full_name, category.full_slug
+    Category.objects.bulk_update(
+        categories, ["slug", "full_name", "full_slug"], batch_size=1000
+    )
+    if renamed:
+        print(f"\n  Renamed {len(renamed)} duplicate sibling slug(s) of categories:")
+        for line in renamed:
+            print(f"    {line}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalogue", "0006_product_product_name_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="full_name",
+            field=models.TextField(
+                default="", editable=False, verbose_name="Full name"
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="full_slug",
+            field=models.TextField(
+                default="", editable=False, verbose_name="Full slug"
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_full_values, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="category",
+            name="full_slug",
+            field=models.TextField(
+                editable=False, unique=True, verbose_name="Full slug"
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.0.5 on 2026-10-17 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalogue", "0007_category_full_name_full_slug"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="productattributevalue",
+            index=models.Index(
+                fields=["attribute", "value_text"], name="attr_value_text_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productattributevalue",
+            index=models.Index(
+                fields=["attribute", "value_integer"], name="attr_value_integer_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productattributevalue",
+            index=models.Index(
+                fields=["attribute", "value_boolean"], name="attr_value_boolean_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productattributevalue",
+            index=models.Index(
+                fields=["attribute", "value_float"], name="attr_value_float_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productattributevalue",
+            index=models.Index(
+                fields=["attribute", "value_date"], name="attr_value_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productattributevalue",
+            index=models.Index(
+                fields=["attribute", "value_datetime"], name="attr_value_datetime_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,140 @@
+# Generated by Django 4.0.5 on 2026-10-17 06:11
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The text search configuration must match core.catalogue.search.SEARCH_CONFIG
+CREATE_SEARCH_SQL = [
+    """
+    CREATE FUNCTION catalogue_product_search_vector(
+        product_id bigint, name text, upc text, description text
+    ) RETURNS tsvector LANGUAGE sql STABLE AS $$
+        SELECT setweight(to_tsvector('english', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(upc, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            || setweight(to_tsvector('english', coalesce((
+                SELECT string_agg(v.value_text, ' ')
+                FROM catalogue_productattributevalue v
+                JOIN catalogue_productattribute a ON a.id = v.attribute_id
+                WHERE v.product_id = $1 AND a.type = 'text'
+            ), '')), 'C')
+    $$
+    """,
+    """
+    CREATE FUNCTION catalogue_product_search_vector_update() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.search_vector := catalogue_product_search_vector(
+            NEW.id, NEW.name, NEW.upc, NEW.description
+        );
+        RETURN NEW;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER catalogue_product_search_vector
+    BEFORE INSERT OR UPDATE OF name, upc, description ON catalogue_product
+    FOR EACH ROW EXECUTE FUNCTION catalogue_product_search_vector_update()
+    """,
+    # Statement level, so bulk writes of attribute values update each
+    # product once
+    """
+    CREATE FUNCTION catalogue_product_search_vector_values_update()
+    RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE catalogue_product p
+        SET search_vector = catalogue_product_search_vector(
+            p.id, p.name, p.upc, p.description
+        )
+        WHERE p.id IN (SELECT product_id FROM changed_values);
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER catalogue_product_search_vector_values_insert
+    AFTER INSERT ON catalogue_productattributevalue
+    REFERENCING NEW TABLE AS changed_values
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION catalogue_product_search_vector_values_update()
+    """,
+    """
+    CREATE TRIGGER catalogue_product_search_vector_values_update
+    AFTER UPDATE ON catalogue_productattributevalue
+    REFERENCING NEW TABLE AS changed_values
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION catalogue_product_search_vector_values_update()
+    """,
+    """
+    CREATE TRIGGER catalogue_product_search_vector_values_delete
+    AFTER DELETE ON catalogue_productattributevalue
+    REFERENCING OLD TABLE AS changed_values
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION catalogue_product_search_vector_values_update()
+    """,
+    """
+    UPDATE catalogue_product
+    SET search_vector = catalogue_product_search_vector(id, name, upc, description)
+    """,
+    """
+    CREATE INDEX catalogue_product_search_vector_idx
+    ON catalogue_product USING gin (search_vector)
+    """,
+    """
+    CREATE INDEX catalogue_product_name_trgm_idx
+    ON catalogue_product USING gin (name gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX catalogue_product_upc_trgm_idx
+    ON catalogue_product USING gin (upc gin_trgm_ops)
+    """,
+]
+
+DROP_SEARCH_SQL = [
+    "DROP INDEX catalogue_product_upc_trgm_idx",
+    "DROP INDEX catalogue_product_name_trgm_idx",
+    "DROP INDEX catalogue_product_search_vector_idx",
+    "DROP TRIGGER catalogue_product_search_vector_values_delete "
+    "ON catalogue_productattributevalue",
+    "DROP TRIGGER catalogue_product_search_vector_values_update "
+    "ON catalogue_productattributevalue",
+    "DROP TRIGGER catalogue_product_search_vector_values_insert "
+    "ON catalogue_productattributevalue",
+    "DROP FUNCTION catalogue_product_search_vector_values_update()",
+    "DROP TRIGGER catalogue_product_search_vector ON catalogue_product",
+    "DROP FUNCTION catalogue_product_search_vector_update()",
+    "DROP FUNCTION catalogue_product_search_vector(bigint, text, text, text)",
+]
+
+
+def run_on_postgresql(statements):
+    def run(apps, schema_editor):
+        # Search is PostgreSQL only, other databases just get the column
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalogue", "0008_product_attribute_value_indexes"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(
+            run_on_postgresql(CREATE_SEARCH_SQL), run_on_postgresql(DROP_SEARCH_SQL)
+        ),
+    ]
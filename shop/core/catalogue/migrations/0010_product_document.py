@@ -0,0 +1,42 @@
+# Generated by Django 4.0.5 on 2026-10-17 06:17
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalogue", "0009_product_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductDocument",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="document",
+                        serialize=False,
+                        to="catalogue.product",
+                        verbose_name="Product",
+                    ),
+                ),
+                (
+                    "data",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        verbose_name="Data",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Product document",
+                "verbose_name_plural": "Product documents",
+            },
+        ),
+    ]
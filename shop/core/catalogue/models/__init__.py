@@ -2,3 +2,4 @@ from .product import *
 from .product_type import *
 from .product_attribute import *
 from .category import *
+from .product_document import *
@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
+from treebeard.exceptions import InvalidMoveToDescendant, PathOverflow
 from treebeard.mp_tree import MP_Node
 
+from core.catalogue.signals import bulk_changed
 from core.common.abstract import AbstractAuditableModelMixin
 
 __all__ = ["Category", "ProductCategory"]
@@ -22,8 +26,14 @@ class Category(MP_Node, AbstractAuditableModelMixin):
         _("Image"), upload_to="categories", blank=True, null=True, max_length=255
     )
     slug = models.SlugField(_("Slug"), max_length=255, db_index=True)
+    # Denormalized from the ancestors, see get_full_values. Unbounded, as
+    # they grow by up to 255 characters per level
+    full_name = models.TextField(_("Full name"), editable=False)
+    full_slug = models.TextField(_("Full slug"), editable=False, unique=True)
 
     _slug_separator = "/"
+    # Saves tried when concurrent writers generate the same sibling slug
+    slug_attempts = 5
     _full_name_separator = " > "
 
     class Meta:
@@ -33,33 +43,79 @@ class Category(MP_Node, AbstractAuditableModelMixin):
         verbose_name_plural = _("Categories")
 
     def __str__(self):
-        return self.full_name
+        # The full name is set on save
+        return self.full_name or self.name
 
-    @property
-    def full_name(self):
+    def get_full_values(self):
         """
-        Returns a string representation of the category and it's ancestors,
-        e.g. 'Books > Non-fiction > Essential programming'.
+        Returns the full name and full slug of the category, built from the
+        stored ones of its parent, e.g. 'Books > Non-fiction' and
+        'books/non-fiction'.
+        """
+        parent = self.get_parent()
+        return self._join_full_values(
+            None if parent is None else (parent.full_name, parent.full_slug),
+            self.name,
+            self.slug,
+        )
+
+    @classmethod
+    def _join_full_values(cls, parent_values, name, slug):
+        if parent_values is None:
+            return name, slug
+        parent_name, parent_slug = parent_values
+        return (
+            f"{parent_name}{cls._full_name_separator}{name}",
+            f"{parent_slug}{cls._slug_separator}{slug}",
+        )
 
-        It's rarely used in Oscar's codebase, but used to be stored as a
-        CharField and is hence kept for backwards compatibility. It's also
-        sufficiently useful to keep around.
+    @staticmethod
+    def _replace_prefix(field_name, old_prefix, new_prefix):
+        """
+        An expression replacing the first len(old_prefix) characters of a
+        column with new_prefix.
         """
-        names = [category.name for category in self.get_ancestors_and_self()]
-        return self._full_name_separator.join(names)
+        return Concat(
+            Value(new_prefix),
+            Substr(field_name, len(old_prefix) + 1),
+            output_field=models.CharField(),
+        )
 
-    @property
-    def full_slug(self):
+    def update_descendants(self, old_full_name, old_full_slug):
         """
-        Returns a string of this category's slug concatenated with the slugs
-        of it's ancestors, e.g. 'books/non-fiction/essential-programming'.
+        Replaces the old full name and full slug prefix of every descendant
+        with the current ones, in one UPDATE.
+        """
+        self.get_descendants().update(
+            full_name=self._replace_prefix("full_name", old_full_name, self.full_name),
+            full_slug=self._replace_prefix("full_slug", old_full_slug, self.full_slug),
+        )
 
-        Oscar used to store this as in the 'slug' model field, but this field
-        has been re-purposed to only store this category's slug and to not
-        include it's ancestors' slugs.
+    @classmethod
+    def rebuild_full_values(cls):
+        """
+        Recomputes the full name and full slug of every category from one
+        scan ordered by path, where parents come before their children, and
+        writes the ones which changed. Returns the number of updated rows.
         """
-        slugs = [category.slug for category in self.get_ancestors_and_self()]
-        return self._slug_separator.join(slugs)
+        full_values, changed = {}, []
+        for category in cls.objects.order_by("path").only(
+            "path", "name", "slug", "full_name", "full_slug"
+        ):
+            full_name, full_slug = cls._join_full_values(
+                full_values.get(category.path[: -cls.steplen]),
+                category.name,
+                category.slug,
+            )
+            full_values[category.path] = full_name, full_slug
+            if (category.full_name, category.full_slug) != (full_name, full_slug):
+                category.full_name, category.full_slug = full_name, full_slug
+                changed.append(category)
+        with transaction.atomic():
+            cls.objects.bulk_update(
+                changed, ["full_name", "full_slug"], batch_size=1000
+            )
+        return len(changed)
 
     def generate_slug(self):
         """
@@ -70,19 +126,19 @@ class Category(MP_Node, AbstractAuditableModelMixin):
 
     def ensure_slug_uniqueness(self):
         """
-        Ensures that the category's slug is unique amongst it's siblings.
-        This is inefficient and probably not thread-safe.
+        Ensures that the category's slug is unique amongst it's siblings by
+        appending the first free suffix, e.g. 'fiction_3'. The sibling slugs
+        it could collide with are fetched with one query. Does not save; two
+        writers picking the same slug at once are told apart by the unique
+        full slug, see save.
         """
-        unique_slug = self.slug
-        siblings = self.get_siblings().exclude(pk=self.pk)
-        next_num = 2
-        while siblings.filter(slug=unique_slug).exists():
-            unique_slug = f"{self.slug}_{next_num}"
-            next_num += 1
-
-        if unique_slug != self.slug:
-            self.slug = unique_slug
-            self.save()
+        taken = (
+            self.get_siblings()
+            .exclude(pk=self.pk)
+            .filter(Q(slug=self.slug) | Q(slug__startswith=f"{self.slug}_"))
+            .values_list("slug", flat=True)
+        )
+        self.slug = self.get_free_slug(self.slug, set(taken))
 
     def save(self, *args, **kwargs):
         """
@@ -91,18 +147,227 @@ class Category(MP_Node, AbstractAuditableModelMixin):
         other means. If you want to control slug creation, just create
         instances with a slug already set, or expose a field on the
         appropriate forms.
+
+        The full name and full slug are kept up to date, on the category
+        and on its descendants when they change.
         """
         if self.slug:
             # Slug was supplied. Hands off!
-            super().save(*args, **kwargs)
-        else:
-            self.slug = self.generate_slug()
-            super().save(*args, **kwargs)
-            # We auto-generated a slug, so we need to make sure that it's
-            # unique. As we need to be able to inspect the category's siblings
-            # for that, we need to wait until the instance is saved. We
-            # update the slug and save again if necessary.
+            self._save_with_full_values(*args, **kwargs)
+            return
+
+        # We auto-generate a slug, so we need to make sure that it's unique.
+        # The siblings are found by path, which treebeard sets before saving.
+        # A sibling saved concurrently with the same slug violates the unique
+        # full slug, and the next free suffix is tried.
+        slug = self.generate_slug()
+        for attempt in range(self.slug_attempts):
+            self.slug = slug
             self.ensure_slug_uniqueness()
+            try:
+                with transaction.atomic():
+                    self._save_with_full_values(*args, **kwargs)
+                return
+            except IntegrityError:
+                if attempt == self.slug_attempts - 1:
+                    raise
+
+    def _save_with_full_values(self, *args, **kwargs):
+        adding = self._state.adding
+        old_full_name, old_full_slug = self.full_name, self.full_slug
+        self.full_name, self.full_slug = self.get_full_values()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {
+                *kwargs["update_fields"],
+                "full_name",
+                "full_slug",
+            }
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not adding and (old_full_name, old_full_slug) != (
+                self.full_name,
+                self.full_slug,
+            ):
+                self.update_descendants(old_full_name, old_full_slug)
+
+    def move(self, target, pos=None):
+        """
+        Moves the category and its descendants, see treebeard's move, and
+        updates their full names and full slugs. The category's slug gets a
+        suffix when a new sibling already uses it. As with treebeard, the
+        instance is stale afterwards and has to be fetched again.
+        """
+        with transaction.atomic():
+            super().move(target, pos)
+            moved = type(self).objects.get(pk=self.pk)
+            old_full_name, old_full_slug = moved.full_name, moved.full_slug
+            moved.ensure_slug_uniqueness()
+            moved.full_name, moved.full_slug = moved.get_full_values()
+            type(self).objects.filter(pk=moved.pk).update(
+                slug=moved.slug, full_name=moved.full_name, full_slug=moved.full_slug
+            )
+            moved.update_descendants(old_full_name, old_full_slug)
+            # Tree changes are written with queryset updates, without signals
+            transaction.on_commit(lambda: bulk_changed.send(sender=Category))
+
+    @staticmethod
+    def get_free_slug(slug, taken):
+        """
+        Returns the slug, or the first of slug_2, slug_3, ... which is not in
+        `taken`, the numbering used by ensure_slug_uniqueness.
+        """
+        unique_slug, next_num = slug, 2
+        while unique_slug in taken:
+            unique_slug = f"{slug}_{next_num}"
+            next_num += 1
+        return unique_slug
+
+    @classmethod
+    def get_children_slots(cls, parent=None):
+        """
+        Returns the slugs taken by the children of `parent`, or by the roots,
+        and the position after the last of them, where new ones are appended.
+        """
+        children = cls.get_root_nodes() if parent is None else parent.get_children()
+        rows = list(children.values_list("path", "slug"))
+        position = 1 + max((cls.get_position(path) for path, _ in rows), default=0)
+        return {slug for _, slug in rows}, position
+
+    # Treebeard computes steps with private helpers, these write them the same
+    # way from its public alphabet and steplen: the 1-based position among the
+    # siblings in base len(alphabet), left padded to steplen characters.
+
+    @classmethod
+    def get_step(cls, position: int) -> str:
+        digits, rest = "", position
+        while rest:
+            rest, digit = divmod(rest, len(cls.alphabet))
+            digits = cls.alphabet[digit] + digits
+        if len(digits) > cls.steplen:
+            raise PathOverflow(_("Path Overflow at position %s") % position)
+        return digits.rjust(cls.steplen, cls.alphabet[0])
+
+    @classmethod
+    def get_position(cls, path: str) -> int:
+        position = 0
+        for char in path[-cls.steplen :]:
+            position = position * len(cls.alphabet) + cls.alphabet.index(char)
+        return position
+
+    @classmethod
+    def load_bulk(cls, bulk_data, parent=None, keep_ids=False):
+        """
+        Loads a tree given in treebeard's format, e.g.
+        `[{"data": {"name": "Books"}, "children": [{"data": {...}}]}]`, below
+        `parent` or as new roots, after the existing children.
+
+        Unlike treebeard's load_bulk, which saves one node at a time, paths,
+        depths, full names and sibling-unique slugs are computed in memory and
+        all nodes are inserted with bulk_create in one transaction, so the
+        query count does not depend on the size of the tree. Returns the ids
+        of the new categories in path order.
+        """
+        with transaction.atomic():
+            if parent is not None:
+                parent = cls.objects.get(pk=parent.pk)
+            slots = cls.get_children_slots(parent)
+            categories = cls._build_bulk(bulk_data, parent, slots, keep_ids)
+            cls.objects.bulk_create(categories, batch_size=1000)
+            if not connection.features.can_return_rows_from_bulk_insert:
+                categories = cls.objects.filter(
+                    path__in=[category.path for category in categories]
+                ).order_by("path")
+            if parent is not None:
+                cls.objects.filter(pk=parent.pk).update(
+                    numchild=F("numchild") + len(bulk_data)
+                )
+            transaction.on_commit(lambda: bulk_changed.send(sender=Category))
+        return [category.pk for category in categories]
+
+    @classmethod
+    def _build_bulk(cls, bulk_data, parent, slots, keep_ids):
+        """
+        Returns the unsaved categories of load_bulk below `parent`, saved or
+        not, in path order. `slots` are the slugs taken below it and the
+        position of the first new child.
+        """
+        taken, first_position = slots
+        categories = []
+        for position, item in enumerate(bulk_data, first_position):
+            data = dict(item["data"])
+            if keep_ids and "id" in item:
+                data["id"] = item["id"]
+            category = cls(**data)
+            if not category.slug:
+                category.slug = cls.get_free_slug(category.generate_slug(), taken)
+            taken.add(category.slug)
+            category.path = (parent.path if parent else "") + cls.get_step(position)
+            category.depth = len(category.path) // cls.steplen
+            children = item.get("children") or []
+            category.numchild = len(children)
+            category.full_name, category.full_slug = cls._join_full_values(
+                None if parent is None else (parent.full_name, parent.full_slug),
+                category.name,
+                category.slug,
+            )
+            categories.append(category)
+            categories += cls._build_bulk(children, category, (set(), 1), keep_ids)
+        return categories
+
+    def move_subtree(self, parent=None):
+        """
+        Moves the category and its descendants after the last child of
+        `parent`, or after the last root. Paths, depths, full names and full
+        slugs of the whole subtree are rewritten by one UPDATE, siblings are
+        never shifted as treebeard's move may do. The category's slug gets a
+        suffix when a new sibling already uses it. The instance is updated in
+        place.
+        """
+        objects = type(self).objects
+        with transaction.atomic():
+            node = objects.get(pk=self.pk)
+            if parent is not None:
+                parent = objects.get(pk=parent.pk)
+                if parent.path.startswith(node.path):
+                    raise InvalidMoveToDescendant(_("Can't move node to a descendant."))
+            old_parent_path = node.path[: -self.steplen]
+            if (parent.path if parent else "") == old_parent_path:
+                return
+
+            taken, position = self.get_children_slots(parent)
+            slug = self.get_free_slug(node.slug, taken)
+            path = (parent.path if parent else "") + self.get_step(position)
+            depth = 1 if parent is None else parent.depth + 1
+            full_name, full_slug = self._join_full_values(
+                None if parent is None else (parent.full_name, parent.full_slug),
+                node.name,
+                slug,
+            )
+
+            objects.filter(path__startswith=node.path).update(
+                path=self._replace_prefix("path", node.path, path),
+                depth=F("depth") + (depth - node.depth),
+                slug=Case(
+                    When(pk=node.pk, then=Value(slug)),
+                    default=F("slug"),
+                    output_field=models.SlugField(),
+                ),
+                full_name=self._replace_prefix("full_name", node.full_name, full_name),
+                full_slug=self._replace_prefix("full_slug", node.full_slug, full_slug),
+            )
+            objects.filter(
+                path__in=[p for p in (old_parent_path, parent and parent.path) if p]
+            ).update(
+                numchild=Case(
+                    When(path=old_parent_path, then=F("numchild") - 1),
+                    default=F("numchild") + 1,
+                )
+            )
+            transaction.on_commit(lambda: bulk_changed.send(sender=Category))
+
+        self.path, self.depth, self.slug = path, depth, slug
+        self.full_name, self.full_slug = full_name, full_slug
+        self.__dict__.pop("_cached_parent_obj", None)
 
     def get_ancestors_and_self(self):
         """
@@ -121,10 +386,11 @@ class Category(MP_Node, AbstractAuditableModelMixin):
         return list(self.get_descendants()) + [self]
 
     def has_children(self):
-        return self.get_num_children() > 0
+        return self.numchild > 0
 
     def get_num_children(self):
-        return self.get_children().count()
+        # Maintained by treebeard, unlike get_children().count() it needs no query
+        return self.numchild
 
 
 class ProductCategory(models.Model):
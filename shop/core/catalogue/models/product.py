@@ -1,8 +1,191 @@
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Count, Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Cast
 from django.utils.translation import gettext_lazy as _
+from core.catalogue.attribute_schema import get_attribute_schemas
 from core.common.abstract import AbstractAuditableModelMixin
+from .category import ProductCategory
+from .product_attribute import ProductAttribute, ProductAttributeValue
 
-__all__ = ["Product"]
+__all__ = ["ProductQuerySet", "Product"]
+
+
+class ProductQuerySet(models.QuerySet):
+    # Lookups filter_attributes accepts, on top of the implicit "exact"
+    attribute_lookups = ("exact", "in", "gt", "gte", "lt", "lte", "range")
+    # Types with a (attribute, value_<type>) index, see ProductAttributeValue
+    filterable_types = (
+        ProductAttribute.TEXT,
+        ProductAttribute.INTEGER,
+        ProductAttribute.BOOLEAN,
+        ProductAttribute.FLOAT,
+        ProductAttribute.DATE,
+        ProductAttribute.DATETIME,
+    )
+
+    def filter_attributes(self, *pairs, **predicates):
+        """
+        Filters products by attribute values, written like field lookups on
+        attribute codes, e.g. `filter_attributes(color="red", size__gte=13)`.
+        Values are coerced to the attribute's type, so "13" works as well.
+        Predicates may also be given as (lookup, value) pairs, which can repeat
+        a lookup, e.g. `filter_attributes(("size__gte", 13), ("size__gte", 15))`.
+        All predicates are combined with AND.
+
+        Every predicate becomes an EXISTS over the typed value column of the
+        attributes with that code, served by the (attribute, value_<type>)
+        indexes. Attribute codes are resolved with one query. Raises
+        ValidationError for unknown codes, lookups or invalid values.
+        """
+        if not pairs and not predicates:
+            return self
+        parsed = []
+        for key, value in (*pairs, *predicates.items()):
+            code, _sep, lookup = key.rpartition("__")
+            if not code or lookup not in self.attribute_lookups:
+                code, lookup = key, "exact"
+            parsed.append((code, lookup, value))
+
+        attributes_by_code = {}
+        for attribute in ProductAttribute.objects.filter(
+            code__in={code for code, _, _ in parsed}
+        ):
+            attributes_by_code.setdefault(attribute.code, []).append(attribute)
+
+        queryset = self
+        for code, lookup, value in parsed:
+            if code not in attributes_by_code:
+                raise ValidationError(
+                    _("Unknown attribute %(code)s"), params={"code": code}
+                )
+            # The same code may be bound to several types with different value types
+            condition = Q()
+            for attribute in attributes_by_code[code]:
+                if attribute.type not in self.filterable_types:
+                    raise ValidationError(
+                        _("Attribute %(code)s can not be filtered"),
+                        params={"code": code},
+                    )
+                condition |= Q(
+                    attribute=attribute,
+                    **{
+                        f"value_{attribute.type}__{lookup}": self._coerce(
+                            attribute, lookup, value
+                        )
+                    },
+                )
+            queryset = queryset.filter(
+                Exists(
+                    ProductAttributeValue.objects.filter(
+                        condition, product=OuterRef("pk")
+                    )
+                )
+            )
+        return queryset
+
+    @staticmethod
+    def _coerce(attribute, lookup, value):
+        if lookup in ("in", "range"):
+            values = [attribute.coerce_value(item) for item in value]
+            if lookup == "range" and len(values) != 2:
+                raise ValidationError(_("A range needs two values"))
+            return values
+        return attribute.coerce_value(value)
+
+    def facet_counts(self, codes=None, categories=True, product_types=True):
+        """
+        Counts the products of the queryset per value of every filterable
+        attribute (or of the attributes with the given codes), per linked
+        category and per product type, e.g.
+
+            {
+                "attributes": {"color": {"red": 3, "blue": 1}},
+                "categories": {category_id: 4},
+                "product_types": {product_type_id: 4},
+            }
+
+        All counts come from one statement, a UNION ALL of grouped selects
+        over ProductAttributeValue, ProductCategory and Product. Attribute
+        values are given as text, like ProductAttributeValue.value.
+        """
+        value_fields = {
+            type_: ProductAttributeValue._meta.get_field(f"value_{type_}")
+            for type_ in self.filterable_types
+        }
+        no_values = {
+            type_: Value(None, output_field=field)
+            for type_, field in value_fields.items()
+        }
+        product_ids = self.order_by().values("pk")
+
+        parts = []
+        if codes is None or codes:
+            values = ProductAttributeValue.objects.filter(
+                product__in=product_ids, attribute__type__in=self.filterable_types
+            )
+            if codes is not None:
+                values = values.filter(attribute__code__in=codes)
+            parts.append(
+                values.order_by().values(
+                    facet=Value("attribute"),
+                    key=F("attribute__code"),
+                    **{type_: F(field.name) for type_, field in value_fields.items()},
+                )
+            )
+        if categories:
+            parts.append(
+                ProductCategory.objects.filter(product__in=product_ids)
+                .order_by()
+                .values(
+                    facet=Value("category"),
+                    key=Cast("category_id", models.CharField()),
+                    **no_values,
+                )
+            )
+        if product_types:
+            parts.append(
+                self.order_by().values(
+                    facet=Value("product_type"),
+                    key=Cast("product_type_id", models.CharField()),
+                    **no_values,
+                )
+            )
+
+        counts = {"attributes": {}, "categories": {}, "product_types": {}}
+        if not parts:
+            return counts
+        parts = [part.annotate(count=Count("*")) for part in parts]
+        for row in parts[0].union(*parts[1:], all=True):
+            if row["facet"] == "attribute":
+                value = next(
+                    row[type_] for type_ in value_fields if row[type_] is not None
+                )
+                by_value = counts["attributes"].setdefault(row["key"], {})
+                # The same code may be bound to several product types
+                by_value[str(value)] = by_value.get(str(value), 0) + row["count"]
+            elif row["facet"] == "category":
+                counts["categories"][int(row["key"])] = row["count"]
+            else:
+                counts["product_types"][int(row["key"])] = row["count"]
+        return counts
+
+    def in_category_tree(self, category):
+        """
+        Products linked to the category or to any of its descendants, as one
+        query: the links are matched with `path LIKE '<category path>%'`,
+        which PostgreSQL serves from the varchar_pattern_ops index Django
+        creates for the unique path column. Products linked to several
+        categories of the subtree are not repeated.
+        """
+        return self.filter(
+            Exists(
+                ProductCategory.objects.filter(
+                    product=OuterRef("pk"), category__path__startswith=category.path
+                )
+            )
+        )
 
 
 class Product(AbstractAuditableModelMixin, models.Model):
@@ -38,6 +221,8 @@ class Product(AbstractAuditableModelMixin, models.Model):
         through="catalogue.ProductCategory",
         verbose_name=_("Categories"),
     )
+    # Maintained by database triggers on PostgreSQL, see core.catalogue.search
+    search_vector = SearchVectorField(null=True, editable=False)
     is_discountable = models.BooleanField(
         _("Is discountable?"),
         default=True,
@@ -46,5 +231,51 @@ class Product(AbstractAuditableModelMixin, models.Model):
         ),
     )
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        app_label = "catalogue"
+        indexes = [
+            # Backs keyset pagination when products are sorted by name
+            models.Index(fields=["name", "id"], name="product_name_id_idx"),
+        ]
+
     def __str__(self):
         return f"Product (id:{self.pk}): {self.name}"
+
+    def set_attributes(self, values):
+        """
+        Sets attribute values by attribute code, e.g.
+        `product.set_attributes({"pages": 295, "cover": None})`.
+        A None or empty value removes the attribute value.
+        Raises ValidationError keyed by attribute code.
+        """
+        self.bulk_set_attributes({self: values}, error_key="{code}")
+
+    @classmethod
+    def bulk_set_attributes(cls, values_by_product, error_key="{upc}.{code}"):
+        """
+        Sets attribute values of many products, given as
+        `{product: {code: value}}`. Every value is validated before anything
+        is written, errors are keyed by `error_key`. Attribute codes resolve
+        against the product's type first, then against attributes bound to no
+        type, and required attributes can not be removed.
+
+        Attributes come from the cached attribute schemas, the query count
+        does not depend on the number of products or values.
+        """
+        schemas = get_attribute_schemas(
+            product.product_type_id for product in values_by_product
+        )
+        items, errors = [], {}
+        for product, values in values_by_product.items():
+            try:
+                cleaned = schemas[product.product_type_id].clean(values, partial=True)
+            except ValidationError as ex:
+                for code, messages in ex.message_dict.items():
+                    errors[error_key.format(upc=product.upc, code=code)] = messages
+                continue
+            items.extend((product, attribute, value) for attribute, value in cleaned)
+        if errors:
+            raise ValidationError(errors)
+        ProductAttributeValue.save_values(items)
@@ -1,12 +1,14 @@
 from datetime import date, datetime
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils.html import strip_tags
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from core.common.abstract import AbstractAuditableModelMixin
+from core.common.utils import to_bool
 from core.common.validators import non_python_keyword
+from core.catalogue.signals import bulk_changed
 
 __all__ = [
     "ProductAttribute",
@@ -81,24 +83,35 @@ class ProductAttribute(AbstractAuditableModelMixin, models.Model):
     def __str__(self):
         return self.name
 
-    def save_value(self, product, value):  # noqa: C901 too complex
-        try:
-            value_obj = product.attribute_values.get(attribute=self)
-        except ProductAttributeValue.DoesNotExist:
-            value_obj = ProductAttributeValue.objects.create(
-                product=product, attribute=self
-            )
-        if value is None or value == "":
-            value_obj.delete()
-            return
-        if value != value_obj.value:
-            value_obj.value = value
-            value_obj.save()
+    def save_value(self, product, value):
+        ProductAttributeValue.save_values([(product, self, value)])
 
     def validate_value(self, value):
         validator = getattr(self, f"_validate_{self.type}")
         validator(value)
 
+    def coerce_value(self, value):
+        """
+        Converts a value written as text, e.g. read from a CSV file, to the
+        attribute's type. Values of other types are returned untouched.
+        """
+        coercer = getattr(self, f"_coerce_{self.type}", None)
+        if coercer is None or not isinstance(value, str):
+            return value
+        try:
+            return coercer(value)
+        except ValueError as ex:
+            raise ValidationError(
+                _("Invalid %(type)s value"), params={"type": self.type}
+            ) from ex
+
+    # Coercers
+    _coerce_integer = staticmethod(int)
+    _coerce_float = staticmethod(float)
+    _coerce_boolean = staticmethod(to_bool)
+    _coerce_date = staticmethod(date.fromisoformat)
+    _coerce_datetime = staticmethod(datetime.fromisoformat)
+
     # Validators
     def _validate_text(self, value):
         if not isinstance(value, str):
@@ -163,12 +176,87 @@ class ProductAttributeValue(AbstractAuditableModelMixin, models.Model):
     class Meta:
         app_label = "catalogue"
         unique_together = ("attribute", "product")
+        # Back filtering and faceting by value, see
+        # ProductQuerySet.filter_attributes. Rich text is not filterable.
+        indexes = [
+            models.Index(
+                fields=["attribute", "value_text"], name="attr_value_text_idx"
+            ),
+            models.Index(
+                fields=["attribute", "value_integer"], name="attr_value_integer_idx"
+            ),
+            models.Index(
+                fields=["attribute", "value_boolean"], name="attr_value_boolean_idx"
+            ),
+            models.Index(
+                fields=["attribute", "value_float"], name="attr_value_float_idx"
+            ),
+            models.Index(
+                fields=["attribute", "value_date"], name="attr_value_date_idx"
+            ),
+            models.Index(
+                fields=["attribute", "value_datetime"], name="attr_value_datetime_idx"
+            ),
+        ]
         verbose_name = _("Product attribute value")
         verbose_name_plural = _("Product attribute values")
 
     def __str__(self):
         return self.summary()
 
+    @classmethod
+    def save_values(cls, items):
+        """
+        Writes many attribute values at once. Each item is a
+        (product, attribute, value) tuple, a None or empty value deletes the
+        stored value. Values must be validated beforehand.
+
+        Costs one select, one insert, one update and one delete whatever the
+        number of items, all inside a single transaction. Deleting selects
+        the rows once more, for the post_delete signals.
+        """
+        items = list(items)
+        if not items:
+            return
+        existing = {
+            (value_obj.product_id, value_obj.attribute_id): value_obj
+            for value_obj in cls.objects.filter(
+                product__in={product.pk for product, _, _ in items},
+                attribute__in={attribute.pk for _, attribute, _ in items},
+            )
+        }
+        to_create, to_update, to_delete = [], [], []
+        update_fields = set()
+        for product, attribute, value in items:
+            value_obj = existing.get((product.pk, attribute.pk))
+            if value is None or value == "":
+                if value_obj is not None:
+                    to_delete.append(value_obj.pk)
+                continue
+            if value_obj is None:
+                value_obj = cls(product=product, attribute=attribute)
+                value_obj.value = value
+                to_create.append(value_obj)
+                continue
+            value_obj.attribute = attribute
+            if value != value_obj.value:
+                value_obj.value = value
+                to_update.append(value_obj)
+                update_fields.add(f"value_{attribute.type}")
+
+        with transaction.atomic():
+            if to_delete:
+                cls.objects.filter(pk__in=to_delete).delete()
+            if to_create:
+                cls.objects.bulk_create(to_create)
+            if to_update:
+                cls.objects.bulk_update(to_update, sorted(update_fields))
+            if to_create or to_update:
+                product_ids = {product.pk for product, _, _ in items}
+                transaction.on_commit(
+                    lambda: bulk_changed.send(sender=cls, product_ids=product_ids)
+                )
+
     @property
     def value(self):
         value = getattr(self, f"value_{self.attribute.type}")
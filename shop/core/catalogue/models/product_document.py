@@ -0,0 +1,31 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+__all__ = ["ProductDocument"]
+
+
+class ProductDocument(models.Model):
+    """
+    A denormalized copy of a product with its type, attribute values by code
+    and categories, so a product is read back with one lookup by primary
+    key. An optional read model, maintained by core.catalogue.documents when
+    CATALOGUE_PRODUCT_DOCUMENTS is enabled.
+    """
+
+    product = models.OneToOneField(
+        "catalogue.Product",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="document",
+        verbose_name=_("Product"),
+    )
+    data = models.JSONField(_("Data"), encoder=DjangoJSONEncoder)
+
+    class Meta:
+        app_label = "catalogue"
+        verbose_name = _("Product document")
+        verbose_name_plural = _("Product documents")
+
+    def __str__(self):
+        return f"Product document (id:{self.pk})"
@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from core.common.abstract import AbstractAuditableModelMixin
+from core.catalogue.attribute_schema import get_attribute_schema
 from django_extensions.db.models import AutoSlugField
 
 __all__ = ["ProductType"]
@@ -39,4 +40,4 @@ class ProductType(AbstractAuditableModelMixin, models.Model):
 
     @property
     def has_attributes(self):
-        return self.attributes.exists()
+        return get_attribute_schema(self.pk).has_own_attributes
@@ -0,0 +1,26 @@
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils.module_loading import import_string
+
+from .base import SearchBackend
+from .postgres import SEARCH_CONFIG
+
+__all__ = ["SEARCH_CONFIG", "SearchBackend", "get_search_backend", "search_products"]
+
+DEFAULT_BACKEND = "core.catalogue.search.postgres.PostgresSearchBackend"
+
+
+@lru_cache(maxsize=None)
+def get_search_backend() -> SearchBackend:
+    """
+    Returns the backend named by the CATALOGUE_SEARCH_BACKEND setting.
+    """
+    backend = getattr(settings, "CATALOGUE_SEARCH_BACKEND", DEFAULT_BACKEND)
+    return import_string(backend)()
+
+
+def search_products(text: str, queryset: Optional[QuerySet] = None) -> QuerySet:
+    return get_search_backend().search(text, queryset)
@@ -0,0 +1,27 @@
+from typing import Optional
+
+from django.db.models import FloatField, QuerySet, Value
+
+__all__ = ["SearchBackend"]
+
+
+class SearchBackend:
+    """
+    Finds the products matching a search text.
+
+    `search` narrows a product queryset, all products by default, to the
+    matches and annotates them with a float `search_rank`, higher is better.
+    Callers page through the results with the keyset ("-search_rank", "id").
+    """
+
+    def search(self, text: str, queryset: Optional[QuerySet] = None) -> QuerySet:
+        raise NotImplementedError
+
+    @staticmethod
+    def no_results(queryset: QuerySet) -> QuerySet:
+        """
+        Returns an empty result, annotated like any other so it can be sorted.
+        """
+        return queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).none()
@@ -0,0 +1,253 @@
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Optional
+
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+
+from core.catalogue.models import Product, ProductAttribute, ProductAttributeValue
+from core.catalogue.signals import bulk_changed
+from core.catalogue.versions import get_version, is_stale, next_version
+
+from .base import SearchBackend
+
+__all__ = ["InvertedIndex", "InMemorySearchBackend"]
+
+VERSION_KEY = "catalogue:search_index:version"
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+class InvertedIndex:
+    """
+    Maps terms to the products containing them and scores matches with BM25.
+
+    Every query word matches the terms it is a prefix of, through a sorted
+    list of terms, and a product must match all words. Terms are not stemmed.
+    Not thread-safe, InMemorySearchBackend guards it with a lock.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        # term -> {product id: term frequency}
+        self.postings: dict[str, dict[int, int]] = defaultdict(dict)
+        # product id -> {term: term frequency}, to remove a product again
+        self.documents: dict[int, Counter] = {}
+        self.lengths: dict[int, int] = {}
+        self.total_length = 0
+        self._terms: Optional[list[str]] = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, product_id: int, terms: list[str]):
+        self.remove(product_id)
+        counts = Counter(terms)
+        for term, count in counts.items():
+            self.postings[term][product_id] = count
+        self.documents[product_id] = counts
+        self.lengths[product_id] = len(terms)
+        self.total_length += len(terms)
+        self._terms = None
+
+    def remove(self, product_id: int):
+        counts = self.documents.pop(product_id, None)
+        if counts is None:
+            return
+        for term in counts:
+            postings = self.postings[term]
+            del postings[product_id]
+            if not postings:
+                del self.postings[term]
+                self._terms = None
+        self.total_length -= self.lengths.pop(product_id)
+
+    def expand(self, prefix: str) -> list[str]:
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        terms = []
+        for i in range(bisect_left(self._terms, prefix), len(self._terms)):
+            if not self._terms[i].startswith(prefix):
+                break
+            terms.append(self._terms[i])
+        return terms
+
+    def search(self, words: list[str]) -> dict[int, float]:
+        """
+        Returns the {product id: score} of the products matching every word.
+        """
+        if not words or not self.documents:
+            return {}
+        count = len(self.documents)
+        average_length = self.total_length / count
+        scores = None
+        for word in words:
+            word_scores = defaultdict(float)
+            for term in self.expand(word):
+                postings = self.postings[term]
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for product_id, frequency in postings.items():
+                    length = self.lengths[product_id]
+                    word_scores[product_id] += (
+                        idf
+                        * frequency
+                        * (self.k1 + 1)
+                        / (
+                            frequency
+                            + self.k1 * (1 - self.b + self.b * length / average_length)
+                        )
+                    )
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {
+                    product_id: score + word_scores[product_id]
+                    for product_id, score in scores.items()
+                    if product_id in word_scores
+                }
+            if not scores:
+                break
+        return scores
+
+
+def rank_by_hits(hits: list[tuple[int, float]]) -> RawSQL:
+    """
+    Returns the score of a product among the (product id, score) hits, looked
+    up in a VALUES list. Both SQLite and PostgreSQL name its columns column1
+    and column2.
+    """
+    rows = ", ".join(["(%s, CAST(%s AS double precision))"] * len(hits))
+    table = connection.ops.quote_name(Product._meta.db_table)
+    column = connection.ops.quote_name(Product._meta.pk.column)
+    return RawSQL(
+        f"SELECT hits.column2 FROM (VALUES {rows}) AS hits "
+        f"WHERE hits.column1 = {table}.{column}",
+        [value for hit in hits for value in hit],
+        output_field=FloatField(),
+    )
+
+
+class InMemorySearchBackend(SearchBackend):
+    """
+    Searches an InvertedIndex of product names, upcs, descriptions and text
+    attribute values held in process memory, for tests and small catalogues.
+
+    The index is built on first search and then updated product by product
+    from model signals and from bulk_changed with product ids. A version
+    shared through the cache, as for the category tree, makes a process
+    rebuild its index after other bulk writes and after writes made by other
+    processes, or after CATALOGUE_LOCAL_CACHE_TIMEOUT seconds when the cache
+    is not shared. At most `max_hits` best matches are returned.
+    """
+
+    max_hits = 1000
+
+    def __init__(self):
+        self.index: Optional[InvertedIndex] = None
+        self.version = None
+        self.built_at = 0.0
+        self.lock = threading.Lock()
+        for model in (Product, ProductAttributeValue):
+            post_save.connect(self.changed_on_commit, sender=model)
+            post_delete.connect(self.changed_on_commit, sender=model)
+            bulk_changed.connect(self.bulk_changed_on_commit, sender=model)
+        # A type change or deletion affects the values of many products
+        post_save.connect(self.invalidate_on_commit, sender=ProductAttribute)
+        post_delete.connect(self.invalidate_on_commit, sender=ProductAttribute)
+        bulk_changed.connect(self.invalidate_on_commit, sender=ProductAttribute)
+
+    @staticmethod
+    def get_documents(product_ids=None):
+        """
+        Returns the {product id: terms} of the given products, or of all.
+        """
+        products = Product.objects.values_list("pk", "name", "upc", "description")
+        values = ProductAttributeValue.objects.filter(
+            attribute__type=ProductAttribute.TEXT
+        ).values_list("product_id", "value_text")
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+            values = values.filter(product__in=product_ids)
+
+        documents = {}
+        for product_id, name, upc, description in products.iterator():
+            documents[product_id] = tokenize(
+                " ".join(filter(None, (name, upc, description)))
+            )
+        for product_id, text in values.iterator():
+            if product_id in documents and text:
+                documents[product_id].extend(tokenize(text))
+        return documents
+
+    def get_index(self) -> InvertedIndex:
+        """
+        Returns the current index, rebuilt if stale. Call with the lock held.
+        """
+        version = get_version(VERSION_KEY)
+        if self.index is None or is_stale(self.version, self.built_at, version):
+            index = InvertedIndex()
+            for product_id, terms in self.get_documents().items():
+                index.add(product_id, terms)
+            self.index, self.version = index, version
+            self.built_at = time.monotonic()
+        return self.index
+
+    def search(self, text, queryset=None):
+        if queryset is None:
+            queryset = Product.objects.all()
+        words = tokenize(text)
+        with self.lock:
+            scores = self.get_index().search(words)
+        if not scores:
+            return self.no_results(queryset)
+
+        hits = sorted(scores.items(), key=lambda hit: hit[1], reverse=True)
+        hits = hits[: self.max_hits]
+        return queryset.filter(pk__in=[pk for pk, _ in hits]).annotate(
+            search_rank=rank_by_hits(hits)
+        )
+
+    def update(self, product_ids):
+        """
+        Reindexes products after a write, products gone are removed.
+        """
+        version = next_version(VERSION_KEY)
+        with self.lock:
+            if self.index is None or version is None or version != self.version + 1:
+                # Another process wrote in between, rebuild on next search
+                return
+            documents = self.get_documents(product_ids)
+            for product_id in product_ids:
+                if product_id in documents:
+                    self.index.add(product_id, documents[product_id])
+                else:
+                    self.index.remove(product_id)
+            self.version = version
+
+    def changed_on_commit(self, sender, instance, **_kwargs):
+        product_id = instance.pk if sender is Product else instance.product_id
+        # An index updated before the commit would read the old rows
+        transaction.on_commit(lambda: self.update([product_id]))
+
+    def bulk_changed_on_commit(self, product_ids=None, **kwargs):
+        if product_ids is None:
+            self.invalidate_on_commit(**kwargs)
+            return
+        product_ids = list(product_ids)
+        transaction.on_commit(lambda: self.update(product_ids))
+
+    @staticmethod
+    def invalidate_on_commit(**_kwargs):
+        transaction.on_commit(lambda: next_version(VERSION_KEY))
@@ -0,0 +1,57 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import NotSupportedError, connection
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast, Greatest
+
+from core.catalogue.models import Product
+
+from .base import SearchBackend
+
+__all__ = ["SEARCH_CONFIG", "PostgresSearchBackend"]
+
+# Text search configuration of Product.search_vector, set by the triggers of
+# migration 0009_product_search_vector
+SEARCH_CONFIG = "english"
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Matches words as prefixes against Product.search_vector, which holds the
+    name, upc, description and text attribute values and is kept up to date
+    by database triggers. Names and upcs also match fuzzily through pg_trgm,
+    and upcs by prefix. Every condition is served by an index.
+    """
+
+    def search(self, text, queryset=None):
+        if connection.vendor != "postgresql":
+            raise NotSupportedError("Product search requires PostgreSQL")
+        if queryset is None:
+            queryset = Product.objects.all()
+        text = text.strip()
+        words = re.findall(r"\w+", text)
+        if not words:
+            return self.no_results(queryset)
+
+        query = SearchQuery(
+            " & ".join(f"{word}:*" for word in words),
+            search_type="raw",
+            config=SEARCH_CONFIG,
+        )
+        return queryset.filter(
+            Q(search_vector=query)
+            | Q(name__trigram_similar=text)
+            | Q(upc__trigram_similar=text)
+            | Q(upc__startswith=text)
+        ).annotate(
+            # ts_rank returns a real, the sum is cast to double precision so
+            # the rank compares equal to the float the keyset cursor holds
+            search_rank=Cast(
+                SearchRank(F("search_vector"), query)
+                + Greatest(
+                    TrigramSimilarity("name", text), TrigramSimilarity("upc", text)
+                ),
+                FloatField(),
+            )
+        )
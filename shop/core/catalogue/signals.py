@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+__all__ = ["bulk_changed"]
+
+#: Sent with the model class as sender after writes which bypass the model
+#: signals, e.g. bulk_create, bulk_update or QuerySet.update. Senders which
+#: know the products affected pass their ids as `product_ids`.
+bulk_changed = Signal()
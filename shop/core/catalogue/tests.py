@@ -1,4 +1,725 @@
-# pylint: disable=unused-import
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import date, datetime, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from treebeard.exceptions import InvalidMoveToDescendant
+
+from core.catalogue.category_tree import get_category_tree
+from core.catalogue import documents
+from core.catalogue.attribute_schema import (
+    get_attribute_schema,
+    invalidate_attribute_schemas,
+)
+from core.catalogue.copy_importer import CopyCatalogueImporter
+from core.catalogue.exporter import CatalogueExporter, to_csv, to_jsonl
+from core.catalogue.importer import CatalogueImporter, RowError, read_csv, read_jsonl
+from core.catalogue.models import (
+    Category,
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductDocument,
+    ProductType,
+)
+from core.catalogue.search import get_search_backend
+from core.catalogue.search.memory import VERSION_KEY, InMemorySearchBackend
+from core.catalogue.signals import bulk_changed
+from core.catalogue.versions import next_version
+
+
+class CatalogueImporterTests(TestCase):
+    importer_class = CatalogueImporter
+
+    @classmethod
+    def setUpTestData(cls):
+        book = ProductType.objects.create(name="Book")
+        phone = ProductType.objects.create(name="Phone")
+        ProductAttribute.objects.create(
+            product_type=book, name="Pages", code="pages", type=ProductAttribute.INTEGER
+        )
+        ProductAttribute.objects.create(
+            product_type=phone,
+            name="Weight",
+            code="weight",
+            type=ProductAttribute.FLOAT,
+        )
+
+    def run_import(self, csv_text, importer=None):
+        importer = importer or self.importer_class()
+        with self.captureOnCommitCallbacks(execute=True):
+            importer.run(read_csv(io.StringIO(csv_text)))
+        return importer
+
+    def test_parent_in_later_chunk(self):
+        importer = self.run_import(
+            "upc,name,product_type,parent\n"
+            "book-1-paperback,Paperback,book,book-1\n"
+            "book-1,Book,book,\n",
+            self.importer_class(chunk_size=1),
+        )
+        self.assertEqual(importer.errors, [])
+        self.assertEqual(
+            Product.objects.get(upc="book-1-paperback").parent,
+            Product.objects.get(upc="book-1"),
+        )
+
+    def test_unknown_parents_are_skipped_and_capped(self):
+        rows = "".join(f"variant-{i},Variant,book,missing-{i}\n" for i in range(5))
+        importer = self.importer_class(chunk_size=2)
+        importer.max_errors = 3
+        self.run_import(f"upc,name,product_type,parent\n{rows}", importer)
+        self.assertEqual(importer.created, 5)
+        self.assertEqual(importer.skipped, 5)
+        self.assertEqual(
+            [str(error) for error in importer.errors],
+            [f"line {i + 2}: unknown parent missing-{i}" for i in range(3)],
+        )
+        self.assertFalse(Product.objects.filter(parent__isnull=False).exists())
+
+    def test_jsonl_records_are_objects(self):
+        stream = io.StringIO('{"upc": "book-1"}\n\n["book-2"]\n')
+        records = read_jsonl(stream)
+        self.assertEqual(next(records), (1, {"upc": "book-1"}))
+        with self.assertRaisesMessage(RowError, "line 3: expected a JSON object"):
+            next(records)
+
+    def test_attribute_columns_of_other_types(self):
+        importer = self.run_import(
+            "upc,name,product_type,pages,weight\n"
+            "book-1,Book,book,320,\n"
+            "phone-1,Phone,phone,,0.2\n"
+            "phone-2,Phone,phone,100,0.2\n"
+        )
+        self.assertEqual(importer.created, 2)
+        self.assertEqual(
+            [str(error) for error in importer.errors],
+            ["line 4: pages: Unknown attribute"],
+        )
+        values = {
+            (value.product.upc, value.attribute.code): value.value
+            for product in Product.objects.all()
+            for value in product.attribute_values.all()
+        }
+        self.assertEqual(values, {("book-1", "pages"): 320, ("phone-1", "weight"): 0.2})
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY import needs PostgreSQL")
+class CopyCatalogueImporterTests(CatalogueImporterTests):
+    importer_class = CopyCatalogueImporter
+
+    def test_merge(self):
+        Category.add_root(name="Books")
+        Product.objects.create(
+            upc="book-1", name="Old", product_type=ProductType.objects.get(name="Book")
+        )
+        changed = []
+
+        def receiver(sender, product_ids=None, **_kwargs):
+            changed.append((sender, set(product_ids)))
+
+        bulk_changed.connect(receiver)
+        self.addCleanup(bulk_changed.disconnect, receiver)
+        importer = self.run_import(
+            "upc,name,product_type,parent,categories,pages\n"
+            "book-1-paperback,Paperback,book,book-1,books,\n"
+            "book-1,Book,book,,books,320\n"
+            "book-1,Book,book,,books,321\n"
+        )
+        self.assertEqual((importer.created, importer.updated), (1, 1))
+        book = Product.objects.get(upc="book-1")
+        paperback = Product.objects.get(upc="book-1-paperback")
+        self.assertEqual(book.name, "Book")
+        self.assertEqual(paperback.parent, book)
+        self.assertEqual(book.attribute_values.get().value, 321)
+        self.assertEqual(
+            list(book.categories.values_list("slug", flat=True)), ["books"]
+        )
+        self.assertEqual(len(changed), 3)
+        for _, product_ids in changed:
+            self.assertEqual(product_ids, {book.pk, paperback.pk})
+
+
+class CatalogueExporterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        book = ProductType.objects.create(name="Book")
+        ProductAttribute.objects.create(
+            product_type=book, name="Pages", code="pages", type=ProductAttribute.INTEGER
+        )
+        fiction = Category.add_root(name="Books").add_child(name="Fiction")
+        # Created first, exported after its parent
+        variant = Product.objects.create(
+            upc="book-1-paperback", name="Paperback", product_type=book
+        )
+        parent = Product.objects.create(
+            upc="book-1", name="Book, 1", description="A book", product_type=book
+        )
+        variant.parent = parent
+        variant.save()
+        parent.set_attributes({"pages": 320})
+        parent.categories.add(fiction)
+
+    def test_jsonl(self):
+        lines = list(to_jsonl(CatalogueExporter(chunk_size=1).records()))
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {
+                    "upc": "book-1",
+                    "name": "Book, 1",
+                    "description": "A book",
+                    "product_type": "book",
+                    "parent": "",
+                    "contains_hazmat": False,
+                    "is_discountable": True,
+                    "categories": ["books/fiction"],
+                    "attributes": {"pages": 320},
+                },
+                {
+                    "upc": "book-1-paperback",
+                    "name": "Paperback",
+                    "description": None,
+                    "product_type": "book",
+                    "parent": "book-1",
+                    "contains_hazmat": False,
+                    "is_discountable": True,
+                    "categories": [],
+                    "attributes": {},
+                },
+            ],
+        )
+
+    def test_csv(self):
+        exporter = CatalogueExporter()
+        self.assertEqual(
+            "".join(to_csv(exporter.records(), exporter.get_attribute_codes())),
+            "upc,name,description,product_type,parent,contains_hazmat,"
+            "is_discountable,categories,pages\r\n"
+            'book-1,"Book, 1",A book,book,,False,True,books/fiction,320\r\n'
+            "book-1-paperback,Paperback,,book,book-1,False,True,,\r\n",
+        )
+
+    def test_export_reimported(self):
+        exporter = CatalogueExporter()
+        csv_text = "".join(to_csv(exporter.records(), exporter.get_attribute_codes()))
+        Product.objects.all().delete()
+        importer = CatalogueImporter()
+        with self.captureOnCommitCallbacks(execute=True):
+            importer.run(read_csv(io.StringIO(csv_text)))
+        self.assertEqual(importer.errors, [])
+        self.assertEqual(
+            "".join(to_csv(exporter.records(), exporter.get_attribute_codes())),
+            csv_text,
+        )
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("export_catalogue", stdout=out)
+        self.assertEqual(
+            [json.loads(line)["upc"] for line in out.getvalue().splitlines()],
+            ["book-1", "book-1-paperback"],
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "catalogue.csv")
+            call_command("export_catalogue", path, chunk_size=1)
+            with open(path, encoding="utf-8", newline="") as stream:
+                self.assertEqual(len(list(csv.DictReader(stream))), 2)
+
+    def test_view(self):
+        user = get_user_model().objects.create_user("clerk")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/catalogue/export.csv").status_code, 403)
+
+        user.user_permissions.add(Permission.objects.get(codename="view_product"))
+        response = self.client.get("/catalogue/export.jsonl")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["upc"] for line in lines],
+            ["book-1", "book-1-paperback"],
+        )
+
+        response = self.client.get("/catalogue/export.csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 3)
+
+
+class CategoryTests(TestCase):
+    def test_deep_full_values(self):
+        category = None
+        for level in range(6):
+            name = f"{level}" * 255
+            if category is None:
+                category = Category.add_root(name=name)
+            else:
+                category = category.add_child(name=name)
+        category.refresh_from_db()
+        self.assertEqual(len(category.full_name), 6 * 255 + 5 * 3)
+        self.assertEqual(len(category.full_slug), 6 * 255 + 5)
+
+    def test_str(self):
+        category = Category(name="Books")
+        self.assertEqual(str(category), "Books")
+        root = Category.add_root(name="Books")
+        self.assertEqual(str(root.add_child(name="Fiction")), "Books > Fiction")
+
+    def test_sibling_slugs(self):
+        books = Category.add_root(name="Books")
+        science = Category.add_root(name="Science")
+        fiction = books.add_child(name="Fiction")
+        self.assertEqual(books.add_child(name="Fiction").slug, "fiction_2")
+        self.assertEqual(books.add_child(name="Fiction!").slug, "fiction_3")
+        self.assertEqual(science.add_child(name="Fiction").slug, "fiction")
+        fiction.name = "Fiction"
+        fiction.save()
+        self.assertEqual(fiction.slug, "fiction")
+
+    def test_slug_taken_concurrently(self):
+        books = Category.add_root(name="Books")
+        books.add_child(name="Fiction")
+        ensure_slug_uniqueness = Category.ensure_slug_uniqueness
+        calls = []
+
+        def race(category):
+            # The first check runs before the other sibling was committed
+            calls.append(category.slug)
+            if len(calls) > 1:
+                ensure_slug_uniqueness(category)
+
+        with mock.patch.object(Category, "ensure_slug_uniqueness", race):
+            fiction = Category.objects.get(pk=books.pk).add_child(name="Fiction")
+        self.assertEqual(calls, ["fiction", "fiction"])
+        self.assertEqual(fiction.slug, "fiction_2")
+        self.assertEqual(fiction.full_slug, "books/fiction_2")
+
+    def test_slug_attempts_exhausted(self):
+        books = Category.add_root(name="Books")
+        books.add_child(name="Fiction")
+        books.refresh_from_db()
+        with mock.patch.object(
+            Category, "ensure_slug_uniqueness", autospec=True
+        ) as ensure_slug_uniqueness:
+            with self.assertRaises(IntegrityError):
+                books.add_child(name="Fiction")
+        self.assertEqual(ensure_slug_uniqueness.call_count, Category.slug_attempts)
+        self.assertEqual(Category.objects.count(), 2)
+
+    def test_load_bulk(self):
+        books = Category.add_root(name="Books")
+        books.add_child(name="Fiction")
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = Category.load_bulk(
+                [
+                    {
+                        "data": {"name": "Fiction"},
+                        "children": [{"data": {"name": "Crime"}}],
+                    },
+                    {"data": {"name": "Science"}},
+                ],
+                parent=books,
+            )
+        categories = Category.objects.filter(pk__in=ids).order_by("path")
+        self.assertEqual(
+            [(category.full_name, category.full_slug) for category in categories],
+            [
+                ("Books > Fiction", "books/fiction_2"),
+                ("Books > Fiction > Crime", "books/fiction_2/crime"),
+                ("Books > Science", "books/science"),
+            ],
+        )
+        self.assertEqual([category.numchild for category in categories], [1, 0, 0])
+        self.assertEqual(Category.objects.get(pk=books.pk).numchild, 3)
+        self.assertEqual(Category.find_problems(), ([], [], [], [], []))
+
+    def test_move_subtree(self):
+        books = Category.add_root(name="Books")
+        fiction = books.add_child(name="Fiction")
+        crime = fiction.add_child(name="Crime")
+        science = Category.add_root(name="Science")
+        science.add_child(name="Fiction")
+        fiction.refresh_from_db()
+        with self.assertRaises(InvalidMoveToDescendant):
+            fiction.move_subtree(crime)
+
+        fiction.move_subtree(science)
+        crime.refresh_from_db()
+        self.assertEqual(fiction.full_slug, "science/fiction_2")
+        self.assertEqual(crime.full_name, "Science > Fiction > Crime")
+        self.assertEqual(crime.depth, 3)
+        fiction.move_subtree()
+        crime.refresh_from_db()
+        self.assertEqual(crime.full_slug, "fiction_2/crime")
+        self.assertEqual(crime.depth, 2)
+        self.assertEqual(
+            [category.numchild for category in Category.get_root_nodes()], [0, 1, 1]
+        )
+        self.assertEqual(Category.find_problems(), ([], [], [], [], []))
+
+
+class CategoryTreeTests(TestCase):
+    def test_rebuilt_on_write(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            books = Category.add_root(name="Books")
+        tree = get_category_tree()
+        self.assertIs(get_category_tree(), tree)
+        with self.captureOnCommitCallbacks(execute=True):
+            books.add_child(name="Fiction")
+        self.assertEqual(
+            [category.name for category in get_category_tree().get_children(books.pk)],
+            ["Fiction"],
+        )
+
+    def test_expires(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.add_root(name="Books")
+        get_category_tree()
+        # As written by a process not sharing the cache
+        Category.objects.update(name="Novels")
+        self.assertEqual(get_category_tree().get_roots()[0].name, "Books")
+        with override_settings(CATALOGUE_LOCAL_CACHE_TIMEOUT=0):
+            self.assertEqual(get_category_tree().get_roots()[0].name, "Novels")
+
+
+class InMemorySearchBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        book = ProductType.objects.create(name="Book")
+        for upc, name in (
+            ("book-1", "Red apple"),
+            ("book-2", "Apple pie with apple"),
+            ("book-3", "Pear"),
+        ):
+            Product.objects.create(upc=upc, name=name, product_type=book)
+
+    def setUp(self):
+        # The backend of the test settings, the only one listening to writes
+        self.backend = get_search_backend()
+        self.assertIsInstance(self.backend, InMemorySearchBackend)
+        # Its index outlives the rollback of each test
+        next_version(VERSION_KEY)
+        self.addCleanup(next_version, VERSION_KEY)
+
+    def search(self, text):
+        return list(
+            self.backend.search(text)
+            .order_by("-search_rank", "id")
+            .values_list("upc", "search_rank")
+        )
+
+    def test_ranked(self):
+        hits = self.search("app")
+        self.assertEqual([upc for upc, _ in hits], ["book-2", "book-1"])
+        self.assertGreater(hits[0][1], hits[1][1])
+        self.assertEqual([upc for upc, _ in self.search("apple red")], ["book-1"])
+        self.assertEqual(self.search("banana"), [])
+
+    def test_missing_description_not_indexed(self):
+        self.assertIsNone(Product.objects.get(upc="book-3").description)
+        self.assertEqual(self.search("none"), [])
+
+    def test_bulk_changed_updates_listed_products(self):
+        self.search("apple")
+        index = self.backend.index
+        pear = Product.objects.get(upc="book-3")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=pear.pk).update(name="Apple pear")
+            bulk_changed.send(sender=Product, product_ids=[pear.pk])
+        self.assertEqual([upc for upc, _ in self.search("pear")], ["book-3"])
+        self.assertIs(self.backend.index, index)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_changed.send(sender=Product)
+        self.search("pear")
+        self.assertIsNot(self.backend.index, index)
+
+    def test_expires(self):
+        self.search("apple")
+        # As written by a process not sharing the cache
+        Product.objects.filter(upc="book-3").update(name="Banana")
+        self.assertEqual(self.search("banana"), [])
+        with override_settings(CATALOGUE_LOCAL_CACHE_TIMEOUT=0):
+            self.assertEqual(len(self.search("banana")), 1)
+
+
+class ProductDocumentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        book = ProductType.objects.create(name="Book")
+        cls.product = Product.objects.create(
+            upc="book-1", name="Book", product_type=book
+        )
+        cls.published = ProductAttribute.objects.create(
+            product_type=book,
+            name="Published",
+            code="published",
+            type=ProductAttribute.DATETIME,
+        )
+
+    def test_round_trip(self):
+        value = ProductAttributeValue(product=self.product, attribute=self.published)
+        value.value = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        value.save()
+        documents.refresh_documents()
+        product = documents.product_from_document(
+            ProductDocument.objects.get(product=self.product).data
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(product.product_type.name, "Book")
+            self.assertEqual(
+                [value.value for value in product.attribute_values.all()],
+                [datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)],
+            )
+
+    def test_refreshed_once_per_transaction(self):
+        value = ProductAttributeValue(product=self.product, attribute=self.published)
+        with mock.patch.object(
+            documents, "refresh_documents", wraps=documents.refresh_documents
+        ) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                for sender, instance in (
+                    (Product, self.product),
+                    (ProductAttributeValue, value),
+                    (ProductAttributeValue, value),
+                ):
+                    documents.refresh_product_on_commit(sender, instance)
+        self.assertEqual(refresh.call_count, 1)
+        self.assertTrue(ProductDocument.objects.filter(product=self.product).exists())
+
+
+class AttributeSchemaTests(TestCase):
+    def test_rebuilt_on_write_and_expires(self):
+        # Ids are used again once the test's rows are rolled back
+        self.addCleanup(invalidate_attribute_schemas)
+        book = ProductType.objects.create(name="Book")
+        self.assertFalse(book.has_attributes)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductAttribute.objects.create(
+                product_type=book,
+                name="Pages",
+                code="pages",
+                type=ProductAttribute.INTEGER,
+            )
+        self.assertIn("pages", get_attribute_schema(book.pk))
+        self.assertTrue(book.has_attributes)
+        # As written by a process not sharing the cache
+        ProductAttribute.objects.update(code="page_count")
+        self.assertIn("pages", get_attribute_schema(book.pk))
+        with override_settings(CATALOGUE_LOCAL_CACHE_TIMEOUT=0):
+            self.assertIn("page_count", get_attribute_schema(book.pk))
+
+
+class SetAttributesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = ProductType.objects.create(name="Book")
+        for code, attribute_type, required in (
+            ("isbn", ProductAttribute.TEXT, True),
+            ("pages", ProductAttribute.INTEGER, False),
+            ("weight", ProductAttribute.FLOAT, False),
+            ("hardcover", ProductAttribute.BOOLEAN, False),
+            ("published", ProductAttribute.DATE, False),
+        ):
+            ProductAttribute.objects.create(
+                product_type=cls.book,
+                name=code.title(),
+                code=code,
+                type=attribute_type,
+                required=required,
+            )
+        # Bound to no type, shared by all
+        ProductAttribute.objects.create(
+            name="Colour", code="colour", type=ProductAttribute.TEXT
+        )
+        Product.objects.bulk_create(
+            Product(upc=f"book-{i}", name=f"Book {i}", product_type=cls.book)
+            for i in range(30)
+        )
+        cls.products = list(Product.objects.order_by("pk"))
+
+    def setUp(self):
+        # Ids are used again once the test's rows are rolled back
+        invalidate_attribute_schemas()
+        self.addCleanup(invalidate_attribute_schemas)
+        # Built once per process, not part of the writes measured below
+        get_attribute_schema(self.book.pk)
+
+    @staticmethod
+    def get_values(product):
+        return {
+            value.attribute.code: value.value
+            for value in product.attribute_values.select_related("attribute")
+        }
+
+    def test_set_attributes(self):
+        product = self.products[0]
+        product.set_attributes(
+            {"isbn": "978-0", "pages": "295", "weight": 0.5, "colour": "red"}
+        )
+        self.assertEqual(
+            self.get_values(product),
+            {"isbn": "978-0", "pages": 295, "weight": 0.5, "colour": "red"},
+        )
+        product.set_attributes({"pages": 300, "weight": None, "colour": ""})
+        self.assertEqual(self.get_values(product), {"isbn": "978-0", "pages": 300})
+
+    def test_errors_keyed_by_code(self):
+        product = self.products[0]
+        with self.assertRaises(ValidationError) as raised:
+            product.set_attributes(
+                {
+                    "isbn": None,
+                    "pages": "many",
+                    "hardcover": "yes",
+                    "published": "2020-01-02",
+                    "unknown": 1,
+                }
+            )
+        self.assertEqual(
+            sorted(raised.exception.message_dict),
+            ["hardcover", "isbn", "pages", "published", "unknown"],
+        )
+        self.assertEqual(self.get_values(product), {})
+
+        with self.assertRaises(ValidationError) as raised:
+            Product.bulk_set_attributes(
+                {self.products[0]: {"pages": 1}, self.products[1]: {"pages": "x"}}
+            )
+        self.assertEqual(list(raised.exception.message_dict), ["book-1.pages"])
+        # Nothing is written when any value is invalid
+        self.assertFalse(ProductAttributeValue.objects.exists())
+
+    def test_coerced_from_text(self):
+        cleaned = get_attribute_schema(self.book.pk).clean(
+            {
+                "pages": "295",
+                "weight": "0.5",
+                "hardcover": "yes",
+                "published": "2020-01-02",
+            },
+            partial=True,
+            coerce=True,
+        )
+        self.assertEqual(
+            [value for _, value in cleaned], [295, 0.5, True, date(2020, 1, 2)]
+        )
+        with self.assertRaises(ValidationError) as raised:
+            get_attribute_schema(self.book.pk).clean(
+                {"published": "soon"}, partial=True, coerce=True
+            )
+        self.assertEqual(list(raised.exception.message_dict), ["published"])
+
+    def test_bulk_query_counts(self):
+        values = {"isbn": "978-0", "pages": 100, "colour": "red"}
+        # Select, savepoint, insert, release
+        with self.assertNumQueries(4):
+            Product.bulk_set_attributes(
+                {product: values for product in self.products[:15]}
+            )
+        self.assertEqual(ProductAttributeValue.objects.count(), 45)
+
+        values = {"pages": 200, "weight": 1.5, "isbn": "978-1", "colour": None}
+        # Select, savepoint, select and delete (for post_delete), insert,
+        # update of all changed columns at once, release
+        with self.assertNumQueries(7):
+            Product.bulk_set_attributes({product: values for product in self.products})
+        self.assertEqual(ProductAttributeValue.objects.count(), 90)
+
+
+class FacetCountsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Schemas cached by earlier tests may hold rolled back attributes
+        invalidate_attribute_schemas()
+        cls.book = ProductType.objects.create(name="Book")
+        cls.pen = ProductType.objects.create(name="Pen")
+        for product_type, code, attribute_type in (
+            (None, "colour", ProductAttribute.TEXT),
+            (cls.book, "pages", ProductAttribute.INTEGER),
+            (cls.book, "hardcover", ProductAttribute.BOOLEAN),
+        ):
+            ProductAttribute.objects.create(
+                product_type=product_type,
+                name=code.title(),
+                code=code,
+                type=attribute_type,
+            )
+        cls.fiction = Category.add_root(name="Fiction")
+        cls.science = Category.add_root(name="Science")
+        for upc, product_type, values, categories in (
+            (
+                "book-1",
+                cls.book,
+                {"colour": "red", "pages": 100, "hardcover": True},
+                [cls.fiction],
+            ),
+            (
+                "book-2",
+                cls.book,
+                {"colour": "red", "pages": 200},
+                [cls.fiction, cls.science],
+            ),
+            ("book-3", cls.book, {"colour": "blue", "pages": 100}, []),
+            ("pen-1", cls.pen, {"colour": "red"}, []),
+        ):
+            product = Product.objects.create(
+                upc=upc, name=upc, product_type=product_type
+            )
+            product.set_attributes(values)
+            product.categories.set(categories)
+
+    def setUp(self):
+        # Ids are used again once the test's rows are rolled back
+        invalidate_attribute_schemas()
+        self.addCleanup(invalidate_attribute_schemas)
+
+    def test_counts_per_value(self):
+        with self.assertNumQueries(1):
+            counts = Product.objects.all().facet_counts()
+        self.assertEqual(
+            counts,
+            {
+                "attributes": {
+                    "colour": {"red": 3, "blue": 1},
+                    "pages": {"100": 2, "200": 1},
+                    "hardcover": {"True": 1},
+                },
+                "categories": {self.fiction.pk: 2, self.science.pk: 1},
+                "product_types": {self.book.pk: 3, self.pen.pk: 1},
+            },
+        )
+
+    def test_filters_narrow_counts(self):
+        products = Product.objects.filter_attributes(colour__exact="red")
+        self.assertEqual(
+            products.facet_counts(),
+            {
+                "attributes": {
+                    "colour": {"red": 3},
+                    "pages": {"100": 1, "200": 1},
+                    "hardcover": {"True": 1},
+                },
+                "categories": {self.fiction.pk: 2, self.science.pk: 1},
+                "product_types": {self.book.pk: 2, self.pen.pk: 1},
+            },
+        )
+        products = products.filter_attributes(pages__gte=150)
+        self.assertEqual(
+            products.facet_counts(["pages"], product_types=False),
+            {
+                "attributes": {"pages": {"200": 1}},
+                "categories": {self.fiction.pk: 1, self.science.pk: 1},
+                "product_types": {},
+            },
+        )
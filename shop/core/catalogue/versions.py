@@ -0,0 +1,71 @@
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Warning as CheckWarning
+from django.core.checks import register
+
+__all__ = ["get_version", "next_version", "is_stale", "check_shared_cache"]
+
+# Backends whose entries other processes cannot see
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+def get_version(key: str):
+    """
+    Returns the version stored under a key of the default cache, which process
+    local caches, e.g. the category tree, compare with the version they were
+    built at to learn about writes in other processes.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def next_version(key: str) -> Optional[int]:
+    """
+    Moves a version on, so every process rebuilds what it holds at the old
+    one. Returns the new version, or None when it was missing.
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # A missing version must never fall back to one used before
+        cache.set(key, time.time_ns(), None)
+        return None
+
+
+def is_stale(version, built_at: float, current_version) -> bool:
+    """
+    Tells whether a process-local cache built at `version` and at the
+    time.monotonic() `built_at` has to be rebuilt: when the version moved on,
+    or after CATALOGUE_LOCAL_CACHE_TIMEOUT seconds, for writes a cache which
+    is not shared between processes never told about.
+    """
+    if version != current_version:
+        return True
+    timeout = getattr(settings, "CATALOGUE_LOCAL_CACHE_TIMEOUT", 60)
+    return timeout is not None and time.monotonic() - built_at >= timeout
+
+
+@register("caches", deploy=True)
+def check_shared_cache(**_kwargs):
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        CheckWarning(
+            "The default cache is local to each process, so the catalogue's "
+            "process-local caches only see writes made by other processes "
+            "after CATALOGUE_LOCAL_CACHE_TIMEOUT seconds.",
+            hint="Use a cache shared by all processes, e.g. RedisCache, when "
+            "running more than one.",
+            id="catalogue.W001",
+        )
+    ]
@@ -0,0 +1,25 @@
+from django.contrib.auth.decorators import permission_required
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from core.catalogue.exporter import CatalogueExporter, to_csv, to_jsonl
+
+CONTENT_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+@require_GET
+@permission_required("catalogue.view_product", raise_exception=True)
+def export_catalogue(request, export_format):
+    """
+    Streams the whole catalogue in the format of the export_catalogue command.
+    """
+    exporter = CatalogueExporter()
+    if export_format == "csv":
+        lines = to_csv(exporter.records(), exporter.get_attribute_codes())
+    else:
+        lines = to_jsonl(exporter.records())
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[export_format])
+    response[
+        "Content-Disposition"
+    ] = f'attachment; filename="catalogue.{export_format}"'
+    return response
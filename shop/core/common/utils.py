@@ -0,0 +1,17 @@
+TRUE_VALUES = frozenset(("1", "true", "t", "yes", "y", "on"))
+FALSE_VALUES = frozenset(("0", "false", "f", "no", "n", "off"))
+
+
+def to_bool(value):
+    """
+    Parses a boolean written as text, e.g. in a CSV file.
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in TRUE_VALUES:
+        return True
+    if normalized in FALSE_VALUES:
+        return False
+    raise ValueError(f"Not a boolean: {value!r}")
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class GraphqlApiConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "graphql_api"
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        from graphql_api import signals, tracing  # noqa: F401
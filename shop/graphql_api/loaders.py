@@ -0,0 +1,177 @@
+from collections import defaultdict
+from typing import Optional
+
+from django.db.models import Model
+from graphql import ResolveInfo
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from core.catalogue.documents import documents_enabled, product_from_document
+from core.catalogue.models import (
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductDocument,
+    ProductType,
+)
+from graphql_api.pagination import first_per_key, page_size
+from graphql_api.thread_pool import run_sync
+from graphql_api.tracing import traced
+
+__all__ = ["Loaders", "get_loaders"]
+
+
+class BatchLoader(DataLoader):
+    """
+    A data loader calling load_batch(keys) through run_sync, i.e. on the
+    thread pool in async requests.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(batch_load_fn=self.dispatch_batch, **kwargs)
+
+    def dispatch_batch(self, keys):
+        with traced(type(self).__name__):
+            return Promise.resolve(run_sync(self.load_batch, keys))
+
+    def load_batch(self, keys):
+        raise NotImplementedError
+
+
+class ModelByIdLoader(BatchLoader):
+    """
+    Loads model instances by primary key, one query per batch.
+    Missing keys resolve to None.
+    """
+
+    model: type[Model]
+
+    def load_batch(self, keys):
+        objects = self.model.objects.in_bulk(keys)
+        return [objects.get(key) for key in keys]
+
+
+class RelatedListLoader(BatchLoader):
+    """
+    Loads the reverse side of a foreign key, e.g. all children of given parents,
+    one query per batch. Every key resolves to a (possibly empty) list, of
+    at most `limit` objects when given, cut in SQL.
+    """
+
+    model: type[Model]
+    key_field: str
+
+    def __init__(self, limit: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.limit = limit
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def load_batch(self, keys):
+        attname = self.model._meta.get_field(self.key_field).attname
+        queryset = self.get_queryset().filter(**{f"{attname}__in": keys})
+        if not queryset.ordered:
+            # Lists are cut to a page, always the same one
+            queryset = queryset.order_by("pk")
+        if self.limit is not None:
+            queryset = first_per_key(queryset, attname, self.limit)
+        grouped = defaultdict(list)
+        for obj in queryset:
+            grouped[getattr(obj, attname)].append(obj)
+        return [grouped[key] for key in keys]
+
+
+class ProductLoader(ModelByIdLoader):
+    model = Product
+
+
+class ProductDocumentLoader(BatchLoader):
+    """
+    Loads products from their documents, one lookup by primary key per batch.
+    Products without a document yet are read from the product table.
+    """
+
+    def load_batch(self, keys):
+        products = {
+            pk: product_from_document(document.data)
+            for pk, document in ProductDocument.objects.in_bulk(keys).items()
+        }
+        missing = [key for key in keys if key not in products]
+        if missing:
+            products.update(Product.objects.in_bulk(missing))
+        return [products.get(key) for key in keys]
+
+
+class ProductTypeLoader(ModelByIdLoader):
+    model = ProductType
+
+
+class ProductAttributeLoader(ModelByIdLoader):
+    model = ProductAttribute
+
+
+class AttributeValuesByProductLoader(RelatedListLoader):
+    model = ProductAttributeValue
+    key_field = "product"
+
+
+class ChildrenByParentLoader(RelatedListLoader):
+    model = Product
+    key_field = "parent"
+
+
+class ProductsByTypeLoader(RelatedListLoader):
+    model = Product
+    key_field = "product_type"
+
+
+class CategoryLinksByProductLoader(RelatedListLoader):
+    model = ProductCategory
+    key_field = "product"
+
+    def get_queryset(self):
+        return self.model.objects.only("product_id", "category_id")
+
+
+class Loaders:
+    """
+    A set of data loaders living as long as one GraphQL request,
+    so their caches never serve data across requests. In async requests
+    batches are loaded on the thread pool, see graphql_api.thread_pool.
+    """
+
+    def __init__(self):
+        self.product = (
+            ProductDocumentLoader() if documents_enabled() else ProductLoader()
+        )
+        self.product_type = ProductTypeLoader()
+        self.attribute = ProductAttributeLoader()
+        self.attribute_values_by_product = AttributeValuesByProductLoader()
+        # (loader class, page size) -> loader of lists cut to that size
+        self.paged_loaders = {}
+
+    def get_paged(self, loader_class, first=None) -> RelatedListLoader:
+        size = page_size(first)
+        loader = self.paged_loaders.get((loader_class, size))
+        if loader is None:
+            loader = self.paged_loaders[loader_class, size] = loader_class(limit=size)
+        return loader
+
+    def children_by_parent(self, first=None) -> ChildrenByParentLoader:
+        return self.get_paged(ChildrenByParentLoader, first)
+
+    def products_by_type(self, first=None) -> ProductsByTypeLoader:
+        return self.get_paged(ProductsByTypeLoader, first)
+
+    def category_links_by_product(self, first=None) -> CategoryLinksByProductLoader:
+        return self.get_paged(CategoryLinksByProductLoader, first)
+
+
+def get_loaders(info: ResolveInfo) -> Loaders:
+    loaders = getattr(info.context, "loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        info.context.loaders = loaders
+    return loaders
@@ -0,0 +1,96 @@
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Optional
+
+from graphql_api.tracing import Trace
+
+__all__ = ["Metrics", "get_metrics"]
+
+NANOSECONDS = 1e9
+
+
+class Metrics:
+    """
+    Totals of the traced GraphQL requests of this process, rendered in the
+    Prometheus text format. Every process of a server keeps its own, scrape
+    each of them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.duration = 0
+        self.cost = 0
+        # "Type.field" -> [count, duration]
+        self.fields = defaultdict(lambda: [0, 0])
+        # resolver or loader -> [count, duration]
+        self.sql = defaultdict(lambda: [0, 0])
+
+    def observe(self, trace: Trace, failed=False, cost: Optional[int] = None):
+        with self.lock, trace.lock:
+            self.requests += 1
+            self.errors += failed
+            self.duration += trace.duration
+            self.cost += cost or 0
+            for name, (count, duration) in trace.fields.items():
+                self.fields[name][0] += count
+                self.fields[name][1] += duration
+            for source, (count, duration) in trace.sql.items():
+                self.sql[source][0] += count
+                self.sql[source][1] += duration
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [
+                "# HELP graphql_requests_total GraphQL requests executed.",
+                "# TYPE graphql_requests_total counter",
+                f"graphql_requests_total {self.requests}",
+                "# HELP graphql_request_errors_total GraphQL requests with errors.",
+                "# TYPE graphql_request_errors_total counter",
+                f"graphql_request_errors_total {self.errors}",
+                "# HELP graphql_request_duration_seconds_total Time spent executing"
+                " GraphQL requests.",
+                "# TYPE graphql_request_duration_seconds_total counter",
+                "graphql_request_duration_seconds_total "
+                f"{self.duration / NANOSECONDS}",
+                "# HELP graphql_query_cost_total Estimated cost of the GraphQL"
+                " requests, see graphql_api.query_cost.",
+                "# TYPE graphql_query_cost_total counter",
+                f"graphql_query_cost_total {self.cost}",
+                "# HELP graphql_field_duration_seconds Time until a field's value"
+                " is resolved, in the requests asking for a trace.",
+                "# TYPE graphql_field_duration_seconds summary",
+            ]
+            for name, (count, duration) in sorted(self.fields.items()):
+                lines.append(
+                    f'graphql_field_duration_seconds_count{{field="{name}"}} {count}'
+                )
+                lines.append(
+                    f'graphql_field_duration_seconds_sum{{field="{name}"}} '
+                    f"{duration / NANOSECONDS}"
+                )
+            lines += [
+                "# HELP graphql_sql_queries_total SQL queries run by a resolver or"
+                " data loader.",
+                "# TYPE graphql_sql_queries_total counter",
+            ]
+            for source, (count, _) in sorted(self.sql.items()):
+                lines.append(f'graphql_sql_queries_total{{source="{source}"}} {count}')
+            lines += [
+                "# HELP graphql_sql_duration_seconds_total Time spent in SQL queries"
+                " by a resolver or data loader.",
+                "# TYPE graphql_sql_duration_seconds_total counter",
+            ]
+            for source, (_, duration) in sorted(self.sql.items()):
+                lines.append(
+                    f'graphql_sql_duration_seconds_total{{source="{source}"}} '
+                    f"{duration / NANOSECONDS}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=None)
+def get_metrics() -> Metrics:
+    return Metrics()
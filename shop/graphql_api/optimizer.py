@@ -0,0 +1,231 @@
+from typing import Sequence
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model, Prefetch, QuerySet
+from graphene.utils.str_converters import to_snake_case
+from graphql import GraphQLError, ResolveInfo
+from graphql.language import ast
+from graphql.type.definition import get_named_type
+
+from graphql_api.pagination import first_per_key, page_size
+
+__all__ = [
+    "register_hints",
+    "get_selections",
+    "optimize",
+    "is_fetched",
+    "is_included",
+]
+
+# model -> graphql field name -> model selections the field's resolver reads
+_hints: dict = {}
+
+# Key of the selections of a field taking `first`, holding its page size
+PAGE_SIZE = "__page_size__"
+
+
+def register_hints(model: type[Model], **expansions: dict):
+    """
+    Declares which model fields a resolver reads when the GraphQL field does not
+    map one to one onto a model field, e.g. an attribute value's `attribute`
+    field, which only reads `attribute.code`:
+
+        register_hints(ProductAttributeValue, attribute={"attribute": {"code": {}}})
+    """
+    _hints.setdefault(model, {}).update(expansions)
+
+
+def is_included(node, variables: dict) -> bool:
+    """
+    Tells whether a selection is kept by its @skip and @include directives.
+    """
+    for directive in node.directives or []:
+        name = directive.name.value
+        if name not in ("skip", "include"):
+            continue
+        condition = next(
+            (arg.value for arg in directive.arguments if arg.name.value == "if"), None
+        )
+        if isinstance(condition, ast.Variable):
+            flag = bool(variables.get(condition.name.value))
+        else:
+            flag = bool(getattr(condition, "value", False))
+        if (name == "skip") == flag:
+            return False
+    return True
+
+
+def _get_page_size(node: ast.Field, info: ResolveInfo):
+    value = next(
+        (arg.value for arg in node.arguments if arg.name.value == "first"), None
+    )
+    if isinstance(value, ast.Variable):
+        value = info.variable_values.get(value.name.value)
+    elif isinstance(value, ast.IntValue):
+        value = int(value.value)
+    try:
+        return page_size(value if isinstance(value, int) else None)
+    except GraphQLError:
+        # Reported by the field's resolver
+        return None
+
+
+def _collect(target: dict, selection_set, info: ResolveInfo, parent_type) -> dict:
+    for node in selection_set.selections:
+        if not is_included(node, info.variable_values):
+            continue
+        if isinstance(node, ast.Field):
+            name = node.name.value
+            if name.startswith("__"):
+                continue
+            children = target.setdefault(to_snake_case(name), {})
+            field = getattr(parent_type, "fields", {}).get(name)
+            if field is not None and "first" in field.args:
+                size = _get_page_size(node, info)
+                if size is not None:
+                    # Aliases of one field share the prefetch, the largest wins
+                    children[PAGE_SIZE] = max(size, children.get(PAGE_SIZE, 0))
+            if node.selection_set:
+                _collect(
+                    children,
+                    node.selection_set,
+                    info,
+                    get_named_type(field.type) if field is not None else None,
+                )
+        elif isinstance(node, ast.FragmentSpread):
+            fragment = info.fragments[node.name.value]
+            _collect(
+                target,
+                fragment.selection_set,
+                info,
+                info.schema.get_type(fragment.type_condition.name.value),
+            )
+        elif isinstance(node, ast.InlineFragment):
+            fragment_type = parent_type
+            if node.type_condition:
+                fragment_type = info.schema.get_type(node.type_condition.name.value)
+            _collect(target, node.selection_set, info, fragment_type)
+    return target
+
+
+def _merge(target: dict, source: dict) -> dict:
+    for name, children in source.items():
+        if name != PAGE_SIZE:
+            _merge(target.setdefault(name, {}), children)
+    return target
+
+
+def get_selections(info: ResolveInfo, path: Sequence[str] = ()) -> dict:
+    """
+    Returns the fields selected below the resolved field as a nested dict of
+    snake_case names, following `path` (e.g. ("edges", "node")) first.
+    Fragments are inlined and @skip/@include are honoured. The selections
+    of a field taking `first` hold its page size under PAGE_SIZE.
+    """
+    selections = {}
+    return_type = get_named_type(info.return_type)
+    for field_ast in info.field_asts:
+        if field_ast.selection_set:
+            _collect(selections, field_ast.selection_set, info, return_type)
+    for name in path:
+        selections = selections.get(name, {})
+    return selections
+
+
+class QueryPlan:
+    def __init__(self):
+        self.only = set()
+        self.select_related = set()
+        self.prefetch = []
+
+    def build(self, model: type[Model], selections: dict, prefix: str = ""):
+        self.only.add(prefix + model._meta.pk.name)
+        hints = _hints.get(model, {})
+        expanded, sizes = {}, {}
+        for name, children in selections.items():
+            if name == PAGE_SIZE:
+                continue
+            expansion = hints.get(name, {name: children})
+            _merge(expanded, expansion)
+            if PAGE_SIZE in children:
+                for relation in expansion:
+                    sizes[relation] = max(children[PAGE_SIZE], sizes.get(relation, 0))
+
+        for name, children in expanded.items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            path = prefix + name
+            if not field.is_relation:
+                self.only.add(path)
+            elif field.concrete and (field.many_to_one or field.one_to_one):
+                self.only.add(path)
+                if children:
+                    self.select_related.add(path)
+                    self.build(field.related_model, children, f"{path}__")
+            else:
+                if field.auto_created and not field.concrete:
+                    # Reverse relations are prefetched through their accessor,
+                    # e.g. "productcategory_set" for "productcategory"
+                    path = prefix + field.get_accessor_name()
+                self.prefetch.append(
+                    Prefetch(
+                        path,
+                        queryset=self._related_queryset(
+                            field, children, sizes.get(name)
+                        ),
+                    )
+                )
+
+    @staticmethod
+    def _related_queryset(field, selections: dict, size=None) -> QuerySet:
+        plan = QueryPlan()
+        plan.build(field.related_model, selections)
+        if not field.many_to_many:
+            # The foreign key pointing back is needed to match rows to owners
+            plan.only.add(field.field.name)
+        queryset = field.related_model.objects.all()
+        if not queryset.ordered:
+            # Lists are cut to a page, always the same one
+            queryset = queryset.order_by("pk")
+        if size is not None and not field.many_to_many:
+            queryset = first_per_key(queryset, field.field.attname, size)
+        return plan.apply(queryset)
+
+    def apply(self, queryset: QuerySet) -> QuerySet:
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch)
+        return queryset.only(*sorted(self.only))
+
+
+def optimize(
+    queryset: QuerySet,
+    info: ResolveInfo,
+    path: Sequence[str] = (),
+    only: Sequence[str] = (),
+) -> QuerySet:
+    """
+    Restricts the queryset to the columns, joins and prefetches the GraphQL
+    selection below `path` reads. Extra columns the caller itself needs,
+    e.g. sort keys, go to `only`.
+    """
+    plan = QueryPlan()
+    plan.build(queryset.model, get_selections(info, path))
+    plan.only.update(only)
+    return plan.apply(queryset)
+
+
+def is_fetched(instance: Model, name: str) -> bool:
+    """
+    Tells whether a relation was already loaded by select_related or
+    prefetch_related, so a resolver can use it instead of a data loader.
+    """
+    field = instance._meta.get_field(name)
+    if field.concrete and (field.many_to_one or field.one_to_one):
+        return field.is_cached(instance)
+    if field.auto_created and not field.concrete:
+        name = field.get_accessor_name()
+    return name in getattr(instance, "_prefetched_objects_cache", {})
@@ -0,0 +1,137 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+from typing import Optional, Sequence, Type
+
+from django.conf import settings
+from django.db.models import OuterRef, Q, QuerySet, Subquery
+from graphene import relay
+from graphql import GraphQLError
+from promise import Promise
+
+__all__ = [
+    "encode_cursor",
+    "decode_cursor",
+    "page_size",
+    "connection_from_keyset",
+    "first_items",
+    "first_per_key",
+]
+
+
+def encode_cursor(values: Sequence) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError) as ex:
+        raise GraphQLError(f"Invalid cursor: {cursor}") from ex
+    if not isinstance(values, list) or len(values) != size:
+        raise GraphQLError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def _after_condition(sort_fields: Sequence[str], values: Sequence) -> Q:
+    """
+    Builds the keyset predicate `(a, b) > (x, y)` as
+    `a > x OR (a = x AND b > y)`, so the database can seek on the
+    (a, b) index instead of skipping rows with OFFSET. Descending fields,
+    prefixed with "-", compare with < instead.
+    """
+    conditions = []
+    for i, field in enumerate(sort_fields):
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition = Q(**{f"{field.lstrip('-')}__{lookup}": values[i]})
+        for prev_field, prev_value in zip(sort_fields[:i], values[:i]):
+            condition &= Q(**{prev_field.lstrip("-"): prev_value})
+        conditions.append(condition)
+    return reduce(or_, conditions)
+
+
+def page_size(first: Optional[int]) -> int:
+    """
+    Returns the number of items a `first` argument asks for, within
+    GRAPHQL_MAX_PAGE_SIZE, GRAPHQL_DEFAULT_PAGE_SIZE without it.
+    """
+    default_size = getattr(settings, "GRAPHQL_DEFAULT_PAGE_SIZE", 20)
+    max_size = getattr(settings, "GRAPHQL_MAX_PAGE_SIZE", 100)
+    if first is None:
+        return default_size
+    if first < 0:
+        raise GraphQLError("Argument 'first' must be a non-negative integer")
+    return min(first, max_size)
+
+
+def connection_from_keyset(
+    connection_type: Type[relay.Connection],
+    queryset: QuerySet,
+    sort_fields: Sequence[str],
+    first: Optional[int] = None,
+    after: Optional[str] = None,
+) -> relay.Connection:
+    """
+    Slices a queryset into a relay connection using keyset pagination.
+
+    The last of `sort_fields` must be unique (usually "id") so that every
+    row has a distinct position. Fields may be annotations and may be
+    descending, e.g. ("-rank", "id"). At most `first + 1` rows are fetched, the
+    extra one only tells whether there is a next page. After a cursor, one
+    more query tells whether any row comes before it.
+    """
+    size = page_size(first)
+    has_previous_page = False
+    if after is not None:
+        condition = _after_condition(
+            sort_fields, decode_cursor(after, len(sort_fields))
+        )
+        has_previous_page = queryset.exclude(condition).exists()
+        queryset = queryset.filter(condition)
+    nodes = list(queryset.order_by(*sort_fields)[: size + 1])
+    has_next_page = len(nodes) > size
+    nodes = nodes[:size]
+
+    edges = [
+        connection_type.Edge(
+            node=node,
+            cursor=encode_cursor(
+                getattr(node, field.lstrip("-")) for field in sort_fields
+            ),
+        )
+        for node in nodes
+    ]
+    page_info = relay.PageInfo(
+        start_cursor=edges[0].cursor if edges else None,
+        end_cursor=edges[-1].cursor if edges else None,
+        has_previous_page=has_previous_page,
+        has_next_page=has_next_page,
+    )
+    return connection_type(edges=edges, page_info=page_info)
+
+
+def first_items(items, first: Optional[int] = None) -> Promise:
+    """
+    Bounds a list field like a page: resolves to at most `first` of the items,
+    GRAPHQL_DEFAULT_PAGE_SIZE without it. `items` may be a promise.
+    """
+    size = page_size(first)
+    return Promise.resolve(items).then(lambda values: list(values)[:size])
+
+
+def first_per_key(queryset: QuerySet, key_field: str, size: int) -> QuerySet:
+    """
+    Cuts a queryset to its first `size` rows per value of `key_field`, in the
+    queryset's order, by primary key without one, so a nested list is
+    bounded in SQL rather than after fetching every row. Each row is checked
+    against the first rows of its key, found through the key's index.
+    """
+    ordering = queryset.query.order_by or queryset.model._meta.ordering or ("pk",)
+    first_rows = (
+        queryset.filter(**{key_field: OuterRef(key_field)})
+        .order_by(*ordering)
+        .values("pk")[:size]
+    )
+    return queryset.filter(pk__in=Subquery(first_rows))
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Optional
+
+from django.conf import settings
+from graphql import GraphQLError, parse, validate
+from graphql.backend import GraphQLCoreBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+
+__all__ = [
+    "hash_query",
+    "PersistedQueryNotFound",
+    "DocumentCacheBackend",
+    "get_document_backend",
+    "get_allowlist",
+]
+
+
+def hash_query(query: str) -> str:
+    """
+    Persisted query id, the same sha256 hex digest Apollo clients send as
+    `extensions.persistedQuery.sha256Hash`.
+    """
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class PersistedQueryNotFound(GraphQLError):
+    """
+    The error for a persisted query hash the server does not know. Apollo
+    clients expect it with HTTP 200 and then retry with the query text.
+    """
+
+    def __init__(self):
+        super().__init__(
+            "PersistedQueryNotFound", extensions={"code": "PERSISTED_QUERY_NOT_FOUND"}
+        )
+
+
+class DocumentCacheBackend(GraphQLCoreBackend):
+    """
+    Keeps the most recently used parsed and validated documents, so a hot
+    query is neither parsed nor validated again. Invalid documents are not
+    cached.
+    """
+
+    def __init__(self, max_size: int, executor=None):
+        super().__init__(executor=executor)
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_document(self, schema, query_hash: str) -> Optional[GraphQLDocument]:
+        with self._lock:
+            document = self._documents.get((schema, query_hash))
+            if document is not None:
+                self._documents.move_to_end((schema, query_hash))
+            return document
+
+    def document_from_string(self, schema, document_string):
+        key = hash_query(document_string)
+        document = self.get_document(schema, key)
+        if document is not None:
+            return document
+
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+        if errors:
+            return GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=lambda *args, **kwargs: ExecutionResult(
+                    errors=errors, invalid=True
+                ),
+            )
+
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(execute, schema, document_ast, **self.execute_params),
+        )
+        with self._lock:
+            self._documents[(schema, key)] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
+
+
+@lru_cache(maxsize=None)
+def get_document_backend() -> DocumentCacheBackend:
+    return DocumentCacheBackend(getattr(settings, "GRAPHQL_DOCUMENT_CACHE_SIZE", 512))
+
+
+@lru_cache(maxsize=None)
+def get_allowlist() -> Optional[dict]:
+    """
+    Returns the {sha256: query} mapping from GRAPHQL_PERSISTED_QUERIES_ALLOWLIST,
+    or None when any query may run.
+    """
+    path = getattr(settings, "GRAPHQL_PERSISTED_QUERIES_ALLOWLIST", None)
+    if path is None:
+        return None
+    with open(path, encoding="utf-8") as allowlist_file:
+        queries = json.load(allowlist_file)
+    if isinstance(queries, list):
+        queries = {hash_query(query): query for query in queries}
+    return queries
@@ -0,0 +1,208 @@
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from graphene import relay
+from graphql import GraphQLError, GraphQLList, GraphQLNonNull
+from graphql.backend import GraphQLDocument
+from graphql.language import ast
+from graphql.type.definition import GraphQLObjectType, get_named_type
+
+from graphql_api.optimizer import is_included
+from graphql_api.response_cache import get_operation
+
+__all__ = ["QueryCost", "register_cost", "get_query_cost", "check_query_cost"]
+
+# "Type.field" -> {"cost": objects charged per item, "size": list size}
+_costs: dict = {}
+
+
+def register_cost(name: str, cost: Optional[int] = None, size: Optional[int] = None):
+    """
+    Declares the cost of a GraphQL field returning objects, 1 per object by
+    default, or the expected size of a list field without a `first`
+    argument, GRAPHQL_QUERY_COST_LIST_SIZE by default, e.g.
+
+        register_cost("Query.facets", cost=10)
+    """
+    options = _costs.setdefault(name, {})
+    if cost is not None:
+        options["cost"] = cost
+    if size is not None:
+        options["size"] = size
+
+
+class QueryCost(NamedTuple):
+    cost: int
+    depth: int
+
+    def as_extension(self) -> dict:
+        return {
+            "requestedQueryCost": self.cost,
+            "maximumAvailable": getattr(settings, "GRAPHQL_MAX_QUERY_COST", None),
+            "depth": self.depth,
+            "maximumDepth": getattr(settings, "GRAPHQL_MAX_QUERY_DEPTH", None),
+        }
+
+
+def _is_list(graphql_type) -> bool:
+    while isinstance(graphql_type, GraphQLNonNull):
+        graphql_type = graphql_type.of_type
+    return isinstance(graphql_type, GraphQLList)
+
+
+def _is_connection(graphql_type) -> bool:
+    graphene_type = getattr(graphql_type, "graphene_type", None)
+    return isinstance(graphene_type, type) and issubclass(
+        graphene_type, relay.Connection
+    )
+
+
+class _Scope(NamedTuple):
+    """
+    Where a selection set is resolved: `count` times, inside a connection
+    when `wrapper`, within the fragments `seen`.
+    """
+
+    count: int
+    wrapper: bool = False
+    seen: tuple = ()
+
+
+class _CostCalculator:
+    """
+    Estimates the objects a query resolves: every field returning objects
+    costs its registered cost for each object, i.e. for each of its items
+    and of the items of the lists around it. Pages count `first` items,
+    other lists their registered size. The edges and nodes of a connection
+    add nothing to the cost of the connection field.
+    """
+
+    def __init__(self, schema, document_ast: ast.Document, variables: dict):
+        self.schema = schema
+        self.variables = variables
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+
+    def get_value(self, value_ast):
+        if isinstance(value_ast, ast.Variable):
+            return self.variables.get(value_ast.name.value)
+        if isinstance(value_ast, ast.IntValue):
+            return int(value_ast.value)
+        return getattr(value_ast, "value", None)
+
+    def get_size(self, key: str, field, node) -> int:
+        if "first" in field.args:
+            first = next(
+                (
+                    self.get_value(arg.value)
+                    for arg in node.arguments
+                    if arg.name.value == "first"
+                ),
+                field.args["first"].default_value,
+            )
+            default_size = getattr(settings, "GRAPHQL_DEFAULT_PAGE_SIZE", 20)
+            max_size = getattr(settings, "GRAPHQL_MAX_PAGE_SIZE", 100)
+            if not isinstance(first, int):
+                return default_size
+            return max(min(first, max_size), 0)
+        if _is_list(field.type):
+            return _costs.get(key, {}).get(
+                "size", getattr(settings, "GRAPHQL_QUERY_COST_LIST_SIZE", 10)
+            )
+        return 1
+
+    def calculate(self, parent_type, selection_set, scope: _Scope) -> QueryCost:
+        """
+        Returns the cost and depth of a selection set resolved in a scope.
+        """
+        cost, depth = 0, 0
+        if not isinstance(parent_type, GraphQLObjectType):
+            # Invalid documents are reported by the validation
+            return QueryCost(cost, depth)
+        for node in selection_set.selections:
+            if not is_included(node, self.variables):
+                continue
+            if isinstance(node, ast.FragmentSpread):
+                fragment = self.fragments.get(node.name.value)
+                if fragment is None or fragment.name.value in scope.seen:
+                    continue
+                fragment_cost = self.calculate(
+                    self.schema.get_type(fragment.type_condition.name.value),
+                    fragment.selection_set,
+                    scope._replace(seen=(*scope.seen, fragment.name.value)),
+                )
+            elif isinstance(node, ast.InlineFragment):
+                fragment_type = parent_type
+                if node.type_condition:
+                    fragment_type = self.schema.get_type(node.type_condition.name.value)
+                fragment_cost = self.calculate(fragment_type, node.selection_set, scope)
+            else:
+                fragment_cost = self.calculate_field(parent_type, node, scope)
+            cost += fragment_cost.cost
+            depth = max(depth, fragment_cost.depth)
+        return QueryCost(cost, depth)
+
+    def calculate_field(self, parent_type, node, scope: _Scope) -> QueryCost:
+        field = parent_type.fields.get(node.name.value)
+        field_type = get_named_type(field.type) if field is not None else None
+        if not isinstance(field_type, GraphQLObjectType) or not node.selection_set:
+            return QueryCost(0, 0 if scope.wrapper else 1)
+
+        key = f"{parent_type.name}.{node.name.value}"
+        if scope.wrapper or _is_connection(parent_type):
+            # edges { node } of a connection, already charged by its field
+            cost, size, depth = 0, 1, 0
+        else:
+            size, depth = self.get_size(key, field, node), 1
+            cost = scope.count * size * _costs.get(key, {}).get("cost", 1)
+        inner = self.calculate(
+            field_type,
+            node.selection_set,
+            _Scope(scope.count * size, _is_connection(parent_type), scope.seen),
+        )
+        return QueryCost(cost + inner.cost, depth + inner.depth)
+
+
+def get_query_cost(
+    document: GraphQLDocument,
+    variables: Optional[dict],
+    operation_name: Optional[str],
+) -> Optional[QueryCost]:
+    """
+    Returns the estimated cost and the depth of the operation to execute,
+    from the document alone, or None when there is no such operation.
+    """
+    operation = get_operation(document.document_ast, operation_name)
+    if operation is None:
+        return None
+    root_type = {
+        "query": document.schema.get_query_type,
+        "mutation": document.schema.get_mutation_type,
+        "subscription": document.schema.get_subscription_type,
+    }[operation.operation]()
+    calculator = _CostCalculator(
+        document.schema, document.document_ast, variables or {}
+    )
+    return calculator.calculate(root_type, operation.selection_set, _Scope(1))
+
+
+def check_query_cost(query_cost: Optional[QueryCost]):
+    """
+    Raises GraphQLError when a query costs more than GRAPHQL_MAX_QUERY_COST or
+    nests deeper than GRAPHQL_MAX_QUERY_DEPTH.
+    """
+    if query_cost is None:
+        return
+    max_cost = getattr(settings, "GRAPHQL_MAX_QUERY_COST", None)
+    if max_cost is not None and query_cost.cost > max_cost:
+        raise GraphQLError(
+            f"Query cost {query_cost.cost} exceeds the maximum of {max_cost}"
+        )
+    max_depth = getattr(settings, "GRAPHQL_MAX_QUERY_DEPTH", None)
+    if max_depth is not None and query_cost.depth > max_depth:
+        raise GraphQLError(
+            f"Query depth {query_cost.depth} exceeds the maximum of {max_depth}"
+        )
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Model
+from graphql import GraphQLObjectType
+from graphql.backend import GraphQLDocument
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.type.definition import get_named_type
+
+__all__ = [
+    "register_dependencies",
+    "invalidate_models",
+    "get_response_cache",
+    "get_response_cache_key",
+    "get_versioned_cache_key",
+    "get_operation",
+]
+
+# "Type" or "Type.field" -> labels of the models its data is read from
+_dependencies: dict = {}
+
+
+def register_dependencies(name: str, *models: type[Model]):
+    """
+    Declares the models a GraphQL type or field reads, on top of the model of
+    a DjangoObjectType. Root fields must be registered, even with no models,
+    to make queries selecting them cacheable, e.g.
+
+        register_dependencies("Query.allProducts", Product)
+    """
+    _dependencies.setdefault(name, set()).update(
+        model._meta.label_lower for model in models
+    )
+
+
+def get_response_cache():
+    alias = getattr(settings, "GRAPHQL_RESPONSE_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def _version_key(label: str) -> str:
+    return f"graphql:version:{label}"
+
+
+def invalidate_models(*models: type[Model]):
+    """
+    Expires every cached response that read any of the given models. Called
+    from model signals, and by hand after bulk writes which send none.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return
+    for model in models:
+        key = _version_key(model._meta.label_lower)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # A missing version must never fall back to one used before
+            cache.set(key, time.time_ns(), None)
+
+
+def _get_versions(cache, labels: set) -> dict:
+    keys = [_version_key(label) for label in sorted(labels)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def get_versioned_cache_key(prefix: str, payload, *models: type[Model]) -> str:
+    """
+    Builds a response cache key from a JSON serializable payload and the
+    current version of the given models, so entries expire with the models
+    like cached responses do, e.g. for results cached inside a resolver.
+    """
+    cache = get_response_cache()
+    labels = {model._meta.label_lower for model in models}
+    data = json.dumps(
+        [payload, _get_versions(cache, labels)], sort_keys=True, default=str
+    )
+    return f"{prefix}:{hashlib.sha256(data.encode()).hexdigest()}"
+
+
+def get_operation(document_ast: ast.Document, operation_name: Optional[str]):
+    """
+    Returns the operation of a document to execute, or None when there is no
+    such operation or, without a name, more than one.
+    """
+    operations = [
+        definition
+        for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    if operation_name is None:
+        return operations[0] if len(operations) == 1 else None
+    return next(
+        (op for op in operations if op.name and op.name.value == operation_name),
+        None,
+    )
+
+
+class _DependencyCollector:
+    def __init__(self, schema, document_ast: ast.Document):
+        self.schema = schema
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+        self.labels = set()
+
+    def add_type(self, graphql_type):
+        model = getattr(getattr(graphql_type, "graphene_type", None), "_meta", None)
+        if getattr(model, "model", None) is not None:
+            self.labels.add(model.model._meta.label_lower)
+        self.labels |= _dependencies.get(graphql_type.name, set())
+
+    def collect(self, parent_type, selection_set, root=False) -> bool:
+        """
+        Adds the models read below a selection set. Returns False when the
+        response must not be cached.
+        """
+        if not isinstance(parent_type, GraphQLObjectType):
+            # Invalid documents are reported by the execution, not cached
+            return False
+        for node in selection_set.selections:
+            if isinstance(node, ast.Field):
+                collected = self.collect_field(parent_type, node, root)
+            else:
+                collected = self.collect_fragment(parent_type, node, root)
+            if not collected:
+                return False
+        return True
+
+    def collect_fragment(self, parent_type, node, root) -> bool:
+        if isinstance(node, ast.FragmentSpread):
+            fragment = self.fragments.get(node.name.value)
+            if fragment is None:
+                return False
+            fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+            return self.collect(fragment_type, fragment.selection_set, root)
+        fragment_type = parent_type
+        if node.type_condition:
+            fragment_type = self.schema.get_type(node.type_condition.name.value)
+        return self.collect(fragment_type, node.selection_set, root)
+
+    def collect_field(self, parent_type, node: ast.Field, root) -> bool:
+        name = node.name.value
+        if name.startswith("__"):
+            return True
+        key = f"{parent_type.name}.{name}"
+        field = parent_type.fields.get(name)
+        if field is None or (root and key not in _dependencies):
+            return False
+        self.labels |= _dependencies.get(key, set())
+        field_type = get_named_type(field.type)
+        if not isinstance(field_type, GraphQLObjectType):
+            return True
+        self.add_type(field_type)
+        return not node.selection_set or self.collect(field_type, node.selection_set)
+
+
+def _get_document_models(
+    document: GraphQLDocument, operation_name: Optional[str]
+) -> Optional[frozenset]:
+    """
+    Returns the labels of the models a query reads, or None when it must not
+    be cached: it is not a query or selects an unregistered root field.
+    Memoized on the document, which the document cache keeps alive.
+    """
+    memo = document.__dict__.setdefault("_response_cache_models", {})
+    if operation_name in memo:
+        return memo[operation_name]
+
+    labels = None
+    operation = get_operation(document.document_ast, operation_name)
+    if operation is not None and operation.operation == "query":
+        collector = _DependencyCollector(document.schema, document.document_ast)
+        if collector.collect(
+            document.schema.get_query_type(), operation.selection_set, root=True
+        ):
+            labels = frozenset(collector.labels)
+    memo[operation_name] = labels
+    return labels
+
+
+def get_response_cache_key(
+    document: GraphQLDocument,
+    variables: Optional[dict],
+    operation_name: Optional[str],
+    scope: str,
+) -> Optional[str]:
+    """
+    Builds the key of a cached response from the normalized query, its
+    variables, the user scope and the current version of every model the
+    query reads. Returns None when the response must not be cached.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return None
+    labels = _get_document_models(document, operation_name)
+    if labels is None:
+        return None
+
+    if "_normalized_hash" not in document.__dict__:
+        document.__dict__["_normalized_hash"] = hashlib.sha256(
+            print_ast(document.document_ast).encode()
+        ).hexdigest()
+    payload = json.dumps(
+        [
+            document.__dict__["_normalized_hash"],
+            variables or {},
+            operation_name,
+            scope,
+            _get_versions(cache, labels),
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return f"graphql:response:{hashlib.sha256(payload.encode()).hexdigest()}"
@@ -1,55 +1,531 @@
 import graphene
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import NotSupportedError
 from graphene_django import DjangoObjectType
-from graphql import ResolveInfo
+from graphql import GraphQLError, ResolveInfo
 
-from core.catalogue.models import Product, ProductAttributeValue, ProductType
+from promise import Promise
+
+from core.catalogue.category_tree import get_category_tree
+from core.catalogue.documents import documents_enabled, product_from_document
+from core.catalogue.models import (
+    Category,
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductDocument,
+    ProductType,
+)
+from core.catalogue.search import search_products
+from graphql_api.loaders import get_loaders
+from graphql_api.optimizer import get_selections, is_fetched, optimize, register_hints
+from graphql_api.pagination import connection_from_keyset, first_items
+from graphql_api.query_cost import register_cost
+from graphql_api.response_cache import (
+    get_response_cache,
+    get_versioned_cache_key,
+    register_dependencies,
+)
+from graphql_api.signals import CATALOGUE_MODELS
+from graphql_api.thread_pool import run_sync
 
 __all__ = ["Query"]
 
 
+def with_category_tree(info: ResolveInfo, func):
+    """
+    Calls `func` with the category tree, fetched once per request and on the
+    thread pool in async requests, as it may have to be rebuilt.
+    """
+    tree = getattr(info.context, "category_tree", None)
+    if tree is None:
+        tree = Promise.resolve(run_sync(get_category_tree))
+        info.context.category_tree = tree
+    return tree.then(func)
+
+
+def load_attribute(attr_val: ProductAttributeValue, info: ResolveInfo):
+    """
+    Loads the attribute of a value through the request's data loader and
+    caches it on the value, so `attr_val.value` does not query it again.
+    """
+    if is_fetched(attr_val, "attribute"):
+        return Promise.resolve(attr_val.attribute)
+
+    def attach(attribute):
+        attr_val.attribute = attribute
+        return attribute
+
+    return get_loaders(info).attribute.load(attr_val.attribute_id).then(attach)
+
+
 class ProductAttributeValueScheme(graphene.ObjectType):
     attribute = graphene.String(required=False)
     value = graphene.String(required=False)
 
     @staticmethod
-    def resolve_attribute(attr_val: ProductAttributeValue, _info: ResolveInfo):
-        return attr_val.attribute.code
+    def resolve_attribute(attr_val: ProductAttributeValue, info: ResolveInfo):
+        return load_attribute(attr_val, info).then(lambda attribute: attribute.code)
 
     @staticmethod
-    def resolve_value(attr_val: ProductAttributeValue, _info: ResolveInfo):
-        return str(attr_val.value)
+    def resolve_value(attr_val: ProductAttributeValue, info: ResolveInfo):
+        return load_attribute(attr_val, info).then(lambda _: str(attr_val.value))
+
+
+register_hints(
+    ProductAttributeValue,
+    attribute={"attribute": {"code": {}}},
+    value={
+        "attribute": {"type": {}},
+        **{f"value_{type_}": {} for type_, _ in ProductAttribute.TYPE_CHOICES},
+    },
+)
+register_dependencies(
+    "ProductAttributeValueScheme", ProductAttributeValue, ProductAttribute
+)
+
+
+class CategoryScheme(DjangoObjectType):
+    """
+    Categories come from the process-local category tree, so walking the
+    tree, e.g. to render a menu, needs no queries.
+    """
+
+    parent = graphene.Field(lambda: CategoryScheme)
+    children = graphene.List(lambda: CategoryScheme, first=graphene.Int())
+    ancestors = graphene.List(lambda: CategoryScheme)
+
+    class Meta:
+        model = Category
+        fields = (
+            "id",
+            "name",
+            "slug",
+            "description",
+            "image",
+            "full_name",
+            "full_slug",
+            "depth",
+        )
+
+    @staticmethod
+    def resolve_parent(category: Category, info: ResolveInfo):
+        return with_category_tree(info, lambda tree: tree.get_parent(category.pk))
+
+    @staticmethod
+    def resolve_children(category: Category, info: ResolveInfo, first=None):
+        return first_items(
+            with_category_tree(info, lambda tree: tree.get_children(category.pk)),
+            first,
+        )
+
+    @staticmethod
+    def resolve_ancestors(category: Category, info: ResolveInfo):
+        return with_category_tree(info, lambda tree: tree.get_ancestors(category.pk))
 
 
 class ProductTypeScheme(DjangoObjectType):
+    products = graphene.List(
+        graphene.NonNull(lambda: ProductScheme), required=True, first=graphene.Int()
+    )
+
     class Meta:
         model = ProductType
 
+    @staticmethod
+    def resolve_products(product_type: ProductType, info: ResolveInfo, first=None):
+        if is_fetched(product_type, "products"):
+            return first_items(product_type.products.all(), first)
+        return first_items(
+            get_loaders(info).products_by_type(first).load(product_type.pk), first
+        )
+
 
 class ProductScheme(DjangoObjectType):
     product_type = graphene.Field(ProductTypeScheme)
     attribute_values = graphene.List(ProductAttributeValueScheme)
+    categories = graphene.List(CategoryScheme, first=graphene.Int())
+    children = graphene.List(
+        graphene.NonNull(lambda: ProductScheme), required=True, first=graphene.Int()
+    )
 
     class Meta:
         model = Product
+        exclude = ("search_vector",)
+
+    @staticmethod
+    def resolve_parent(product: Product, info: ResolveInfo):
+        if product.parent_id is None or is_fetched(product, "parent"):
+            return product.parent
+        return get_loaders(info).product.load(product.parent_id)
 
     @staticmethod
-    def resolve_attribute_values(product: Product, _info: ResolveInfo):
-        return product.attribute_values.all()
+    def resolve_children(product: Product, info: ResolveInfo, first=None):
+        if is_fetched(product, "children"):
+            return first_items(product.children.all(), first)
+        return first_items(
+            get_loaders(info).children_by_parent(first).load(product.pk), first
+        )
+
+    @staticmethod
+    def resolve_product_type(product: Product, info: ResolveInfo):
+        if is_fetched(product, "product_type"):
+            return product.product_type
+        return get_loaders(info).product_type.load(product.product_type_id)
+
+    @staticmethod
+    def resolve_attribute_values(product: Product, info: ResolveInfo):
+        if is_fetched(product, "attribute_values"):
+            return product.attribute_values.all()
+        return get_loaders(info).attribute_values_by_product.load(product.pk)
+
+    @staticmethod
+    def resolve_categories(product: Product, info: ResolveInfo, first=None):
+        def to_categories(links):
+            return with_category_tree(
+                info,
+                lambda tree: [
+                    category
+                    for category in (tree.get(link.category_id) for link in links)
+                    if category is not None
+                ],
+            )
+
+        if is_fetched(product, "productcategory"):
+            return first_items(to_categories(product.productcategory_set.all()), first)
+        return first_items(
+            get_loaders(info)
+            .category_links_by_product(first)
+            .load(product.pk)
+            .then(to_categories),
+            first,
+        )
+
+
+# Only the links are fetched, categories come from the category tree
+register_hints(Product, categories={"productcategory": {"category_id": {}}})
+register_dependencies("ProductScheme.categories", ProductCategory)
+
+
+class ProductConnection(graphene.relay.Connection):
+    class Meta:
+        node = ProductScheme
+
+
+class ProductSort(graphene.Enum):
+    ID = "id"
+    NAME = "name"
+
+
+class AttributeFilterInput(graphene.InputObjectType):
+    """
+    Conditions on the values of the attributes with a code, combined with AND.
+    Values are given as strings and converted to the attribute's type.
+    """
+
+    code = graphene.String(required=True)
+    eq = graphene.String()
+    in_ = graphene.List(graphene.NonNull(graphene.String), name="in")
+    gt = graphene.String()
+    gte = graphene.String()
+    lt = graphene.String()
+    lte = graphene.String()
+
+
+class ProductFilterInput(graphene.InputObjectType):
+    attributes = graphene.List(graphene.NonNull(AttributeFilterInput))
+    category = graphene.String(
+        description="Full slug of a category, its descendants are included"
+    )
+    product_type = graphene.String(description="Slug of a product type")
+
+
+# Operators of AttributeFilterInput -> lookups of ProductQuerySet.filter_attributes
+ATTRIBUTE_FILTER_LOOKUPS = {
+    "eq": "exact",
+    "in_": "in",
+    "gt": "gt",
+    "gte": "gte",
+    "lt": "lt",
+    "lte": "lte",
+}
+
+
+def filter_products(queryset, product_filter):
+    """
+    Applies a ProductFilterInput to a product queryset, the category through
+    the category tree.
+    """
+    if not product_filter:
+        return queryset
+    if product_filter.get("category") is not None:
+        category = get_category_tree().get_by_full_slug(product_filter["category"])
+        if category is None:
+            return queryset.none()
+        queryset = queryset.in_category_tree(category)
+    if product_filter.get("product_type") is not None:
+        queryset = queryset.filter(product_type__slug=product_filter["product_type"])
+
+    # A code may come with the same operator more than once, so the
+    # predicates are passed as pairs rather than keyword arguments
+    predicates = [
+        (f"{condition['code']}__{lookup}", condition[name])
+        for condition in product_filter.get("attributes") or []
+        for name, lookup in ATTRIBUTE_FILTER_LOOKUPS.items()
+        if condition.get(name) is not None
+    ]
+    try:
+        return queryset.filter_attributes(*predicates)
+    except ValidationError as ex:
+        raise GraphQLError(" ".join(ex.messages)) from ex
+
+
+class FacetValue(graphene.ObjectType):
+    value = graphene.String(required=True)
+    count = graphene.Int(required=True)
+
+
+class AttributeFacet(graphene.ObjectType):
+    code = graphene.String(required=True)
+    values = graphene.List(graphene.NonNull(FacetValue), required=True)
+
+
+class CategoryFacet(graphene.ObjectType):
+    category = graphene.Field(CategoryScheme)
+    count = graphene.Int(required=True)
+
+    @staticmethod
+    def resolve_category(facet: dict, info: ResolveInfo):
+        return with_category_tree(info, lambda tree: tree.get(facet["category_id"]))
+
+
+class ProductTypeFacet(graphene.ObjectType):
+    product_type = graphene.Field(ProductTypeScheme)
+    count = graphene.Int(required=True)
+
+    @staticmethod
+    def resolve_product_type(facet: dict, info: ResolveInfo):
+        return get_loaders(info).product_type.load(facet["product_type_id"])
+
+
+class Facets(graphene.ObjectType):
+    attributes = graphene.List(graphene.NonNull(AttributeFacet))
+    categories = graphene.List(graphene.NonNull(CategoryFacet))
+    product_types = graphene.List(graphene.NonNull(ProductTypeFacet))
+
+
+# Facet counts are computed from every catalogue model
+FACET_MODELS = CATALOGUE_MODELS
+
+
+def get_facet_counts(product_filter, codes, categories, product_types):
+    """
+    Returns ProductQuerySet.facet_counts of the filtered products, cached
+    per filter signature until one of the models they are computed from
+    changes.
+    """
+    cache = get_response_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = get_versioned_cache_key(
+            "graphql:facets",
+            [product_filter, codes, categories, product_types],
+            *FACET_MODELS,
+        )
+        counts = cache.get(cache_key)
+        if counts is not None:
+            return counts
+
+    counts = filter_products(Product.objects.all(), product_filter).facet_counts(
+        codes, categories, product_types
+    )
+    if cache_key is not None:
+        cache.set(
+            cache_key,
+            counts,
+            getattr(settings, "GRAPHQL_RESPONSE_CACHE_TIMEOUT", 300),
+        )
+    return counts
+
+
+def to_facets(counts):
+    """
+    Shapes facet counts as the Facets type.
+    """
+    return {
+        "attributes": [
+            {
+                "code": code,
+                "values": [
+                    {"value": value, "count": count}
+                    for value, count in sorted(values.items())
+                ],
+            }
+            for code, values in sorted(counts["attributes"].items())
+        ],
+        "categories": [
+            {"category_id": category_id, "count": count}
+            for category_id, count in counts["categories"].items()
+        ],
+        "product_types": [
+            {"product_type_id": product_type_id, "count": count}
+            for product_type_id, count in counts["product_types"].items()
+        ],
+    }
+
+
+# Keyset columns per ProductSort value, the trailing "id" makes every
+# position unique
+PRODUCT_SORT_KEYS = {
+    "id": ("id",),
+    "name": ("name", "id"),
+}
 
 
 class Query(graphene.ObjectType):
-    all_products = graphene.List(ProductScheme)
+    all_products = graphene.Field(
+        ProductConnection,
+        first=graphene.Int(),
+        after=graphene.String(),
+        sort=ProductSort(default_value="id"),
+        filter=ProductFilterInput(),
+    )
+    product = graphene.Field(
+        ProductScheme, id_=graphene.ID(name="id"), upc=graphene.String()
+    )
+    search_products = graphene.Field(
+        ProductConnection,
+        query=graphene.String(required=True),
+        first=graphene.Int(),
+        after=graphene.String(),
+        description="Products matching a text, best matches first",
+    )
     all_product_types = graphene.List(ProductTypeScheme)
+    categories = graphene.List(CategoryScheme, description="Root categories")
+    category = graphene.Field(CategoryScheme, full_slug=graphene.String(required=True))
+    facets = graphene.Field(
+        Facets,
+        filter=ProductFilterInput(),
+        attributes=graphene.List(
+            graphene.NonNull(graphene.String),
+            description="Attribute codes to count, all filterable ones by default",
+        ),
+    )
 
     @staticmethod
-    def resolve_all_products(_root, _info):
-        # We can easily optimize query count in the resolve method
-        return (
-            Product.objects.select_related("parent", "product_type")
-            .prefetch_related("attribute_values")
-            .all()
-        )
+    def resolve_all_products(
+        _root, info, first=None, after=None, sort="id", filter=None
+    ):  # pylint: disable=redefined-builtin
+        # Columns, joins and prefetches follow the selection set, anything
+        # deeper than the plan reaches is batched by the data loaders
+        sort_keys = PRODUCT_SORT_KEYS[sort]
+
+        def resolve():
+            queryset = optimize(
+                filter_products(Product.objects.all(), filter),
+                info,
+                path=("edges", "node"),
+                only=sort_keys,
+            )
+            return connection_from_keyset(
+                ProductConnection, queryset, sort_keys, first, after
+            )
+
+        return run_sync(resolve)
+
+    @staticmethod
+    def resolve_product(_root, info, id_=None, upc=None):
+        if id_ is not None:
+            try:
+                product_id = int(id_)
+            except ValueError as ex:
+                raise GraphQLError(f"Invalid id: {id_}") from ex
+            return get_loaders(info).product.load(product_id)
+        if upc is None:
+            raise GraphQLError("Either id or upc is required")
+
+        def resolve():
+            if documents_enabled():
+                document = ProductDocument.objects.filter(product__upc=upc).first()
+                if document is not None:
+                    return product_from_document(document.data)
+            return optimize(Product.objects.filter(upc=upc), info).first()
+
+        return run_sync(resolve)
 
     @staticmethod
-    def resolve_all_product_types(_root, _info):
-        return ProductType.objects.all()
+    def resolve_search_products(_root, info, query, first=None, after=None):
+        def resolve():
+            try:
+                queryset = search_products(query)
+            except NotSupportedError as ex:
+                raise GraphQLError(str(ex)) from ex
+            queryset = optimize(queryset, info, path=("edges", "node"), only=("id",))
+            return connection_from_keyset(
+                ProductConnection, queryset, ("-search_rank", "id"), first, after
+            )
+
+        return run_sync(resolve)
+
+    @staticmethod
+    def resolve_all_product_types(_root, info):
+        return run_sync(lambda: list(optimize(ProductType.objects.all(), info)))
+
+    @staticmethod
+    def resolve_categories(_root, info):
+        return with_category_tree(info, lambda tree: tree.get_roots())
+
+    @staticmethod
+    def resolve_category(_root, info, full_slug):
+        return with_category_tree(info, lambda tree: tree.get_by_full_slug(full_slug))
+
+    @staticmethod
+    def resolve_facets(
+        _root, info, filter=None, attributes=None
+    ):  # pylint: disable=redefined-builtin
+        # Only the selected facets are counted, all in one statement
+        selections = get_selections(info)
+        return Promise.resolve(
+            run_sync(
+                get_facet_counts,
+                filter,
+                attributes if "attributes" in selections else [],
+                "categories" in selections,
+                "product_types" in selections,
+            )
+        ).then(to_facets)
+
+
+register_dependencies(
+    "Query.allProducts",
+    Product,
+    # Read by filters
+    Category,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductType,
+)
+register_dependencies(
+    "Query.product",
+    Product,
+    Category,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductType,
+)
+# Search matches text attribute values, so the type of an attribute counts
+register_dependencies(
+    "Query.searchProducts", Product, ProductAttribute, ProductAttributeValue
+)
+register_dependencies("Query.allProductTypes", ProductType)
+register_dependencies("Query.facets", *FACET_MODELS)
+register_dependencies("Query.categories", Category)
+register_dependencies("Query.category", Category)
+
+# Statements over the whole catalogue cost more than looking up a page
+register_cost("Query.searchProducts", cost=10)
+register_cost("Query.facets", cost=10)
@@ -0,0 +1,37 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from core.catalogue.models import (
+    Category,
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductType,
+)
+from core.catalogue.signals import bulk_changed
+from graphql_api.response_cache import invalidate_models
+
+CATALOGUE_MODELS = (
+    Category,
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductType,
+)
+
+
+def invalidate_cached_responses(sender, **_kwargs):
+    # Not before the commit, or a concurrent request could cache the rows
+    # as they were under the new versions
+    transaction.on_commit(lambda: invalidate_models(sender))
+
+
+# Connected per model, a catch-all receiver would disable fast deletes of
+# every other model in the project
+for model in CATALOGUE_MODELS:
+    post_save.connect(invalidate_cached_responses, sender=model)
+    post_delete.connect(invalidate_cached_responses, sender=model)
+    bulk_changed.connect(invalidate_cached_responses, sender=model)
+m2m_changed.connect(invalidate_cached_responses, sender=ProductCategory)
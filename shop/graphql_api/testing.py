@@ -0,0 +1,203 @@
+import re
+from collections import Counter
+from typing import Optional
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+from core.catalogue.models import (
+    Category,
+    Product,
+    ProductAttribute,
+    ProductAttributeValue,
+    ProductCategory,
+    ProductType,
+)
+from core.catalogue.signals import bulk_changed
+from graphql_api.response_cache import invalidate_models
+
+__all__ = ["CATALOGUE_SIZES", "grow_catalogue", "QueryBudgetMixin"]
+
+CATALOGUE_SIZES = (10, 100, 1000)
+
+
+def _get_fixtures():
+    book, created = ProductType.objects.get_or_create(name="Book")
+    if not created:
+        return (
+            list(ProductType.objects.order_by("name")),
+            list(ProductAttribute.objects.order_by("code")),
+            list(Category.objects.filter(depth__gt=1).order_by("path")),
+        )
+    phone = ProductType.objects.create(name="Phone", requires_shipping=False)
+    attributes = [
+        ProductAttribute.objects.create(
+            product_type=product_type, name=name, code=name.lower(), type=type_
+        )
+        for product_type, name, type_ in (
+            (book, "Pages", ProductAttribute.INTEGER),
+            (None, "Color", ProductAttribute.TEXT),
+            (phone, "Weight", ProductAttribute.FLOAT),
+        )
+    ]
+    books = Category.add_root(name="Books")
+    electronics = Category.add_root(name="Electronics")
+    categories = [
+        books.add_child(name="Fiction"),
+        books.add_child(name="Science"),
+        electronics.add_child(name="Phones"),
+    ]
+    return [book, phone], attributes, categories
+
+
+def grow_catalogue(size: int):
+    """
+    Adds products until the catalogue holds `size` of them, variants not
+    counted, so one document can be measured at growing sizes. Product
+    types, attributes and a small category tree come with the first call.
+
+    Every product has a value for each of its attributes and a category,
+    every fourth one two variants. Rows are bulk inserted and bulk_changed
+    is sent as by the importer, from a TestCase run it within
+    captureOnCommitCallbacks(execute=True) so process-local caches follow.
+    """
+    product_types, attributes, categories = _get_fixtures()
+    start = Product.objects.filter(parent=None).count()
+    if start >= size:
+        return
+    Product.objects.bulk_create(
+        Product(
+            name=f"Product {i}",
+            upc=f"product-{i}",
+            description=f"Description of product {i}",
+            product_type=product_types[i % len(product_types)],
+        )
+        for i in range(start, size)
+    )
+    products = list(
+        Product.objects.filter(
+            upc__in=[f"product-{i}" for i in range(start, size)]
+        ).order_by("pk")
+    )
+    Product.objects.bulk_create(
+        Product(
+            name=f"{product.name} variant {j}",
+            upc=f"{product.upc}-variant-{j}",
+            product_type=product.product_type,
+            parent=product,
+        )
+        for product in products[::4]
+        for j in range(2)
+    )
+
+    values = []
+    for i, product in enumerate(products):
+        for attribute in attributes:
+            if attribute.product_type_id not in (None, product.product_type_id):
+                continue
+            value = ProductAttributeValue(product=product, attribute=attribute)
+            value.value = {
+                ProductAttribute.INTEGER: 100 + i,
+                ProductAttribute.TEXT: ("red", "green", "blue")[i % 3],
+                ProductAttribute.FLOAT: 0.5 + i % 10,
+            }[attribute.type]
+            values.append(value)
+    ProductAttributeValue.objects.bulk_create(values)
+    ProductCategory.objects.bulk_create(
+        ProductCategory(product=product, category=categories[i % len(categories)])
+        for i, product in enumerate(products)
+    )
+
+    product_ids = {product.pk for product in products}
+    for sender in (Product, ProductAttributeValue, ProductCategory):
+        bulk_changed.send(sender=sender, product_ids=product_ids)
+
+
+def _normalize(sql: str) -> str:
+    sql = re.sub(r"'(?:[^']|'')*'", "%s", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "%s", sql)
+    # IN lists grow with the batch, not with the number of statements
+    return re.sub(r"\((?:%s, )*%s\)", "(...)", sql)
+
+
+class QueryBudgetMixin:
+    """
+    For TestCase subclasses: assertQueryCountStable() posts a GraphQL document
+    to the GraphQL view, with its query cost limits and response cache, for
+    catalogues of CATALOGUE_SIZES products and fails when the number of SQL
+    queries grows with the catalogue, or exceeds a budget, listing the
+    offending statements.
+
+    Fields are resolved on the request thread, the thread pool would not see
+    the rows of the test's transaction, so keep GRAPHQL_MAX_FAN_OUT at 1.
+    """
+
+    catalogue_sizes = CATALOGUE_SIZES
+    graphql_url = "/graphql"
+
+    def execute_document(self, document: str, variables: Optional[dict] = None):
+        """
+        Posts a document as a client would and returns the response's JSON
+        with the SQL queries run.
+        """
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            response = self.client.post(
+                self.graphql_url,
+                {"query": document, "variables": variables or {}},
+                content_type="application/json",
+            )
+        return response.json(), [query["sql"] for query in queries.captured_queries]
+
+    def measure(self, document: str, variables: Optional[dict] = None) -> dict:
+        """
+        Returns the {catalogue size: SQL queries} of a document. Every size
+        runs it twice and keeps the second run, the first one fills the
+        process-local caches a live process would have filled already. The
+        cached responses and facet counts are expired in between, so the
+        second run queries the database again.
+        """
+        runs = {}
+        for size in self.catalogue_sizes:
+            with self.captureOnCommitCallbacks(execute=True):
+                grow_catalogue(size)
+            self.execute_document(document, variables)
+            invalidate_models(*apps.get_app_config("catalogue").get_models())
+            result, queries = self.execute_document(document, variables)
+            if result.get("errors"):
+                self.fail(f"Errors at {size} products: {result['errors']}")
+            runs[size] = queries
+        return runs
+
+    def assertQueryCountStable(  # pylint: disable=invalid-name
+        self, document: str, variables: Optional[dict] = None, budget=None
+    ):
+        runs = self.measure(document, variables)
+        counts = {size: len(queries) for size, queries in runs.items()}
+        smallest = min(runs)
+        largest = max(runs, key=lambda size: (counts[size], size))
+        grown = counts[largest] > counts[smallest]
+        if not grown and (budget is None or counts[largest] <= budget):
+            return
+
+        before = Counter(_normalize(sql) for sql in runs[smallest])
+        after = Counter(_normalize(sql) for sql in runs[largest])
+        examples = {_normalize(sql): sql for sql in runs[largest]}
+        lines = [f"Query counts by catalogue size: {counts}"]
+        if grown:
+            lines.append(
+                f"Statements run more often at {largest} than at {smallest} "
+                "products:"
+            )
+            offending = [
+                statement for statement in after if after[statement] > before[statement]
+            ]
+        else:
+            lines.append(f"Over the budget of {budget} queries:")
+            offending = list(after)
+        for statement in offending:
+            lines.append(
+                f"  {before[statement]} -> {after[statement]} times: "
+                f"{examples[statement]}"
+            )
+        self.fail("\n".join(lines))
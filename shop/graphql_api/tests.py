@@ -0,0 +1,603 @@
+import json
+import tempfile
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from core.catalogue.models import Category, Product, ProductType
+from graphql_api.loaders import Loaders
+from graphql_api.persisted_queries import (
+    get_allowlist,
+    get_document_backend,
+    hash_query,
+)
+from graphql_api.response_cache import get_response_cache, invalidate_models
+from graphql_api.schema import schema
+from graphql_api.schema.catalogue import FACET_MODELS
+from graphql_api.testing import QueryBudgetMixin, grow_catalogue
+from graphql_api.thread_pool import FanOut, close_thread_pool
+from graphql_api.tracing import Trace
+from graphql_api.views import GraphQLView
+
+PRODUCT_FIELDS = """
+    name
+    upc
+    productType { name }
+    parent { name }
+    children { name productType { name } }
+    categories { name fullSlug parent { name } }
+    attributeValues { attribute value }
+"""
+
+
+class CatalogueQueryCountTests(QueryBudgetMixin, TestCase):
+    """
+    Documents a storefront sends, which must cost as many queries for 1000
+    products as for 10.
+    """
+
+    def test_all_products(self):
+        self.assertQueryCountStable(
+            f"{{ allProducts(first: 100) {{ edges {{ node {{ {PRODUCT_FIELDS} }} }} }} }}",
+            budget=4,
+        )
+
+    def test_filtered_products(self):
+        self.assertQueryCountStable(
+            """
+            query($filter: ProductFilterInput) {
+                allProducts(first: 50, sort: NAME, filter: $filter) {
+                    edges { cursor node { name attributeValues { attribute value } } }
+                    pageInfo { hasNextPage endCursor }
+                }
+            }
+            """,
+            {
+                "filter": {
+                    "category": "books",
+                    "attributes": [{"code": "color", "in": ["red", "blue"]}],
+                }
+            },
+            budget=3,
+        )
+
+    def test_product_types(self):
+        self.assertQueryCountStable(
+            f"{{ allProductTypes {{ name products(first: 5) {{ {PRODUCT_FIELDS} }} }} }}",
+            budget=5,
+        )
+
+    def test_product(self):
+        self.assertQueryCountStable(
+            f"""{{
+                byUpc: product(upc: "product-0") {{ {PRODUCT_FIELDS} }}
+                variant: product(upc: "product-0-variant-0") {{ {PRODUCT_FIELDS} }}
+            }}""",
+            budget=8,
+        )
+
+    def test_categories(self):
+        self.assertQueryCountStable(
+            """
+            {
+                categories { name children { name ancestors { name } parent { name } } }
+                category(fullSlug: "books/fiction") { fullName }
+            }
+            """,
+            budget=0,
+        )
+
+    def test_facets(self):
+        self.assertQueryCountStable(
+            """
+            {
+                facets {
+                    attributes { code values { value count } }
+                    categories { count category { fullSlug } }
+                    productTypes { count productType { name products { name } } }
+                }
+            }
+            """,
+            budget=3,
+        )
+
+    def test_search_products(self):
+        self.assertQueryCountStable(
+            f"""{{
+                searchProducts(query: "product", first: 50) {{
+                    edges {{ node {{ {PRODUCT_FIELDS} }} }}
+                }}
+            }}""",
+            budget=5,
+        )
+
+
+PAGE_QUERY = """
+query($first: Int, $after: String, $sort: ProductSort) {
+    allProducts(first: $first, after: $after, sort: $sort) {
+        edges { cursor node { upc } }
+        pageInfo { hasPreviousPage hasNextPage startCursor endCursor }
+    }
+}
+"""
+
+
+@override_settings(GRAPHQL_DEFAULT_PAGE_SIZE=3, GRAPHQL_MAX_PAGE_SIZE=5)
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        grow_catalogue(10)
+        # Same names, told apart by the trailing id of the cursor
+        for product in Product.objects.filter(upc__in=["product-3", "product-4"]):
+            product.name = "Product 2"
+            product.save()
+
+    @staticmethod
+    def execute(document, **variables):
+        return schema.execute(
+            document,
+            variable_values=variables,
+            context_value=RequestFactory().post("/graphql"),
+        )
+
+    def get_page(self, **variables):
+        result = self.execute(PAGE_QUERY, **variables)
+        self.assertIsNone(result.errors)
+        return result.data["allProducts"]
+
+    def walk(self, **variables):
+        upcs, after = [], None
+        for _ in range(20):
+            page = self.get_page(after=after, **variables)
+            upcs += [edge["node"]["upc"] for edge in page["edges"]]
+            self.assertEqual(page["pageInfo"]["hasPreviousPage"], after is not None)
+            if not page["pageInfo"]["hasNextPage"]:
+                break
+            after = page["pageInfo"]["endCursor"]
+        else:
+            self.fail(f"Pagination does not end: {upcs}")
+        return upcs
+
+    def test_walk_pages(self):
+        expected = list(Product.objects.order_by("pk").values_list("upc", flat=True))
+        self.assertEqual(self.walk(first=1), expected)
+
+    def test_walk_pages_sorted_by_duplicate_names(self):
+        expected = list(
+            Product.objects.order_by("name", "pk").values_list("upc", flat=True)
+        )
+        self.assertEqual(self.walk(first=2, sort="NAME"), expected)
+
+    def test_page_sizes(self):
+        self.assertEqual(len(self.get_page()["edges"]), 3)
+        self.assertEqual(len(self.get_page(first=50)["edges"]), 5)
+        page = self.get_page(first=0)
+        self.assertEqual(page["edges"], [])
+        self.assertIsNone(page["pageInfo"]["startCursor"])
+        self.assertTrue(page["pageInfo"]["hasNextPage"])
+
+    def test_after_last_row(self):
+        last = self.get_page(first=5, sort="NAME")
+        while last["pageInfo"]["hasNextPage"]:
+            last = self.get_page(
+                first=5, sort="NAME", after=last["pageInfo"]["endCursor"]
+            )
+        page = self.get_page(sort="NAME", after=last["pageInfo"]["endCursor"])
+        self.assertEqual(page["edges"], [])
+        self.assertFalse(page["pageInfo"]["hasNextPage"])
+        self.assertTrue(page["pageInfo"]["hasPreviousPage"])
+
+    def test_after_deleted_row(self):
+        page = self.get_page(first=2)
+        Product.objects.filter(upc=page["edges"][-1]["node"]["upc"]).delete()
+        following = self.get_page(first=1, after=page["pageInfo"]["endCursor"])
+        self.assertEqual(following["edges"][0]["node"]["upc"], "product-2")
+        self.assertTrue(following["pageInfo"]["hasPreviousPage"])
+
+    def test_invalid_arguments(self):
+        for variables in (
+            {"first": -1},
+            {"after": "not a cursor"},
+            # A cursor of the NAME sort has two values
+            {"after": self.get_page(sort="NAME")["pageInfo"]["endCursor"]},
+        ):
+            with self.subTest(variables):
+                result = self.execute(PAGE_QUERY, **variables)
+                self.assertIsNone(result.data["allProducts"])
+                self.assertEqual(len(result.errors), 1)
+
+    def test_nested_lists(self):
+        result = self.execute(
+            """
+            {
+                allProducts(first: 1) { edges { node {
+                    children(first: 1) { upc }
+                    categories(first: 0) { name }
+                } } }
+                allProductTypes { products { upc } }
+                categories { children(first: 1) { name } }
+            }
+            """
+        )
+        self.assertIsNone(result.errors)
+        node = result.data["allProducts"]["edges"][0]["node"]
+        self.assertEqual(node["children"], [{"upc": "product-0-variant-0"}])
+        self.assertEqual(node["categories"], [])
+        for product_type in result.data["allProductTypes"]:
+            self.assertEqual(len(product_type["products"]), 3)
+        for category in result.data["categories"]:
+            self.assertEqual(len(category["children"]), 1)
+
+    def test_nested_lists_fetch_one_page(self):
+        with mock.patch.object(
+            Product, "from_db", side_effect=Product.from_db
+        ) as from_db:
+            result = self.execute(
+                "{ allProductTypes { name products(first: 2) { upc } } }"
+            )
+        self.assertIsNone(result.errors)
+        for product_type in result.data["allProductTypes"]:
+            self.assertEqual(len(product_type["products"]), 2)
+        self.assertEqual(from_db.call_count, 2 * ProductType.objects.count())
+
+    def test_loader_fetches_one_page(self):
+        product_types = list(ProductType.objects.order_by("pk"))
+        loader = Loaders().products_by_type(2)
+        with mock.patch.object(
+            Product, "from_db", side_effect=Product.from_db
+        ) as from_db:
+            lists = loader.load_many([pt.pk for pt in product_types]).get()
+        self.assertEqual(from_db.call_count, 2 * len(product_types))
+        for product_type, products in zip(product_types, lists):
+            self.assertEqual(
+                products,
+                list(Product.objects.filter(product_type=product_type)[:2]),
+            )
+
+    def test_product_by_id(self):
+        product = Product.objects.get(upc="product-1")
+        result = self.execute(
+            "query($id: ID) { product(id: $id) { upc } }", id=str(product.pk)
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["product"], {"upc": "product-1"})
+        result = self.execute('{ product(id: "one") { upc } }')
+        self.assertEqual(
+            [error.message for error in result.errors], ["Invalid id: one"]
+        )
+
+    def test_repeated_attribute_conditions(self):
+        result = self.execute(
+            """
+            query($filter: ProductFilterInput) {
+                allProducts(first: 5, filter: $filter) { edges { node { upc } } }
+            }
+            """,
+            filter={
+                "attributes": [
+                    {"code": "pages", "gte": "105"},
+                    {"code": "pages", "gte": "102", "lt": "108"},
+                ]
+            },
+        )
+        self.assertIsNone(result.errors)
+        self.assertEqual(
+            [edge["node"]["upc"] for edge in result.data["allProducts"]["edges"]],
+            ["product-6"],
+        )
+
+
+class PersistedQueryTests(TestCase):
+    query = "{ allProductTypes { name } }"
+
+    def post(self, query=None, query_hash=None):
+        data = {}
+        if query is not None:
+            data["query"] = query
+        if query_hash is not None:
+            data["extensions"] = {
+                "persistedQuery": {"version": 1, "sha256Hash": query_hash}
+            }
+        return self.client.post("/graphql", data, content_type="application/json")
+
+    def test_unknown_hash(self):
+        response = self.post(query_hash=hash_query("{ categories { name } }"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["errors"],
+            [
+                {
+                    "message": "PersistedQueryNotFound",
+                    "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                }
+            ],
+        )
+
+    def test_register_then_send_hash(self):
+        query_hash = hash_query(self.query)
+        for data in ({"query": self.query}, {}):
+            response = self.post(data.get("query"), query_hash)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["data"], {"allProductTypes": []})
+
+    def test_hash_mismatch(self):
+        response = self.post(self.query, hash_query("{ categories { name } }"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_allowlist(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as allowlist_file:
+            json.dump([self.query], allowlist_file)
+            allowlist_file.flush()
+            get_allowlist.cache_clear()
+            self.addCleanup(get_allowlist.cache_clear)
+            with self.settings(GRAPHQL_PERSISTED_QUERIES_ALLOWLIST=allowlist_file.name):
+                response = self.post(query_hash=hash_query(self.query))
+                self.assertEqual(response.json()["data"], {"allProductTypes": []})
+                response = self.post("{ categories { name } }")
+                self.assertEqual(response.status_code, 400)
+                response = self.post(query_hash=hash_query("{ categories { name } }"))
+                self.assertEqual(
+                    response.json()["errors"][0]["message"], "PersistedQueryNotFound"
+                )
+
+    def test_document_fetched_once(self):
+        backend = get_document_backend()
+        with mock.patch.object(
+            backend, "document_from_string", wraps=backend.document_from_string
+        ) as document_from_string:
+            response = self.post(self.query)
+        self.assertEqual(response.status_code, 200)
+        document_from_string.assert_called_once()
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        get_response_cache().clear()
+
+    def get_product_types(self):
+        response = self.client.post(
+            "/graphql",
+            {"query": "{ allProductTypes { name } }"},
+            content_type="application/json",
+        )
+        return [
+            product_type["name"]
+            for product_type in response.json()["data"]["allProductTypes"]
+        ]
+
+    def test_invalidated_on_commit(self):
+        self.assertEqual(self.get_product_types(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductType.objects.create(name="Book")
+            # Until the commit, other requests may only cache what they see
+            # under the versions before it
+            self.assertEqual(self.get_product_types(), [])
+        self.assertEqual(self.get_product_types(), ["Book"])
+
+
+class FacetsTests(TestCase):
+    document = """
+    query($filter: ProductFilterInput) {
+        facets(filter: $filter) {
+            attributes { code values { value count } }
+            categories { count category { fullSlug } }
+            productTypes { count productType { name } }
+        }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        grow_catalogue(6)
+
+    def setUp(self):
+        # Cached counts of earlier tests may be of rolled back rows
+        invalidate_models(*FACET_MODELS)
+
+    def get_facets(self, **variables):
+        response = self.client.post(
+            "/graphql",
+            {"query": self.document, "variables": variables},
+            content_type="application/json",
+        )
+        self.assertNotIn("errors", response.json())
+        return response.json()["data"]["facets"]
+
+    def test_counts_per_value(self):
+        facets = self.get_facets()
+        self.assertEqual(
+            facets["attributes"][0],
+            {
+                "code": "color",
+                "values": [
+                    {"value": "blue", "count": 2},
+                    {"value": "green", "count": 2},
+                    {"value": "red", "count": 2},
+                ],
+            },
+        )
+        # Variants are counted with their type, not with their parent's values
+        self.assertCountEqual(
+            facets["productTypes"],
+            [
+                {"count": 7, "productType": {"name": "Book"}},
+                {"count": 3, "productType": {"name": "Phone"}},
+            ],
+        )
+
+    def test_filters_narrow_counts(self):
+        facets = self.get_facets(
+            filter={"attributes": [{"code": "color", "eq": "red"}]}
+        )
+        self.assertEqual(
+            facets["attributes"],
+            [
+                {"code": "color", "values": [{"value": "red", "count": 2}]},
+                {"code": "pages", "values": [{"value": "100", "count": 1}]},
+                {"code": "weight", "values": [{"value": "3.5", "count": 1}]},
+            ],
+        )
+        self.assertEqual(
+            facets["categories"],
+            [{"count": 2, "category": {"fullSlug": "books/fiction"}}],
+        )
+        self.assertCountEqual(
+            facets["productTypes"],
+            [
+                {"count": 1, "productType": {"name": "Book"}},
+                {"count": 1, "productType": {"name": "Phone"}},
+            ],
+        )
+
+
+class QueryCostTests(TestCase):
+    def get_cost(self, query):
+        response = self.client.post(
+            "/graphql", {"query": query}, content_type="application/json"
+        )
+        return response.json()["extensions"]["cost"]["requestedQueryCost"]
+
+    def test_items_charged(self):
+        self.assertEqual(
+            self.get_cost(
+                "{ allProducts(first: 10) { edges { node { productType { name } } } } }"
+            ),
+            10 + 10,
+        )
+        # allProductTypes counts GRAPHQL_QUERY_COST_LIST_SIZE items
+        self.assertEqual(
+            self.get_cost("{ allProductTypes { products(first: 5) { name } } }"),
+            10 + 10 * 5,
+        )
+
+    @override_settings(GRAPHQL_MAX_QUERY_COST=100)
+    def test_rejected(self):
+        response = self.client.post(
+            "/graphql",
+            {
+                "query": "{ allProducts(first: 100) { edges { node { parent { name } } } } }"
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(
+            response.json()["errors"][0]["message"],
+            "Query cost 200 exceeds the maximum of 100",
+        )
+
+
+@override_settings(
+    GRAPHQL_METRICS=True, GRAPHQL_TRACING=True, GRAPHQL_INTERNAL_TOKEN="secret"
+)
+class TracingTests(TestCase):
+    def post(self, **extra):
+        response = self.client.post(
+            "/graphql",
+            {
+                "query": "{ allProductTypes { name } }",
+                "extensions": {"tracing": True},
+            },
+            content_type="application/json",
+            **extra,
+        )
+        return response.json().get("extensions", {})
+
+    def test_traces_for_internal_callers_only(self):
+        with mock.patch.object(Trace, "add_field") as add_field:
+            self.assertNotIn("tracing", self.post())
+        add_field.assert_not_called()
+        tracing = self.post(HTTP_AUTHORIZATION="Bearer secret")["tracing"]
+        self.assertEqual(
+            [resolver["fieldName"] for resolver in tracing["execution"]["resolvers"]],
+            ["allProductTypes"],
+        )
+        self.client.force_login(
+            get_user_model().objects.create_user("staff", is_staff=True)
+        )
+        self.assertIn("tracing", self.post())
+
+    def test_metrics_for_internal_callers_only(self):
+        self.post()
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(
+            self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer other").status_code,
+            403,
+        )
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("graphql_requests_total", response.content.decode())
+
+
+# Pool threads query outside the test's transaction
+@override_settings(GRAPHQL_MAX_FAN_OUT=4)
+class FanOutTests(TransactionTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+        self.addCleanup(close_thread_pool)
+
+    def test_root_fields(self):
+        ProductType.objects.create(name="Book")
+        root = Category.add_root(name="Books")
+        root.add_child(name="Fiction")
+        with mock.patch.object(
+            FanOut, "submit", autospec=True, side_effect=FanOut.submit
+        ) as submit:
+            response = self.client.post(
+                "/graphql",
+                {
+                    "query": """
+                    {
+                        allProductTypes { name }
+                        category(fullSlug: "books") { children { name } }
+                        allProducts(first: 1) { edges { node { name } } }
+                    }
+                    """
+                },
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["data"],
+            {
+                "allProductTypes": [{"name": "Book"}],
+                "category": {"children": [{"name": "Fiction"}]},
+                "allProducts": {"edges": []},
+            },
+        )
+        self.assertGreaterEqual(submit.call_count, 2)
+
+
+# Pool threads query outside the test's transaction
+class AsyncViewTests(TransactionTestCase):
+    def setUp(self):
+        get_response_cache().clear()
+        self.addCleanup(close_thread_pool)
+
+    async def post(self, query):
+        return await self.async_client.post(
+            "/graphql/async", {"query": query}, content_type="application/json"
+        )
+
+    async def test_query(self):
+        await sync_to_async(ProductType.objects.create)(name="Book")
+        for _ in range(2):
+            # The pool threads keep their connections between requests
+            response = await self.post("{ allProductTypes { name } }")
+            self.assertEqual(
+                response.json()["data"], {"allProductTypes": [{"name": "Book"}]}
+            )
+
+    async def test_unexpected_errors_propagate(self):
+        with mock.patch.object(
+            GraphQLView, "execute_document", side_effect=RuntimeError("bug")
+        ):
+            with self.assertRaises(RuntimeError):
+                await self.post("{ allProductTypes { name } }")
+        response = await self.post("{ unknownField }")
+        self.assertEqual(response.status_code, 400)
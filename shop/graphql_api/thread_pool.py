@@ -0,0 +1,185 @@
+import asyncio
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import lru_cache, partial
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections
+from graphql.execution.executors.sync import SyncExecutor
+from promise import Promise
+
+__all__ = [
+    "FanOut",
+    "FanOutExecutor",
+    "close_thread_pool",
+    "get_thread_pool",
+    "in_event_loop",
+    "run_sync",
+    "use_fan_out",
+]
+
+_fan_out: ContextVar[Optional["FanOut"]] = ContextVar("graphql_fan_out", default=None)
+
+
+@lru_cache(maxsize=None)
+def get_thread_pool() -> ThreadPoolExecutor:
+    """
+    Threads running the database work of GraphQL requests, shared by all
+    requests of the process. Every thread keeps its own database
+    connection for as long as it lives, GRAPHQL_ASYNC_THREADS bounds them.
+    """
+    return ThreadPoolExecutor(
+        max_workers=getattr(settings, "GRAPHQL_ASYNC_THREADS", 8),
+        thread_name_prefix="graphql",
+    )
+
+
+def close_thread_pool(timeout: float = 10):
+    """
+    Retires the threads of the pool after closing their database
+    connections, e.g. on server shutdown or at the end of a test. The next
+    get_thread_pool() starts a new pool.
+    """
+    pool = get_thread_pool()
+    get_thread_pool.cache_clear()
+    workers = getattr(settings, "GRAPHQL_ASYNC_THREADS", 8)
+    # Every thread takes one call, the others are busy waiting meanwhile
+    barrier = threading.Barrier(workers, timeout=timeout)
+
+    def close():
+        try:
+            barrier.wait()
+        finally:
+            connections.close_all()
+
+    wait([pool.submit(close) for _ in range(workers)])
+    pool.shutdown()
+
+
+def in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # The thread's connections outlive the call, except broken ones
+        for connection in connections.all():
+            if (
+                connection.connection is not None
+                and connection.errors_occurred
+                and not connection.is_usable()
+            ):
+                connection.close()
+
+
+def _bind(func, args, kwargs):
+    # The call sees the context variables of its caller, e.g. the trace
+    return partial(copy_context().run, _call, func, args, kwargs)
+
+
+class FanOut:
+    """
+    Runs the database calls of one request on the thread pool, at most
+    `limit` at a time and the others queued, so the independent fields of a
+    query are resolved concurrently.
+
+    The Promises of the results are settled on the request's own thread, so
+    resolvers and data loaders never run on two threads at once: by the
+    event loop given as `loop`, else by wait().
+    """
+
+    def __init__(self, limit: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.limit = max(limit, 1)
+        self.loop = loop
+        self.running: dict[Future, Promise] = {}
+        self.queued: deque = deque()
+        self.finished: queue.SimpleQueue = queue.SimpleQueue()
+
+    def submit(self, func, args, kwargs) -> Promise:
+        promise = Promise()
+        self.queued.append((promise, _bind(func, args, kwargs)))
+        self.start()
+        return promise
+
+    def start(self):
+        while self.queued and len(self.running) < self.limit:
+            promise, call = self.queued.popleft()
+            if self.loop is not None:
+                future = self.loop.run_in_executor(get_thread_pool(), call)
+                future.add_done_callback(self.settle)
+            else:
+                future = get_thread_pool().submit(call)
+                future.add_done_callback(self.finished.put)
+            self.running[future] = promise
+
+    def settle(self, future):
+        promise = self.running.pop(future)
+        self.start()
+        error = future.exception()
+        if error is not None:
+            promise.do_reject(error)
+        else:
+            promise.do_resolve(future.result())
+
+    def wait(self):
+        """
+        Settles the calls as they finish, including the calls made meanwhile,
+        until none is left. Not needed on an event loop.
+        """
+        while self.running:
+            self.settle(self.finished.get())
+
+
+class FanOutExecutor(SyncExecutor):
+    """
+    Executes a query like SyncExecutor, but waits for the calls run on the
+    thread pool by the request's FanOut before the result is read.
+    """
+
+    def __init__(self, fan_out: FanOut):
+        self.fan_out = fan_out
+
+    def wait_until_finished(self):
+        self.fan_out.wait()
+
+
+@contextmanager
+def use_fan_out(fan_out: Optional[FanOut]):
+    """
+    Makes run_sync() hand calls to the given FanOut within the block.
+    """
+    token = _fan_out.set(fan_out)
+    try:
+        yield fan_out
+    finally:
+        _fan_out.reset(token)
+
+
+def run_sync(func, *args, **kwargs):
+    """
+    Calls a function which may use the database. Within use_fan_out(), the
+    call is run by the request's FanOut and a Promise of its result is
+    returned right away. On an event loop, i.e. in AsyncGraphQLView, the
+    call runs on the thread pool likewise, so the loop never waits on the
+    database. Elsewhere the function is simply called.
+    """
+    fan_out = _fan_out.get()
+    if fan_out is not None:
+        return fan_out.submit(func, args, kwargs)
+    if not in_event_loop():
+        return func(*args, **kwargs)
+    future = asyncio.get_running_loop().run_in_executor(
+        get_thread_pool(), _bind(func, args, kwargs)
+    )
+    return Promise.resolve(future)
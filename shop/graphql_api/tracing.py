@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from django.db.backends.signals import connection_created
+from promise import Promise, is_thenable
+
+__all__ = ["Trace", "TracingMiddleware", "get_trace", "traced", "use_trace"]
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("graphql_trace", default=None)
+# The resolver or data loader the queries being run are charged to
+_source: ContextVar[Optional[str]] = ContextVar("graphql_trace_source", default=None)
+
+
+# Timings and their aggregates, one attribute each
+class Trace:  # pylint: disable=too-many-instance-attributes
+    """
+    Timings of one GraphQL request: the count and duration of the SQL
+    queries run by each resolver and data loader, on any thread, and when
+    the trace is `requested`, of every resolved field. Durations are in
+    nanoseconds.
+    """
+
+    def __init__(self, requested=False):
+        # Whether the response reports the trace
+        self.requested = requested
+        self.start_time = datetime.now(timezone.utc)
+        self.end_time = None
+        self.start = time.perf_counter_ns()
+        self.duration = None
+        self.resolvers = []
+        # "Type.field" -> [count, duration]
+        self.fields = defaultdict(lambda: [0, 0])
+        # resolver or loader -> [count, duration]
+        self.sql = defaultdict(lambda: [0, 0])
+        self.lock = threading.Lock()
+
+    def add_field(self, info, start, end):
+        self.resolvers.append(
+            {
+                "path": list(info.path),
+                "parentType": info.parent_type.name,
+                "fieldName": info.field_name,
+                "returnType": str(info.return_type),
+                "startOffset": start - self.start,
+                "duration": end - start,
+            }
+        )
+        field = self.fields[f"{info.parent_type.name}.{info.field_name}"]
+        field[0] += 1
+        field[1] += end - start
+
+    def add_sql(self, source, duration):
+        with self.lock:
+            queries = self.sql[source or "other"]
+            queries[0] += 1
+            queries[1] += duration
+
+    def finish(self):
+        self.end_time = datetime.now(timezone.utc)
+        self.duration = time.perf_counter_ns() - self.start
+
+    def as_extension(self) -> dict:
+        """
+        Returns the trace in the Apollo tracing format, plus the SQL queries
+        by resolver and data loader.
+        """
+        with self.lock:
+            sql = {
+                source: {"count": count, "duration": duration}
+                for source, (count, duration) in self.sql.items()
+            }
+        return {
+            "version": 1,
+            "startTime": self.start_time.isoformat(),
+            "endTime": self.end_time.isoformat(),
+            "duration": self.duration,
+            "execution": {"resolvers": self.resolvers},
+            "sql": {
+                "count": sum(queries["count"] for queries in sql.values()),
+                "duration": sum(queries["duration"] for queries in sql.values()),
+                "sources": sql,
+            },
+        }
+
+
+def get_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """
+    Makes the fields resolved and the queries run within the block, or on
+    the thread pool on its behalf, recorded by the given trace.
+    """
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def traced(source: str):
+    """
+    Charges the queries run within the block to `source`, e.g. a data loader.
+    """
+    token = _source.set(source)
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+class TracingMiddleware:
+    """
+    Graphene middleware timing every field of a request until its value is
+    resolved, and charging the queries its resolver runs to the field.
+    """
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+
+    def resolve(self, next_, root, info, **args):
+        start = time.perf_counter_ns()
+        with traced(f"{info.parent_type.name}.{info.field_name}"):
+            try:
+                result = next_(root, info, **args)
+            except Exception:
+                self.trace.add_field(info, start, time.perf_counter_ns())
+                raise
+        if not is_thenable(result):
+            self.trace.add_field(info, start, time.perf_counter_ns())
+            return result
+
+        def on_resolve(value):
+            self.trace.add_field(info, start, time.perf_counter_ns())
+            return value
+
+        def on_reject(error):
+            self.trace.add_field(info, start, time.perf_counter_ns())
+            raise error
+
+        return Promise.resolve(result).then(on_resolve, on_reject)
+
+
+def record_query(execute, sql, params, many, context):
+    trace = _trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter_ns()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_sql(_source.get(), time.perf_counter_ns() - start)
+
+
+def install_query_recorder(connection, **_kwargs):
+    # A connection object survives reconnecting, e.g. after CONN_MAX_AGE
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
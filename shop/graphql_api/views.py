@@ -0,0 +1,465 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.db import connection, transaction
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+)
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView as BaseGraphQLView
+from graphene_django.views import HttpError
+from graphql import GraphQLError
+from graphql.execution import ExecutionResult
+from graphql.execution.executors.asyncio import AsyncioExecutor
+from graphql.execution.middleware import MiddlewareManager
+from promise import Promise
+
+from graphql_api.metrics import get_metrics
+from graphql_api.persisted_queries import (
+    PersistedQueryNotFound,
+    get_allowlist,
+    get_document_backend,
+    hash_query,
+)
+from graphql_api.query_cost import check_query_cost, get_query_cost
+from graphql_api.response_cache import get_response_cache, get_response_cache_key
+from graphql_api.thread_pool import FanOut, FanOutExecutor, run_sync, use_fan_out
+from graphql_api.tracing import Trace, TracingMiddleware, get_trace, use_trace
+
+__all__ = ["GraphQLView", "AsyncGraphQLView", "is_internal", "metrics"]
+
+
+class GraphQLView(BaseGraphQLView):
+    """
+    GraphQL view serving documents from an LRU of parsed and validated
+    documents, with support for Apollo persisted queries: a client may send
+    `extensions.persistedQuery.sha256Hash` instead of the query text.
+    When GRAPHQL_PERSISTED_QUERIES_ALLOWLIST is set, only the queries listed
+    there may run.
+
+    Responses of cacheable queries are kept in the response cache, see
+    graphql_api.response_cache. When GRAPHQL_MAX_FAN_OUT is above 1, the
+    fields of a query are resolved concurrently on the thread pool, up to that
+    many database calls at a time, see graphql_api.thread_pool.FanOut.
+
+    Queries costing more than GRAPHQL_MAX_QUERY_COST are rejected before they
+    run, see graphql_api.query_cost, and every response reports the cost in
+    `extensions.cost`.
+
+    With GRAPHQL_METRICS, requests are timed and their SQL queries counted
+    for the totals served by the metrics view. With GRAPHQL_TRACING, internal
+    callers, see is_internal(), sending `extensions.tracing` get the timings
+    of every field in `extensions.tracing` of the response.
+    """
+
+    def __init__(self, *args, backend=None, **kwargs):
+        super().__init__(*args, backend=backend or get_document_backend(), **kwargs)
+
+    @staticmethod
+    def get_extensions(request, data) -> dict:
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError as ex:
+                raise HttpError(
+                    HttpResponseBadRequest("Extensions are invalid JSON.")
+                ) from ex
+        return extensions if isinstance(extensions, dict) else {}
+
+    def get_persisted_query_hash(self, request, data):
+        extensions = self.get_extensions(request, data)
+        return (extensions.get("persistedQuery") or {}).get("sha256Hash")
+
+    def get_persisted_query(self, query_hash):
+        allowlist = get_allowlist()
+        if allowlist is not None:
+            return allowlist.get(query_hash)
+        document = self.backend.get_document(self.schema, query_hash)
+        return document.document_string if document is not None else None
+
+    # A staticmethod upstream, persisted queries need the view here
+    def get_graphql_params(self, request, data):  # pylint: disable=arguments-differ
+        """
+        Returns the query, its variables, operation name and batch id. The
+        query is None when a persisted query hash is unknown.
+        """
+        query, variables, operation_name, id_ = super().get_graphql_params(
+            request, data
+        )
+        query_hash = self.get_persisted_query_hash(request, data)
+        if not query and query_hash:
+            query = self.get_persisted_query(query_hash)
+        if query:
+            actual_hash = hash_query(query)
+            if query_hash and query_hash != actual_hash:
+                raise HttpError(
+                    HttpResponseBadRequest("Provided sha256Hash does not match query")
+                )
+            allowlist = get_allowlist()
+            if allowlist is not None and actual_hash not in allowlist:
+                raise HttpError(HttpResponseBadRequest("PersistedQueryNotAllowed"))
+        return query, variables, operation_name, id_
+
+    @staticmethod
+    def get_cache_scope(request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return "anonymous"
+
+    def get_document(self, query):
+        """
+        Returns the parsed and validated document of a query, from the
+        document cache. Syntax errors are raised.
+        """
+        return self.backend.document_from_string(self.schema, query)
+
+    def get_response_cache_key(self, request, document, variables, operation_name):
+        trace = get_trace()
+        if trace is not None and trace.requested:
+            # A cached response would have no fields to time
+            return None
+        return get_response_cache_key(
+            document, variables, operation_name, self.get_cache_scope(request)
+        )
+
+    @staticmethod
+    def get_fan_out(document, operation_name, loop=None):
+        """
+        Returns the FanOut of a request, or None for mutations, whose fields
+        must run one after another, and for sync requests when
+        GRAPHQL_MAX_FAN_OUT is 1.
+        """
+        limit = getattr(settings, "GRAPHQL_MAX_FAN_OUT", 1)
+        if loop is None and limit <= 1:
+            return None
+        if document.get_operation_type(operation_name) != "query":
+            return None
+        return FanOut(limit, loop)
+
+    @staticmethod
+    def check_method(request, document, operation_name):
+        operation_type = document.get_operation_type(operation_name)
+        if request.method.lower() == "get" and operation_type not in (None, "query"):
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    f"Can only perform a {operation_type} operation from a "
+                    "POST request.",
+                )
+            )
+
+    def prepare_execution(
+        self, request, data, query, variables, operation_name
+    ):  # pylint: disable=too-many-arguments
+        """
+        Returns the document of a request with its cost, or the result to
+        respond with instead: the error of an unknown persisted query, a
+        syntax error, a query over budget or a cached response.
+        """
+        if not query and self.get_persisted_query_hash(request, data):
+            return None, None, ExecutionResult(errors=[PersistedQueryNotFound()])
+        if not query:
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+        try:
+            document = self.get_document(query)
+        except Exception as ex:  # pylint: disable=broad-except
+            return None, None, ExecutionResult(errors=[ex], invalid=True)
+        self.check_method(request, document, operation_name)
+
+        query_cost = get_query_cost(document, variables, operation_name)
+        try:
+            check_query_cost(query_cost)
+        except GraphQLError as ex:
+            result = ExecutionResult(errors=[ex], invalid=True)
+            return None, None, self.add_query_cost(result, query_cost)
+        return document, query_cost, None
+
+    def execute_document(
+        self, request, document, variables, operation_name, **options
+    ):  # pylint: disable=too-many-arguments
+        options.update(
+            root_value=self.get_root_value(request),
+            variable_values=variables,
+            operation_name=operation_name,
+            context_value=self.get_context(request),
+            middleware=self.get_middleware(request),
+        )
+        if document.get_operation_type(operation_name) == "mutation" and (
+            graphene_settings.ATOMIC_MUTATIONS is True
+            or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+        ):
+            with transaction.atomic():
+                result = document.execute(**options)
+                if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                    transaction.set_rollback(True)
+            return result
+        return document.execute(**options)
+
+    @staticmethod
+    def add_query_cost(result, query_cost):
+        if result is not None and query_cost is not None:
+            result.extensions["cost"] = query_cost.as_extension()
+        return result
+
+    def format_result(self, result, id_):
+        """
+        Returns the response body of an execution result and its status code.
+        """
+        status_code = 200
+        response = {}
+        if result.errors:
+            response["errors"] = [self.format_error(error) for error in result.errors]
+        if result.invalid:
+            status_code = 400
+        else:
+            response["data"] = result.data
+        if result.extensions:
+            response["extensions"] = result.extensions
+        if self.batch:
+            response["id"] = id_
+            response["status"] = status_code
+        return response, status_code
+
+    def get_trace(self, request, data):
+        requested = (
+            getattr(settings, "GRAPHQL_TRACING", False)
+            and bool(self.get_extensions(request, data).get("tracing"))
+            and is_internal(request)
+        )
+        if requested or getattr(settings, "GRAPHQL_METRICS", False):
+            return Trace(requested)
+        return None
+
+    @staticmethod
+    def finish_trace(trace, result):
+        if trace is None or result is None:
+            return
+        trace.finish()
+        if getattr(settings, "GRAPHQL_METRICS", False):
+            cost = result.extensions.get("cost", {}).get("requestedQueryCost")
+            get_metrics().observe(trace, bool(result.errors), cost)
+        if trace.requested:
+            result.extensions["tracing"] = trace.as_extension()
+
+    def get_middleware(self, request):
+        middleware = super().get_middleware(request)
+        trace = get_trace()
+        # Fields are timed for the response's trace only
+        if trace is None or not trace.requested:
+            return middleware
+        # Not wrapping every value in a Promise, the tracing waits for those
+        # resolvers return only
+        return MiddlewareManager(
+            *(middleware or []), TracingMiddleware(trace), wrap_in_promise=False
+        )
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id_ = self.get_graphql_params(request, data)
+        with use_trace(self.get_trace(request, data)) as trace:
+            result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        self.finish_trace(trace, result)
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+        if result is None:
+            return None, 200
+        if result.errors:
+            set_rollback()
+        response, status_code = self.format_result(result, id_)
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+    # The signature of graphene-django's view
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):  # pylint: disable=too-many-arguments
+        try:
+            document, query_cost, result = self.prepare_execution(
+                request, data, query, variables, operation_name
+            )
+        except HttpError:
+            if show_graphiql:
+                return None
+            raise
+        if result is not None:
+            return result
+
+        cache_key = self.get_response_cache_key(
+            request, document, variables, operation_name
+        )
+        if cache_key is not None:
+            cached = get_response_cache().get(cache_key)
+            if cached is not None:
+                return self.add_query_cost(ExecutionResult(data=cached), query_cost)
+
+        fan_out = self.get_fan_out(document, operation_name)
+        options = {}
+        if fan_out is not None:
+            options["executor"] = FanOutExecutor(fan_out)
+        elif self.executor:
+            options["executor"] = self.executor
+        try:
+            with use_fan_out(fan_out):
+                result = self.execute_document(
+                    request, document, variables, operation_name, **options
+                )
+        except Exception as ex:  # pylint: disable=broad-except
+            result = ExecutionResult(errors=[ex], invalid=True)
+        if cache_key is not None and not result.errors and not result.invalid:
+            get_response_cache().set(
+                cache_key,
+                result.data,
+                getattr(settings, "GRAPHQL_RESPONSE_CACHE_TIMEOUT", 300),
+            )
+        return self.add_query_cost(result, query_cost)
+
+
+class AsyncGraphQLView(GraphQLView):
+    """
+    GraphQLView handling requests on the event loop of an ASGI server.
+
+    Resolvers and data loaders hand their database work to the thread pool
+    of graphql_api.thread_pool and the loop serves other requests meanwhile,
+    so concurrent requests share GRAPHQL_ASYNC_THREADS threads instead of
+    holding one each. Only queries are supported, the schema has no
+    mutations.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        super().as_view(**initkwargs)  # Validates initkwargs
+
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.async_dispatch(request, *args, **kwargs)
+
+        view.view_class = cls
+        view.view_initkwargs = initkwargs
+        # Like GraphQLView in urls.py, csrf_exempt() would hide the coroutine
+        # function from Django 4.0
+        view.csrf_exempt = True
+        return view
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["GET", "POST"], "GraphQL only supports GET and POST requests."
+                    )
+                )
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                return await run_sync(self.dispatch, request, *args, **kwargs)
+
+            if self.batch:
+                responses = [
+                    await self.get_async_response(request, entry) for entry in data
+                ]
+                result = f"[{','.join(response[0] for response in responses)}]"
+                status_code = max((response[1] for response in responses), default=200)
+            else:
+                result, status_code = await self.get_async_response(request, data)
+            # Encoded already, JsonResponse would encode it again
+            return HttpResponse(  # pylint: disable=http-response-with-content-type-json
+                status=status_code, content=result, content_type="application/json"
+            )
+        except HttpError as ex:
+            response = ex.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(ex)]}
+            )
+            return response
+
+    async def get_async_response(self, request, data):
+        query, variables, operation_name, id_ = self.get_graphql_params(request, data)
+        # May read the user from the session
+        trace = await run_sync(self.get_trace, request, data)
+        with use_trace(trace):
+            result = await self.execute_async_graphql_request(
+                request, data, query, variables, operation_name
+            )
+        self.finish_trace(trace, result)
+        response, status_code = self.format_result(result, id_)
+        return self.json_encode(request, response), status_code
+
+    async def execute_async_graphql_request(
+        self, request, data, query, variables, operation_name
+    ):  # pylint: disable=too-many-arguments
+        document, query_cost, result = self.prepare_execution(
+            request, data, query, variables, operation_name
+        )
+        if result is not None:
+            return result
+
+        # Reads model versions and maybe the session
+        cache_key = await run_sync(
+            self.get_response_cache_key, request, document, variables, operation_name
+        )
+        if cache_key is not None:
+            cached = await get_response_cache().aget(cache_key)
+            if cached is not None:
+                return self.add_query_cost(ExecutionResult(data=cached), query_cost)
+
+        loop = asyncio.get_running_loop()
+        try:
+            with use_fan_out(self.get_fan_out(document, operation_name, loop)):
+                result = self.execute_document(
+                    request,
+                    document,
+                    variables,
+                    operation_name,
+                    executor=AsyncioExecutor(loop=loop),
+                    return_promise=True,
+                )
+                # Invalid documents give their result right away
+                if isinstance(result, Promise):
+                    result = await result
+        except GraphQLError as ex:
+            # Other errors are bugs, left to the server to answer with a 500
+            return ExecutionResult(errors=[ex], invalid=True)
+
+        if cache_key is not None and not result.errors and not result.invalid:
+            await get_response_cache().aset(
+                cache_key,
+                result.data,
+                getattr(settings, "GRAPHQL_RESPONSE_CACHE_TIMEOUT", 300),
+            )
+        return self.add_query_cost(result, query_cost)
+
+
+def is_internal(request) -> bool:
+    """
+    Tells whether a request comes from a staff user, or from a service sending
+    GRAPHQL_INTERNAL_TOKEN as `Authorization: Bearer <token>`.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    token = getattr(settings, "GRAPHQL_INTERNAL_TOKEN", None)
+    return bool(token) and constant_time_compare(
+        request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {token}"
+    )
+
+
+def metrics(request):
+    """
+    Serves the GraphQL metrics of this process in the Prometheus text format,
+    to internal callers only, see is_internal().
+    """
+    if not is_internal(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        get_metrics().render(), content_type="text/plain; version=0.0.4"
+    )
@@ -35,9 +35,11 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "graphene_django",
     "core.customer",
     "core.catalogue",
+    "graphql_api",
 ]
 
 MIDDLEWARE = [
@@ -84,6 +86,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Use django.core.cache.backends.redis.RedisCache to share the cache
+# between workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -123,3 +136,86 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Catalogue
+# Product search backend: PostgresSearchBackend requires PostgreSQL with
+# pg_trgm, InMemorySearchBackend keeps an index in every process and suits
+# tests and small catalogues.
+
+CATALOGUE_SEARCH_BACKEND = "core.catalogue.search.postgres.PostgresSearchBackend"
+
+# The category tree, attribute schemas and in-memory search index are kept in
+# every process and learn of writes in other processes through the default
+# cache, which should be shared by all of them, `manage.py check --deploy`
+# warns when it is not. They are rebuilt at least every
+# CATALOGUE_LOCAL_CACHE_TIMEOUT seconds anyway, None keeps them until a write.
+
+CATALOGUE_LOCAL_CACHE_TIMEOUT = 60
+
+# Keep a denormalized ProductDocument per product and serve GraphQL products
+# from it. Run the rebuild_product_documents command after enabling it.
+
+CATALOGUE_PRODUCT_DOCUMENTS = False
+
+# GraphQL
+# Page size used by connection fields when `first` is omitted, and the upper
+# bound a client can ask for.
+
+GRAPHQL_DEFAULT_PAGE_SIZE = 20
+
+GRAPHQL_MAX_PAGE_SIZE = 100
+
+# Number of parsed and validated GraphQL documents kept in memory.
+
+GRAPHQL_DOCUMENT_CACHE_SIZE = 512
+
+# Path to a JSON file with the persisted queries clients may run, either a list
+# of query strings or a {sha256: query} mapping. When set, any other query is
+# rejected.
+
+GRAPHQL_PERSISTED_QUERIES_ALLOWLIST = None
+
+# Cache alias storing GraphQL query responses, None disables the response
+# cache. Entries expire after GRAPHQL_RESPONSE_CACHE_TIMEOUT seconds at the
+# latest, catalogue writes expire them right away.
+
+GRAPHQL_RESPONSE_CACHE_ALIAS = "default"
+
+GRAPHQL_RESPONSE_CACHE_TIMEOUT = 300
+
+# Threads running the database queries of the async GraphQL endpoint, and of
+# the sync one when its fields are resolved concurrently. Each keeps its own
+# database connection for as long as it lives, so the database must accept
+# GRAPHQL_ASYNC_THREADS connections per process on top of the request threads.
+
+GRAPHQL_ASYNC_THREADS = 8
+
+# Database calls a single GraphQL query may run at once, e.g. its root fields.
+# 1 resolves the fields of sync requests one after another on the request
+# thread, as a mutation always is. Above 1, they run on the threads of
+# GRAPHQL_ASYNC_THREADS.
+
+GRAPHQL_MAX_FAN_OUT = 1
+
+# Queries are rejected before they run when they would resolve more objects
+# than GRAPHQL_MAX_QUERY_COST, as estimated from page sizes and from
+# GRAPHQL_QUERY_COST_LIST_SIZE items per other list, or nest fields deeper
+# than GRAPHQL_MAX_QUERY_DEPTH. None disables either limit.
+
+GRAPHQL_MAX_QUERY_COST = 10000
+
+GRAPHQL_MAX_QUERY_DEPTH = 10
+
+GRAPHQL_QUERY_COST_LIST_SIZE = 10
+
+# GRAPHQL_METRICS times every GraphQL request and counts the SQL queries of
+# each data loader, served at /metrics to staff users and to callers sending
+# GRAPHQL_INTERNAL_TOKEN as `Authorization: Bearer <token>`. With
+# GRAPHQL_TRACING, such callers sending `extensions: {"tracing": true}` get
+# the timings of every field in the response, which the metrics then include.
+
+GRAPHQL_METRICS = True
+
+GRAPHQL_TRACING = False
+
+GRAPHQL_INTERNAL_TOKEN = None
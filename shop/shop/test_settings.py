@@ -0,0 +1,21 @@
+"""
+Settings for the test suite, e.g. `python manage.py test --settings=shop.test_settings`.
+
+SQLite stands in for PostgreSQL, set TEST_DATABASE=postgresql to run against
+the database of shop.settings instead. Tests needing PostgreSQL, e.g. of
+the COPY import, are skipped on SQLite. Product search runs on the
+in-memory backend, which works on either database.
+"""
+import os
+
+from shop.settings import *  # noqa: F401,F403 pylint: disable=wildcard-import,unused-wildcard-import
+
+if os.environ.get("TEST_DATABASE") != "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        }
+    }
+
+CATALOGUE_SEARCH_BACKEND = "core.catalogue.search.memory.InMemorySearchBackend"
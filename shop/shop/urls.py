@@ -14,12 +14,21 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+from core.catalogue.views import export_catalogue
 from graphql_api.schema import schema
+from graphql_api.views import AsyncGraphQLView, GraphQLView, metrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema))),
+    # For ASGI servers, GraphQLView holds a worker thread per request
+    path("graphql/async", AsyncGraphQLView.as_view(graphiql=True, schema=schema)),
+    path("metrics", metrics, name="metrics"),
+    re_path(
+        r"^catalogue/export\.(?P<export_format>csv|jsonl)$",
+        export_catalogue,
+        name="catalogue-export",
+    ),
 ]